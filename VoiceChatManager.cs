@@ -18,6 +18,11 @@ public class VoiceChatManager : MonoBehaviour
     [Header("Audio Settings")]
     [SerializeField] private int recordingSampleRate = 48000;
     [SerializeField] private int maxRecordingSeconds = 30;
+    [SerializeField] private bool streamResponses = true; // receive reply as sentence segments
+    [SerializeField] private bool incrementalStt = false; // stream raw PCM while recording so the server transcribes as we speak
+    [SerializeField] private bool serverEndpointing = false; // let the server end the turn on silence (needs incrementalStt)
+    [SerializeField] private bool pushAudio = true; // receive reply audio as binary socket frames instead of downloading WAVs
+    [SerializeField] private int pushSampleRate = 16000; // sample rate of the pushed 16-bit PCM
 
     private SocketIOUnity socket;
     private AudioClip recordingClip;
@@ -27,6 +32,12 @@ public class VoiceChatManager : MonoBehaviour
     // private int recordingStartPosition = 0;
     private int lastProcessedPosition = 0;
     private List<float> accumulatedSamples = new List<float>();
+    private int sentSampleCount = 0; // samples already streamed as PCM (incremental STT)
+
+    // Streamed reply segments (a URL to download, or a clip built from pushed PCM), played strictly in index order
+    private SortedDictionary<int, (string url, AudioClip clip)> pendingSegments = new SortedDictionary<int, (string url, AudioClip clip)>();
+    private int nextSegmentIndex = 0;
+    private bool segmentPlayerRunning = false;
 
     public static event Action<string> OnStatusUpdate;
     public static event Action<string> OnTranscriptReceived;
@@ -68,6 +79,8 @@ public class VoiceChatManager : MonoBehaviour
         if (isRecording && Microphone.IsRecording(null))
         {
             CaptureAudioData();
+            if (incrementalStt)
+                SendPendingPcm();
         }
 
         // Handle spacebar for push-to-talk
@@ -130,6 +143,9 @@ public class VoiceChatManager : MonoBehaviour
             socket.OnUnityThread("transcript", OnTranscriptMessage);
             socket.OnUnityThread("response_text", OnResponseTextMessage);
             socket.OnUnityThread("audio_ready", OnAudioReadyMessage);
+            socket.OnUnityThread("audio_segment", OnAudioSegmentMessage);
+            socket.OnUnityThread("audio_complete", OnAudioCompleteMessage);
+            socket.OnUnityThread("endpoint", OnEndpointMessage);
 
             socket.Connect();
             OnStatusUpdate?.Invoke("Connecting to server...");
@@ -196,7 +212,13 @@ public class VoiceChatManager : MonoBehaviour
             var json = JObject.Parse(jsonText);
             string audioUrl = json["audio_url"]?.Value<string>();
 
-            if (!string.IsNullOrEmpty(audioUrl))
+            AudioClip pushedClip = ClipFromPushedAudio(response, json);
+            if (pushedClip != null)
+            {
+                UnityEngine.Debug.Log($"Audio pushed: {json["audio_id"]}");
+                StartCoroutine(PlayClip(pushedClip));
+            }
+            else if (!string.IsNullOrEmpty(audioUrl))
             {
                 UnityEngine.Debug.Log("Audio ready: " + audioUrl);
                 StartCoroutine(DownloadAndPlayAudio(audioUrl));
@@ -208,6 +230,55 @@ public class VoiceChatManager : MonoBehaviour
         }
     }
 
+    private void OnAudioSegmentMessage(SocketIOClient.SocketIOResponse response)
+    {
+        try
+        {
+            string jsonText = response.GetValue().GetRawText();
+            var json = JObject.Parse(jsonText);
+            int index = json["index"]?.Value<int>() ?? 0;
+            string audioUrl = json["audio_url"]?.Value<string>();
+            AudioClip pushedClip = ClipFromPushedAudio(response, json);
+
+            if (pushedClip != null || !string.IsNullOrEmpty(audioUrl))
+            {
+                pendingSegments[index] = (audioUrl, pushedClip);
+                if (!segmentPlayerRunning)
+                    StartCoroutine(PlayAudioSegments());
+            }
+        }
+        catch (Exception ex)
+        {
+            UnityEngine.Debug.LogError($"Error parsing audio segment message: {ex.Message}");
+        }
+    }
+
+    private void OnAudioCompleteMessage(SocketIOClient.SocketIOResponse response)
+    {
+        try
+        {
+            string jsonText = response.GetValue().GetRawText();
+            var json = JObject.Parse(jsonText);
+            UnityEngine.Debug.Log(
+                $"Reply complete: {json["segments"]} segments, time to first audio {json["time_to_first_audio"]}s, total {json["total_latency"]}s");
+        }
+        catch (Exception ex)
+        {
+            UnityEngine.Debug.LogError($"Error parsing audio complete message: {ex.Message}");
+        }
+    }
+
+    private void OnEndpointMessage(SocketIOClient.SocketIOResponse response)
+    {
+        // The server detected the end of speech and already started the turn
+        if (!isRecording) return;
+        CaptureAudioData();
+        SendPendingPcm();
+        isRecording = false;
+        Microphone.End(null);
+        OnStatusUpdate?.Invoke("Processing...");
+    }
+
     public void StartRecording()
     {
         if (!isConnected)
@@ -227,13 +298,27 @@ public class VoiceChatManager : MonoBehaviour
             // Clear previous recording data
             accumulatedSamples.Clear();
             lastProcessedPosition = 0;
+            sentSampleCount = 0;
 
             // Start microphone with buffer
             recordingClip = Microphone.Start(null, true, maxRecordingSeconds, recordingSampleRate);
             // recordingStartPosition = 0;
             isRecording = true;
 
-            var data = new { format = "wav" };
+            pendingSegments.Clear();
+            nextSegmentIndex = 0;
+
+            var data = new
+            {
+                format = incrementalStt ? "pcm16" : "wav",
+                sample_rate = recordingSampleRate,
+                incremental = incrementalStt,
+                endpointing = incrementalStt && serverEndpointing,
+                streaming = streamResponses,
+                audio_delivery = pushAudio ? "push" : "url",
+                audio_format = "pcm16",
+                audio_sample_rate = pushSampleRate
+            };
             socket.Emit("start_stream", data);
 
             OnStatusUpdate?.Invoke("Recording...");
@@ -255,6 +340,16 @@ public class VoiceChatManager : MonoBehaviour
             CaptureAudioData();
             isRecording = false;
             Microphone.End(null);
+
+            if (incrementalStt)
+            {
+                // Everything but the last few frames is already on the server
+                SendPendingPcm();
+                socket.Emit("stop_stream", new { });
+                OnStatusUpdate?.Invoke("Processing...");
+                return;
+            }
+
             float[] allSamples = accumulatedSamples.ToArray();
 
             if (allSamples.Length > 0)
@@ -320,6 +415,24 @@ public class VoiceChatManager : MonoBehaviour
         lastProcessedPosition = currentPosition;
     }
 
+    // Sends samples captured since the last call as 16-bit little-endian PCM
+    private void SendPendingPcm()
+    {
+        int count = accumulatedSamples.Count - sentSampleCount;
+        if (count <= 0) return;
+
+        byte[] pcmData = new byte[count * 2];
+        for (int i = 0; i < count; i++)
+        {
+            float sample = Mathf.Clamp(accumulatedSamples[sentSampleCount + i], -1.0f, 1.0f);
+            short pcmSample = (short)(sample * 32767f);
+            pcmData[i * 2] = (byte)(pcmSample & 0xFF);
+            pcmData[i * 2 + 1] = (byte)((pcmSample >> 8) & 0xFF);
+        }
+        sentSampleCount += count;
+        socket.Emit("message", pcmData);
+    }
+
     private byte[] CreateWAVFile(float[] samples, int sampleRate)
     {
         byte[] pcmData = new byte[samples.Length * 2];
@@ -362,6 +475,47 @@ public class VoiceChatManager : MonoBehaviour
         }
     }
 
+    // Builds a clip from audio pushed as a binary attachment (16-bit PCM), or returns null
+    private AudioClip ClipFromPushedAudio(SocketIOClient.SocketIOResponse response, JObject json)
+    {
+        if (response.InBytes == null || response.InBytes.Count == 0)
+            return null;
+        if (json["format"]?.Value<string>() != "pcm16")
+        {
+            UnityEngine.Debug.LogError($"Unsupported pushed audio format: {json["format"]}");
+            return null;
+        }
+
+        byte[] pcm = response.InBytes[0];
+        int sampleRate = json["sample_rate"]?.Value<int>() ?? pushSampleRate;
+        float[] samples = new float[pcm.Length / 2];
+        for (int i = 0; i < samples.Length; i++)
+            samples[i] = BitConverter.ToInt16(pcm, i * 2) / 32768f;
+
+        AudioClip clip = AudioClip.Create("reply", samples.Length, 1, sampleRate, false);
+        clip.SetData(samples, 0);
+        return clip;
+    }
+
+    private IEnumerator PlayClip(AudioClip audioClip)
+    {
+        OnAudioResponseReceived?.Invoke(audioClip);
+
+        AudioSource audioSource = GetComponent<AudioSource>();
+        if (audioSource == null)
+            audioSource = gameObject.AddComponent<AudioSource>();
+
+        audioSource.clip = audioClip;
+        audioSource.Play();
+
+        OnStatusUpdate?.Invoke("Agent speaking...");
+        UnityEngine.Debug.Log($"Playing audio, duration: {audioClip.length:F2}s");
+
+        yield return new WaitForSeconds(audioClip.length);
+
+        OnStatusUpdate?.Invoke("Ready - Hold button to speak");
+    }
+
     private IEnumerator DownloadAndPlayAudio(string audioUrl)
     {
         OnStatusUpdate?.Invoke("Downloading audio...");
@@ -373,21 +527,7 @@ public class VoiceChatManager : MonoBehaviour
             if (www.result == UnityWebRequest.Result.Success)
             {
                 AudioClip audioClip = DownloadHandlerAudioClip.GetContent(www);
-                OnAudioResponseReceived?.Invoke(audioClip);
-
-                AudioSource audioSource = GetComponent<AudioSource>();
-                if (audioSource == null)
-                    audioSource = gameObject.AddComponent<AudioSource>();
-
-                audioSource.clip = audioClip;
-                audioSource.Play();
-
-                OnStatusUpdate?.Invoke("Agent speaking...");
-                UnityEngine.Debug.Log($"Playing audio, duration: {audioClip.length:F2}s");
-
-                yield return new WaitForSeconds(audioClip.length);
-
-                OnStatusUpdate?.Invoke("Ready - Hold button to speak");
+                yield return PlayClip(audioClip);
             }
             else
             {
@@ -396,4 +536,53 @@ public class VoiceChatManager : MonoBehaviour
             }
         }
     }
+
+    private IEnumerator PlayAudioSegments()
+    {
+        segmentPlayerRunning = true;
+        AudioSource audioSource = GetComponent<AudioSource>();
+        if (audioSource == null)
+            audioSource = gameObject.AddComponent<AudioSource>();
+
+        while (pendingSegments.ContainsKey(nextSegmentIndex))
+        {
+            var (audioUrl, audioClip) = pendingSegments[nextSegmentIndex];
+            pendingSegments.Remove(nextSegmentIndex);
+            nextSegmentIndex++;
+
+            if (audioClip == null)
+            {
+                using (UnityWebRequest www = UnityWebRequestMultimedia.GetAudioClip(audioUrl, AudioType.WAV))
+                {
+                    yield return www.SendWebRequest();
+
+                    if (www.result != UnityWebRequest.Result.Success)
+                    {
+                        UnityEngine.Debug.LogError($"Failed to download audio segment: {www.error}");
+                        continue;
+                    }
+
+                    audioClip = DownloadHandlerAudioClip.GetContent(www);
+                }
+            }
+            OnAudioResponseReceived?.Invoke(audioClip);
+
+            // Wait for the previous segment to finish before starting the next
+            while (audioSource.isPlaying)
+                yield return null;
+
+            audioSource.clip = audioClip;
+            audioSource.Play();
+            OnStatusUpdate?.Invoke("Agent speaking...");
+        }
+
+        while (audioSource.isPlaying)
+            yield return null;
+
+        segmentPlayerRunning = false;
+        if (pendingSegments.ContainsKey(nextSegmentIndex))
+            StartCoroutine(PlayAudioSegments());
+        else
+            OnStatusUpdate?.Invoke("Ready - Hold button to speak");
+    }
 }
\ No newline at end of file
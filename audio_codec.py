@@ -0,0 +1,109 @@
+import io
+import wave
+import shutil
+import subprocess
+
+from startup import LazyModule
+
+np = LazyModule('numpy')
+
+# =================================================================
+# Audio encoding for pushed replies
+# =================================================================
+# Reply audio can be pushed to the client over the socket instead of being
+# downloaded from /audio. The client picks the encoding:
+#   'opus'  - Ogg/Opus (browsers decode it natively); needs ffmpeg on PATH
+#   'pcm16' - raw 16-bit little-endian mono PCM at the client's sample rate
+#             (Unity builds an AudioClip from it without any decoder)
+#   'wav'   - the PCM with a WAV header
+# Opus falls back to 'pcm16' when ffmpeg is not available.
+
+PUSH_FORMATS = ('opus', 'pcm16', 'wav')
+MIN_SAMPLE_RATE = 8000      # sample rates a client may name, for its recordings or pushed PCM
+MAX_SAMPLE_RATE = 192000
+FILTER_TAPS = 31
+
+
+# Whether ffmpeg is on PATH (Ogg/Opus encoding, compressed recording decoding)
+def ffmpeg_available(ffmpeg_path: str = 'ffmpeg'):
+    return shutil.which(ffmpeg_path) is not None
+
+
+# A client-supplied sample rate as an int, or None when it is malformed or out of range
+def parse_sample_rate(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        sample_rate = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return sample_rate if MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE else None
+
+
+# Windowed-sinc low-pass filter taps for the given cutoff (fraction of the sample rate)
+def _lowpass_taps(cutoff: float, taps: int = FILTER_TAPS):
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return kernel / kernel.sum()
+
+
+def resample_samples(samples, from_rate: int, to_rate: int):
+    """Resample a mono sample array (low-pass first when downsampling, then linear interpolation)"""
+    samples = np.asarray(samples, dtype=np.float32)
+    if from_rate == to_rate or samples.size == 0:
+        return samples
+    if to_rate < from_rate:
+        # Keep content below the new Nyquist frequency so it does not alias
+        samples = np.convolve(samples, _lowpass_taps(0.5 * to_rate / from_rate * 0.9), mode='same')
+    out_count = int(len(samples) * to_rate / from_rate)
+    positions = np.arange(out_count) * (from_rate / to_rate)
+    return np.interp(positions, np.arange(len(samples)), samples)
+
+
+# Float samples back to 16-bit little-endian PCM bytes
+def to_pcm16(samples) -> bytes:
+    return np.clip(np.round(samples), -32768, 32767).astype('<i2').tobytes()
+
+
+def resample_pcm16(pcm: bytes, from_rate: int, to_rate: int) -> bytes:
+    """Resample 16-bit mono PCM bytes"""
+    if from_rate == to_rate or not pcm:
+        return pcm
+    samples = np.frombuffer(pcm, dtype='<i2', count=len(pcm) // 2)
+    return to_pcm16(resample_samples(samples, from_rate, to_rate))
+
+
+# Encodes 16-bit mono PCM as Ogg/Opus by piping it through ffmpeg
+def encode_ogg_opus(pcm: bytes, sample_rate: int, bitrate: str = '24k', ffmpeg_path: str = 'ffmpeg') -> bytes:
+    result = subprocess.run(
+        [ffmpeg_path, '-hide_banner', '-loglevel', 'error',
+         '-f', 's16le', '-ar', str(sample_rate), '-ac', '1', '-i', 'pipe:0',
+         '-c:a', 'libopus', '-b:a', bitrate, '-application', 'voip', '-f', 'ogg', 'pipe:1'],
+        input=pcm, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg Opus encoding failed: {result.stderr.decode(errors='replace').strip()}")
+    return result.stdout
+
+
+def encode_pcm(pcm: bytes, sample_rate: int, audio_format: str, target_rate: int = None,
+               bitrate: str = '24k', ffmpeg_path: str = 'ffmpeg') -> bytes:
+    """
+    Encode a reply clip for pushing. target_rate applies to 'pcm16' and
+    'wav' (Opus resamples internally and is always sent at its own rate).
+    """
+    if audio_format == 'opus':
+        return encode_ogg_opus(pcm, sample_rate, bitrate, ffmpeg_path)
+    if audio_format not in ('pcm16', 'wav'):
+        raise ValueError(f"Unknown push audio format: {audio_format}")
+    out_rate = target_rate or sample_rate
+    pcm = resample_pcm16(pcm, sample_rate, out_rate)
+    if audio_format == 'wav':
+        wav_io = io.BytesIO()
+        with wave.open(wav_io, "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(out_rate)
+            wf.writeframes(pcm)
+        return wav_io.getvalue()
+    return pcm
@@ -0,0 +1,175 @@
+import io
+import wave
+import subprocess
+import threading
+
+from audio_codec import ffmpeg_available, resample_samples, to_pcm16
+from incremental_stt import FRAME_MS, frame_energies
+from startup import LazyModule
+
+np = LazyModule('numpy')
+
+# =================================================================
+# Inbound audio normalization
+# =================================================================
+# Every recording passes through here before it is transcribed. Raw PCM
+# and WAV uploads (and WebM/Ogg when ffmpeg can decode them) are:
+#   1. downmixed to mono and resampled to the STT rate (16 kHz; Gemini
+#      downsamples to that anyway, so anything higher is wasted upload),
+#   2. trimmed of leading and trailing silence with an energy VAD,
+#   3. capped at a maximum duration,
+# and re-wrapped as a compact 16-bit WAV. A recording with no speech at all
+# skips STT entirely. Containers that cannot be decoded are passed through.
+# Interim windows of an incrementally transcribed recording go through the
+# same steps but are counted apart from finished recordings in the stats.
+
+
+def _wav_bytes(pcm: bytes, sample_rate: int) -> bytes:
+    wav_io = io.BytesIO()
+    with wave.open(wav_io, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes(pcm)
+    return wav_io.getvalue()
+
+
+# Decodes a PCM WAV to (mono float samples on the 16-bit scale, sample rate)
+def decode_wav(data: bytes):
+    with wave.open(io.BytesIO(data)) as wf:
+        channels, width, rate = wf.getnchannels(), wf.getsampwidth(), wf.getframerate()
+        frames = wf.readframes(wf.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) * 256
+    elif width == 2:
+        samples = np.frombuffer(frames, dtype='<i2').astype(np.float32)
+    elif width == 4:
+        samples = np.frombuffer(frames, dtype='<i4').astype(np.float32) / 65536
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {width} bytes")
+    if channels > 1:
+        samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    return samples, rate
+
+
+# Decodes a compressed recording (WebM/Ogg) to mono PCM at sample_rate with ffmpeg
+def decode_with_ffmpeg(data: bytes, sample_rate: int, ffmpeg_path: str = 'ffmpeg'):
+    result = subprocess.run(
+        [ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+         '-f', 's16le', '-ac', '1', '-ar', str(sample_rate), 'pipe:1'],
+        input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg decoding failed: {result.stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(result.stdout, dtype='<i2').astype(np.float32)
+
+
+def sniff_format(data: bytes, input_format: str = None):
+    """'pcm16', 'wav', 'ogg' or 'webm' for a recording"""
+    if input_format == 'pcm16':
+        return 'pcm16'
+    if data[:4] == b'RIFF':
+        return 'wav'
+    if data[:4] == b'OggS':
+        return 'ogg'
+    return 'webm'
+
+
+# First and last sample of detected speech, padded, or None if there is none
+def speech_bounds(samples, sample_rate: int, energy_threshold: float, pad_ms: int):
+    energies = frame_energies(samples, sample_rate)
+    voiced = np.flatnonzero(energies >= energy_threshold)
+    if voiced.size == 0:
+        return None
+    frame_len = max(1, sample_rate * FRAME_MS // 1000)
+    pad = sample_rate * pad_ms // 1000
+    start = max(0, voiced[0] * frame_len - pad)
+    end = min(len(samples), (voiced[-1] + 1) * frame_len + pad)
+    return start, end
+
+
+class AudioIngest:
+    def __init__(self, target_rate: int = 16000, max_seconds: float = 30.0, energy_threshold: float = 500.0,
+                 pad_ms: int = 200, trim: bool = True, ffmpeg_path: str = 'ffmpeg'):
+        self.target_rate = target_rate
+        self.max_seconds = max_seconds
+        self.energy_threshold = energy_threshold
+        self.pad_ms = pad_ms                  # silence kept around the speech so words are not clipped
+        self.trim = trim
+        self.ffmpeg_path = ffmpeg_path
+        self.decode_compressed = ffmpeg_available(ffmpeg_path)
+        self._lock = threading.Lock()
+        self._stats = {'recordings': 0, 'bytes_in': 0, 'bytes_out': 0, 'trimmed_seconds': 0.0,
+                       'capped': 0, 'silent': 0, 'passthrough': 0,
+                       'windows': 0, 'window_bytes_in': 0, 'window_bytes_out': 0}
+
+    def process(self, data: bytes, input_format: str = None, sample_rate: int = 16000, window: bool = False):
+        """
+        Normalize one recording (or, with window=True, an interim window of
+        one). Returns ((audio_bytes, mime_type) or None when there is no
+        speech, per-recording stats dict).
+        """
+        kind = sniff_format(data, input_format)
+        turn_stats = {'format': kind, 'bytes_in': len(data), 'bytes_out': len(data),
+                      'trimmed_seconds': 0.0, 'capped': False}
+        try:
+            if kind == 'pcm16':
+                samples = np.frombuffer(data, dtype='<i2', count=len(data) // 2).astype(np.float32)
+            elif kind == 'wav':
+                samples, sample_rate = decode_wav(data)
+            elif self.decode_compressed:
+                samples, sample_rate = decode_with_ffmpeg(data, self.target_rate, self.ffmpeg_path), self.target_rate
+            else:
+                samples = None
+        except (wave.Error, ValueError, EOFError, RuntimeError) as e:
+            print(f"Warning: Could not decode {kind} recording, sending it unchanged: {e}")
+            samples = None
+
+        if samples is None:
+            # Compressed audio we cannot decode goes to STT as recorded
+            self._record(turn_stats, window, passthrough=True)
+            return (data, f'audio/{kind}'), turn_stats
+
+        samples = resample_samples(samples, sample_rate, self.target_rate)
+        original_count = len(samples)
+        if self.trim:
+            bounds = speech_bounds(samples, self.target_rate, self.energy_threshold, self.pad_ms)
+            if bounds is None:
+                turn_stats['bytes_out'] = 0
+                turn_stats['trimmed_seconds'] = original_count / self.target_rate
+                self._record(turn_stats, window, silent=True)
+                return None, turn_stats
+            samples = samples[bounds[0]:bounds[1]]
+        max_samples = int(self.max_seconds * self.target_rate)
+        if len(samples) > max_samples:
+            samples = samples[:max_samples]
+            turn_stats['capped'] = True
+
+        wav = _wav_bytes(to_pcm16(samples), self.target_rate)
+        turn_stats['bytes_out'] = len(wav)
+        turn_stats['trimmed_seconds'] = (original_count - len(samples)) / self.target_rate
+        self._record(turn_stats, window)
+        return (wav, 'audio/wav'), turn_stats
+
+    def _record(self, turn_stats, window, silent=False, passthrough=False):
+        with self._lock:
+            if window:
+                self._stats['windows'] += 1
+                self._stats['window_bytes_in'] += turn_stats['bytes_in']
+                self._stats['window_bytes_out'] += turn_stats['bytes_out']
+                return
+            self._stats['recordings'] += 1
+            self._stats['bytes_in'] += turn_stats['bytes_in']
+            self._stats['bytes_out'] += turn_stats['bytes_out']
+            self._stats['trimmed_seconds'] += turn_stats['trimmed_seconds']
+            self._stats['capped'] += int(turn_stats['capped'])
+            self._stats['silent'] += int(silent)
+            self._stats['passthrough'] += int(passthrough)
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+        snapshot['bytes_saved'] = snapshot['bytes_in'] - snapshot['bytes_out']
+        snapshot['trimmed_seconds'] = round(snapshot['trimmed_seconds'], 2)
+        snapshot['saved_ratio'] = round(snapshot['bytes_saved'] / snapshot['bytes_in'], 4) if snapshot['bytes_in'] else 0.0
+        return snapshot
@@ -0,0 +1,212 @@
+import os
+import mmap
+import time
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+# =================================================================
+# Bounded audio store for /audio/<audio_id>
+# =================================================================
+# Rendered clips wait here until the client downloads them. The store has
+# a byte budget for memory, spills least-recently-used clips to temp files
+# once that budget is exceeded, and drops clips that were never fetched
+# after a TTL. A fetched clip stays readable for a short grace window so
+# retries and range requests still succeed.
+#
+# A clip is stored as a tuple of buffers (e.g. WAV header and PCM body) so
+# it never has to be concatenated; reads hand back the same buffers, or a
+# memory-mapped view of the spill file, without copying.
+
+
+class _Entry:
+    __slots__ = ('data', 'path', 'size', 'created_at', 'expires_at')
+
+    def __init__(self, data, size, expires_at):
+        self.data = data        # tuple of buffers while in memory, None once spilled
+        self.path = None        # temp file path once spilled to disk
+        self.size = size
+        self.created_at = time.monotonic()
+        self.expires_at = expires_at
+
+
+class AudioStore:
+    def __init__(self, max_memory_bytes: int = 64 * 1024 * 1024, max_disk_bytes: int = 512 * 1024 * 1024,
+                 ttl_seconds: float = 300, grace_seconds: float = 30, spill_dir: str = None):
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self.grace_seconds = grace_seconds
+        self.spill_dir = spill_dir      # created on the first spill (a temp dir if None)
+        self._spill_dir_ready = False
+        self._entries = OrderedDict()   # audio_id -> _Entry, least recently used first
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'puts': 0,
+            'hits': 0,
+            'misses': 0,
+            'spills': 0,
+            'expired': 0,
+            'evicted': 0,
+        }
+
+    # --- Internal helpers (call with the lock held) ---
+
+    def _remove(self, audio_id):
+        entry = self._entries.pop(audio_id)
+        if entry.path:
+            self._disk_bytes -= entry.size
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        else:
+            self._memory_bytes -= entry.size
+        return entry
+
+    # Creates the spill directory the first time a clip is spilled, so a store
+    # whose clips all fit in memory never touches the disk
+    def _ensure_spill_dir(self):
+        if self._spill_dir_ready:
+            return
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix="audio_store_")
+        else:
+            os.makedirs(self.spill_dir, exist_ok=True)
+        self._spill_dir_ready = True
+
+    def _spill(self, audio_id, entry):
+        try:
+            self._ensure_spill_dir()
+            path = os.path.join(self.spill_dir, f"{audio_id}.bin")
+            with open(path, "wb") as f:
+                for part in entry.data:
+                    f.write(part)
+        except OSError as e:
+            print(f"Warning: Could not spill audio {audio_id} to disk: {e}")
+            return False
+        entry.path = path
+        entry.data = None
+        self._memory_bytes -= entry.size
+        self._disk_bytes += entry.size
+        self._stats['spills'] += 1
+        return True
+
+    def _purge_expired(self, now):
+        expired = [audio_id for audio_id, entry in self._entries.items() if entry.expires_at <= now]
+        for audio_id in expired:
+            self._remove(audio_id)
+            self._stats['expired'] += 1
+
+    def _enforce_budgets(self):
+        # Spill the coldest in-memory clips until memory fits the budget
+        if self._memory_bytes > self.max_memory_bytes:
+            for audio_id, entry in list(self._entries.items()):
+                if self._memory_bytes <= self.max_memory_bytes:
+                    break
+                if entry.path is None and not self._spill(audio_id, entry):
+                    break
+        # Then drop the coldest clips of a tier still over its budget: spilled clips
+        # for the disk budget, in-memory ones for memory (when spilling failed)
+        if self._disk_bytes > self.max_disk_bytes:
+            self._evict_tier(True, lambda: self._disk_bytes > self.max_disk_bytes)
+        if self._memory_bytes > self.max_memory_bytes:
+            self._evict_tier(False, lambda: self._memory_bytes > self.max_memory_bytes)
+
+    def _evict_tier(self, spilled, over_budget):
+        for audio_id, entry in list(self._entries.items()):
+            if not over_budget():
+                break
+            if (entry.path is not None) == spilled:
+                self._remove(audio_id)
+                self._stats['evicted'] += 1
+
+    # --- Public API ---
+
+    def put(self, audio_id, data):
+        """Store a clip given as one buffer or a sequence of buffers"""
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            data = (data,)
+        data = tuple(data)
+        size = sum(len(part) for part in data)
+        now = time.monotonic()
+        with self._lock:
+            if audio_id in self._entries:
+                self._remove(audio_id)
+            self._entries[audio_id] = _Entry(data, size, now + self.ttl_seconds)
+            self._memory_bytes += size
+            self._stats['puts'] += 1
+            self._purge_expired(now)
+            self._enforce_budgets()
+
+    def get(self, audio_id):
+        """
+        Return the clip as a tuple of buffers, or None. The first read shortens
+        the entry's lifetime to the grace window; later reads within it still
+        succeed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(audio_id)
+            if entry is None or entry.expires_at <= now:
+                if entry is not None:
+                    self._remove(audio_id)
+                    self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(audio_id)
+            entry.expires_at = min(entry.expires_at, now + self.grace_seconds)
+            self._stats['hits'] += 1
+            if entry.data is not None:
+                return entry.data
+            path = entry.path
+
+        try:
+            with open(path, "rb") as f:
+                # The mapping outlives the file descriptor and even the file's removal
+                return (memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)),)
+        except (OSError, ValueError):
+            # Evicted between releasing the lock and opening the file
+            return None
+
+    def __contains__(self, audio_id):
+        with self._lock:
+            entry = self._entries.get(audio_id)
+            return entry is not None and entry.expires_at > time.monotonic()
+
+    def discard(self, audio_id):
+        with self._lock:
+            if audio_id in self._entries:
+                self._remove(audio_id)
+
+    def sweep(self):
+        """Drop expired clips; meant to be called periodically"""
+        with self._lock:
+            self._purge_expired(time.monotonic())
+
+    def start_sweeper(self, interval_seconds: float = 10):
+        def loop():
+            while True:
+                time.sleep(interval_seconds)
+                self.sweep()
+        threading.Thread(target=loop, name="audio-store-sweeper", daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['entries'] = len(self._entries)
+            snapshot['memory_bytes'] = self._memory_bytes
+            snapshot['disk_bytes'] = self._disk_bytes
+        return snapshot
+
+    def close(self):
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+            self._disk_bytes = 0
+            if not self._spill_dir_ready:
+                return
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
@@ -0,0 +1,77 @@
+import sys
+import time
+import argparse
+import statistics
+from io import BytesIO
+
+import server
+
+# =================================================================
+# Pipeline benchmark: three-call vs fused per-turn latency
+# =================================================================
+# Replays one recorded utterance through both pipeline modes against the
+# live Gemini API and reports per-turn latency (STT + LLM + TTS for
+# three_call, fused call + TTS for fused). Needs a valid API key.
+#
+#   python bench_pipeline.py recording.wav --turns 5 --memory 3
+
+
+def run_three_call(audio_bytes, mime_type, system_instruction):
+    transcript = server.transcribe_audio(BytesIO(audio_bytes), mime_type=mime_type)
+    reply, pcm = server.generate_response_and_tts(transcript, system_instruction)
+    return transcript, reply, pcm
+
+
+def run_fused(audio_bytes, mime_type, system_instruction):
+    transcript, reply = server.generate_fused_response(audio_bytes, mime_type, system_instruction)
+    pcm = server.synthesize_speech(reply)
+    return transcript, reply, pcm
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-turn latency of the three-call and fused pipelines.")
+    parser.add_argument("recording", help="WAV or WebM file with one spoken utterance")
+    parser.add_argument("--turns", type=int, default=5, help="turns per mode")
+    parser.add_argument("--memory", default=None, help="memory scene id to use for the system instruction")
+    args = parser.parse_args()
+
+    with open(args.recording, "rb") as f:
+        audio_bytes = f.read()
+    mime_type = 'audio/wav' if audio_bytes[:4] == b'RIFF' else 'audio/webm'
+
+    # Reuse the server's own prompt building with a throwaway session
+    server.state_store.update_session('bench', {'memory_id': args.memory, 'memory_description': None})
+    system_instruction = server.build_system_instruction('bench')
+
+    results = {}
+    for mode, run in (('three_call', run_three_call), ('fused', run_fused)):
+        latencies = []
+        for turn in range(args.turns):
+            started = time.perf_counter()
+            try:
+                transcript, reply, _ = run(audio_bytes, mime_type, system_instruction)
+            except Exception as e:
+                print(f"[{mode}] turn {turn + 1} failed: {e}")
+                continue
+            latencies.append(time.perf_counter() - started)
+            print(f"[{mode}] turn {turn + 1}: {latencies[-1]:.2f}s | '{transcript}' -> '{reply}'")
+        results[mode] = latencies
+
+    print("\nmode         turns   mean    p50     p95     min")
+    for mode, latencies in results.items():
+        if not latencies:
+            print(f"{mode:<12} 0")
+            continue
+        print(f"{mode:<12} {len(latencies):<7} {statistics.mean(latencies):<7.2f} "
+              f"{percentile(latencies, 50):<7.2f} {percentile(latencies, 95):<7.2f} {min(latencies):.2f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
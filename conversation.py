@@ -0,0 +1,199 @@
+import time
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from resilience import current_deadline
+from startup import LazyModule
+
+errors = LazyModule('google.genai.errors')
+types = LazyModule('google.genai.types')
+
+# =================================================================
+# Conversation memory and cached prompt prefixes
+# =================================================================
+# Each session keeps its recent turns verbatim and folds older turns into a
+# running summary once the history exceeds its token budget, so the prompt
+# stays roughly the same size however long the conversation runs.
+#
+# The static part of every prompt (persona + scene) can be registered with
+# the API's explicit context caching; turns then reference the cache
+# instead of re-sending and re-tokenizing the whole prefix.
+
+
+# Rough token estimate (about four characters per token for English text)
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class ConversationHistory:
+    def __init__(self, token_budget: int = 800, keep_recent_turns: int = 2):
+        self.token_budget = token_budget
+        self.keep_recent_turns = keep_recent_turns
+        self.summary = ""
+        self.turns = []   # (user_text, model_text)
+        self._lock = threading.Lock()
+
+    def _tokens(self):
+        return estimate_tokens(self.summary) + sum(
+            estimate_tokens(user_text) + estimate_tokens(model_text) for user_text, model_text in self.turns
+        )
+
+    def add_turn(self, user_text: str, model_text: str):
+        with self._lock:
+            self.turns.append((user_text, model_text))
+
+    def needs_compaction(self):
+        with self._lock:
+            return self._tokens() > self.token_budget and len(self.turns) > self.keep_recent_turns
+
+    def compact(self, summarize_fn):
+        """
+        Fold the oldest turns into the summary until the history fits the
+        budget. summarize_fn(previous_summary, turns) returns the new summary;
+        only the turns being dropped are sent, so each compaction is small.
+        """
+        with self._lock:
+            older_count = 0
+            while len(self.turns) - older_count > self.keep_recent_turns:
+                older_count += 1
+                remaining = self.turns[older_count:]
+                if estimate_tokens(self.summary) + sum(
+                        estimate_tokens(u) + estimate_tokens(m) for u, m in remaining) <= self.token_budget:
+                    break
+            older = self.turns[:older_count]
+            previous_summary = self.summary
+        if not older:
+            return
+
+        summary = summarize_fn(previous_summary, older)
+        with self._lock:
+            # Turns may have been appended meanwhile; only drop the ones summarized
+            if self.turns[:len(older)] == older:
+                self.turns = self.turns[len(older):]
+                self.summary = summary
+
+    def as_contents(self):
+        """History as API contents, oldest first (summary, then verbatim turns)"""
+        with self._lock:
+            contents = []
+            if self.summary:
+                contents.append(types.Content(role='user', parts=[types.Part(
+                    text=f"(Summary of our conversation so far: {self.summary})")]))
+                contents.append(types.Content(role='model', parts=[types.Part(text="(Understood.)")]))
+            for user_text, model_text in self.turns:
+                contents.append(types.Content(role='user', parts=[types.Part(text=user_text)]))
+                contents.append(types.Content(role='model', parts=[types.Part(text=model_text)]))
+            return contents
+
+    def clear(self):
+        with self._lock:
+            self.summary = ""
+            self.turns = []
+
+    def to_state(self):
+        """Plain-JSON form for a shared state store"""
+        with self._lock:
+            return {'token_budget': self.token_budget, 'keep_recent_turns': self.keep_recent_turns,
+                    'summary': self.summary, 'turns': [list(turn) for turn in self.turns]}
+
+    @classmethod
+    def from_state(cls, state):
+        history = cls(token_budget=state['token_budget'], keep_recent_turns=state['keep_recent_turns'])
+        history.summary = state['summary']
+        history.turns = [tuple(turn) for turn in state['turns']]
+        return history
+
+
+class PromptPrefixCache:
+    """
+    Explicit context caches for static system instructions, one per key.
+    If the API refuses to cache a prefix (e.g. it is below the model's
+    minimum cacheable size), that key falls back to inline instructions.
+
+    A cache is created outside the lock, once per key: concurrent callers
+    share the in-flight creation, waiting for it no longer than their turn's
+    deadline. A failed creation is not retried until a backoff (doubling up
+    to max_retry_seconds) has passed; until then the prefix is sent inline.
+    """
+
+    def __init__(self, create_fn, model: str, ttl_seconds: int = 3600,
+                 retry_seconds: float = 30, max_retry_seconds: float = 600):
+        self.create_fn = create_fn     # create_fn(model, config) -> CachedContent
+        self.model = model
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self.max_retry_seconds = max_retry_seconds
+        self._caches = {}              # key -> (cache name, expires_at)
+        self._creating = {}            # key -> Future of the creation in flight
+        self._failures = {}            # key -> (consecutive failures, retry_at)
+        self._unsupported = set()
+        self._lock = threading.Lock()
+
+    def get(self, key, system_instruction: str):
+        """Return a cached-content name for this prefix, or None to send it inline"""
+        now = time.monotonic()
+        with self._lock:
+            if key in self._unsupported:
+                return None
+            cached = self._caches.get(key)
+            # Refresh a minute before expiry so in-flight turns never hit a dead cache
+            if cached and cached[1] - 60 > now:
+                return cached[0]
+            failure = self._failures.get(key)
+            if failure and failure[1] > now:
+                return None
+            creating = self._creating.get(key)
+            if creating is None:
+                creating = self._creating[key] = Future()
+                leader = True
+            else:
+                leader = False
+        if leader:
+            return self._create(key, system_instruction, creating)
+        if cached and cached[1] > now:
+            return cached[0]           # still valid while another caller refreshes it
+        deadline = current_deadline.get()
+        try:
+            return creating.result(timeout=None if deadline is None else max(0.0, deadline.remaining()))
+        except FutureTimeout:
+            return None
+
+    def _create(self, key, system_instruction, creating):
+        name = None
+        try:
+            cache = self.create_fn(self.model, types.CreateCachedContentConfig(
+                system_instruction=system_instruction,
+                display_name=f"persona-{key}",
+                ttl=f"{self.ttl_seconds}s"
+            ))
+            name = cache.name
+        except errors.ClientError as e:
+            if e.code == 429:
+                self._failed(key, e)
+            else:
+                # Rejected outright (too small, unsupported model...): stop trying for this key
+                print(f"Context caching unavailable for '{key}', sending prefix inline: {e}")
+                with self._lock:
+                    self._unsupported.add(key)
+        except Exception as e:
+            self._failed(key, e)
+        else:
+            with self._lock:
+                self._caches[key] = (name, time.monotonic() + self.ttl_seconds)
+                self._failures.pop(key, None)
+        finally:
+            with self._lock:
+                self._creating.pop(key, None)
+            creating.set_result(name)
+        return name
+
+    def _failed(self, key, error):
+        with self._lock:
+            count = self._failures.get(key, (0, 0))[0] + 1
+            backoff = min(self.retry_seconds * 2 ** (count - 1), self.max_retry_seconds)
+            self._failures[key] = (count, time.monotonic() + backoff)
+        print(f"Warning: Could not create context cache for '{key}' (retrying in {backoff:.0f}s): {error}")
+
+    def invalidate(self, key):
+        with self._lock:
+            self._caches.pop(key, None)
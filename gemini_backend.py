@@ -0,0 +1,547 @@
+import io
+import json
+import time
+import wave
+import random
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager, asynccontextmanager
+
+from google.api_core.exceptions import ServiceUnavailable
+
+from resilience import queue_timing, note_queue_wait
+from startup import LazyModule
+
+np = LazyModule('numpy')
+genai = LazyModule('google.genai')
+types = LazyModule('google.genai.types')
+httpx = LazyModule('httpx')
+
+# =================================================================
+# Gemini backends
+# =================================================================
+# server.py talks to Gemini only through a backend object with three calls:
+# generate_content, generate_content_stream and create_cached_content
+# (plus connect() and probe() for the startup warm-up).
+# GenaiBackend forwards them to the real API. FakeGeminiBackend answers
+# locally with canned transcripts, replies and audio after a sampled delay,
+# and can inject 503s, so the whole server can be load-tested offline.
+# Both also offer agenerate_content/agenerate_content_stream coroutines
+# for the asyncio server (server_async.py).
+#
+# The server wraps its backend in a PooledBackend: every request first
+# takes one of GEMINI_POOL_SIZE slots (RequestSlots), and GenaiBackend's
+# HTTP pools keep as many keep-alive connections. So concurrent STT, LLM
+# and TTS calls from many sessions reuse warm connections, and when all are
+# busy a request queues for the next free one instead of opening another.
+#
+#   GEMINI_BACKEND=fake FAKE_GEMINI_LATENCY_LLM=lognormal:800,0.4 python server.py
+
+
+class GenaiBackend:
+    """
+    The real Gemini API through google-genai. The client is created once, on
+    first use (normally by the startup warm-up, see connect()), under a lock.
+    Its sync and async HTTP clients each keep up to pool_size keep-alive
+    connections, idle for at most keepalive_seconds; every request times out
+    after timeout_seconds (google-genai sends none by default).
+    """
+
+    def __init__(self, pool_size: int = 16, keepalive_seconds: float = 60, timeout_seconds: float = 60):
+        self.pool_size = pool_size
+        self.keepalive_seconds = keepalive_seconds
+        self.timeout_seconds = timeout_seconds
+        self.client = None
+        self._client_lock = threading.Lock()
+        self._stats = {'requests': 0, 'connections_opened': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    # httpx event hooks: count requests, and ask httpcore to report (through
+    # the trace extension) when a request has to open a new connection
+    def _trace(self, event, info):
+        if event == 'connection.connect_tcp.complete':
+            self._count('connections_opened')
+
+    async def _atrace(self, event, info):
+        self._trace(event, info)
+
+    def _on_request(self, request):
+        self._count('requests')
+        request.extensions['trace'] = self._trace
+
+    async def _aon_request(self, request):
+        self._count('requests')
+        request.extensions['trace'] = self._atrace
+
+    def _make_client(self):
+        limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size,
+                              keepalive_expiry=self.keepalive_seconds)
+        timeout = httpx.Timeout(self.timeout_seconds)
+        return genai.Client(http_options=types.HttpOptions(
+            timeout=int(self.timeout_seconds * 1000),   # per request (ms); overrides the httpx client's
+            httpx_client=httpx.Client(limits=limits, timeout=timeout,
+                                      event_hooks={'request': [self._on_request]}),
+            httpx_async_client=httpx.AsyncClient(limits=limits, timeout=timeout,
+                                                 event_hooks={'request': [self._aon_request]})
+        ))
+
+    def _client(self):
+        client = self.client
+        if client is None:
+            with self._client_lock:
+                # Another thread may have created it while this one waited
+                if self.client is None:
+                    try:
+                        # self.client = genai.Client(api_key=API_KEY)
+                        self.client = self._make_client()
+                    except Exception as e:
+                        raise Exception(f"Gemini Client not initialized: {e}") from e
+                    print(f"Gemini Client initialized successfully (pool of {self.pool_size} connections).")
+                client = self.client
+        return client
+
+    def connection_stats(self):
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot['reused_ratio'] = (round(1 - snapshot['connections_opened'] / snapshot['requests'], 3)
+                                    if snapshot['requests'] else None)
+        return snapshot
+
+    def connect(self):
+        """Creates the client now, so a missing API key fails the warm-up instead of a turn"""
+        self._client()
+
+    def probe(self, model):
+        """Cheap metadata call: checks the model is usable and leaves a warm connection"""
+        return self._client().models.get(model=model)
+
+    async def aprobe(self, model):
+        """probe() through the async client, whose connections are separate"""
+        return await self._client().aio.models.get(model=model)
+
+    def generate_content(self, model, contents, config=None):
+        return self._client().models.generate_content(model=model, contents=contents, config=config)
+
+    def generate_content_stream(self, model, contents, config=None):
+        return self._client().models.generate_content_stream(model=model, contents=contents, config=config)
+
+    def create_cached_content(self, model, config):
+        return self._client().caches.create(model=model, config=config)
+
+    async def agenerate_content(self, model, contents, config=None):
+        return await self._client().aio.models.generate_content(model=model, contents=contents, config=config)
+
+    async def agenerate_content_stream(self, model, contents, config=None):
+        stream = await self._client().aio.models.generate_content_stream(model=model, contents=contents, config=config)
+        async for chunk in stream:
+            yield chunk
+
+
+# --- Request slots ---
+
+class PoolTimeout(Exception):
+    """No Gemini request slot came free within the acquire timeout"""
+
+
+class RequestSlots:
+    """
+    At most `size` Gemini requests in flight, one per pooled connection.
+    Requests wait for a free slot in arrival order; threads (acquire) and
+    coroutines (aacquire) share the same slots. Tracks how long requests
+    waited and how busy the slots were.
+    """
+
+    def __init__(self, size: int, acquire_timeout: float = 10.0, on_wait=None):
+        self.size = size
+        self.acquire_timeout = acquire_timeout
+        self.on_wait = on_wait                # called with each acquire's wait in seconds (e.g. a histogram)
+        self._in_use = 0
+        self._waiters = deque()               # a Future per waiting request, resolved when it gets a slot
+        self._lock = threading.Lock()
+        self._started = self._changed = time.monotonic()
+        self._busy_seconds = 0.0              # slot-seconds in use since start, for the mean utilization
+        self._waits = deque(maxlen=1000)      # recent acquire waits in seconds
+        self._stats = {'acquired': 0, 'waited': 0, 'timeouts': 0, 'peak_in_use': 0}
+
+    def _set_in_use(self, in_use):
+        now = time.monotonic()
+        self._busy_seconds += self._in_use * (now - self._changed)
+        self._changed = now
+        self._in_use = in_use
+        self._stats['peak_in_use'] = max(self._stats['peak_in_use'], in_use)
+
+    # A free slot (None), or a Future to wait on; called with the lock held
+    def _take(self):
+        if self._in_use < self.size and not self._waiters:
+            self._set_in_use(self._in_use + 1)
+            return None
+        waiter = Future()
+        self._waiters.append(waiter)
+        return waiter
+
+    # Marks the calling request (see resilience.QueueTiming) as queued for a slot
+    @staticmethod
+    def _queued():
+        timing = queue_timing.get()
+        if timing is not None:
+            timing.waiting = True
+
+    def _acquired(self, started, waited):
+        seconds = time.monotonic() - started
+        timing = queue_timing.get()
+        if timing is not None:
+            timing.waiting = False
+        note_queue_wait(seconds)
+        with self._lock:
+            self._stats['acquired'] += 1
+            self._stats['waited'] += int(waited)
+            self._waits.append(seconds)
+        if self.on_wait is not None:
+            self.on_wait(seconds)
+
+    def _timed_out(self):
+        timing = queue_timing.get()
+        if timing is not None:
+            timing.waiting = False
+        with self._lock:
+            self._stats['timeouts'] += 1
+        return PoolTimeout(f"No Gemini connection free within {self.acquire_timeout}s ({self.size} in use)")
+
+    def acquire(self):
+        started = time.monotonic()
+        with self._lock:
+            waiter = self._take()
+        if waiter is not None:
+            self._queued()
+            try:
+                waiter.result(timeout=self.acquire_timeout)
+            except TimeoutError:
+                # cancel() fails if release() handed this waiter a slot just now: then it is ours
+                if waiter.cancel():
+                    raise self._timed_out()
+        self._acquired(started, waiter is not None)
+
+    async def aacquire(self):
+        started = time.monotonic()
+        with self._lock:
+            waiter = self._take()
+        if waiter is not None:
+            self._queued()
+            try:
+                await asyncio.wait_for(asyncio.wrap_future(waiter), self.acquire_timeout)
+            except TimeoutError:
+                if waiter.cancel():
+                    raise self._timed_out()
+            except asyncio.CancelledError:
+                if not waiter.cancel():
+                    self.release()   # handed a slot as the caller gave up: pass it on
+                raise
+        self._acquired(started, waiter is not None)
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                # Waiters that timed out or were cancelled are skipped
+                if waiter.set_running_or_notify_cancel():
+                    waiter.set_result(None)
+                    return   # the slot goes straight to the next waiter
+            self._set_in_use(self._in_use - 1)
+
+    @contextmanager
+    def hold(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def ahold(self):
+        await self.aacquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            self._set_in_use(self._in_use)   # bring the busy time up to now
+            snapshot = dict(self._stats)
+            snapshot['size'] = self.size
+            snapshot['in_use'] = self._in_use
+            snapshot['waiting'] = sum(1 for waiter in self._waiters if not waiter.done())
+            elapsed = time.monotonic() - self._started
+            snapshot['utilization'] = round(self._in_use / self.size, 3)
+            snapshot['mean_utilization'] = round(self._busy_seconds / (self.size * elapsed), 3) if elapsed else 0.0
+            waits = sorted(self._waits)
+        for name, pct in (('p50', 50), ('p95', 95), ('p99', 99)):
+            snapshot[f'wait_{name}_ms'] = (round(waits[min(len(waits) - 1, int(pct / 100 * len(waits)))] * 1000, 2)
+                                           if waits else None)
+        snapshot['wait_max_ms'] = round(waits[-1] * 1000, 2) if waits else None
+        return snapshot
+
+
+class PooledBackend:
+    """
+    Runs every request of the wrapped backend in a RequestSlots slot. A
+    stream keeps its slot until it has been read to the end (or closed).
+    Anything else (connect, stats...) goes straight to the wrapped backend.
+    """
+
+    def __init__(self, backend, slots: RequestSlots):
+        self.backend = backend
+        self.slots = slots
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def generate_content(self, model, contents, config=None):
+        with self.slots.hold():
+            return self.backend.generate_content(model, contents, config)
+
+    def generate_content_stream(self, model, contents, config=None):
+        with self.slots.hold():
+            yield from self.backend.generate_content_stream(model, contents, config)
+
+    def create_cached_content(self, model, config):
+        with self.slots.hold():
+            return self.backend.create_cached_content(model, config)
+
+    def probe(self, model):
+        with self.slots.hold():
+            return self.backend.probe(model)
+
+    async def agenerate_content(self, model, contents, config=None):
+        async with self.slots.ahold():
+            return await self.backend.agenerate_content(model, contents, config)
+
+    async def agenerate_content_stream(self, model, contents, config=None):
+        async with self.slots.ahold():
+            async for chunk in self.backend.agenerate_content_stream(model, contents, config):
+                yield chunk
+
+    async def aprobe(self, model):
+        async with self.slots.ahold():
+            return await self.backend.aprobe(model)
+
+
+# --- Fake backend ---
+
+# Parses a latency spec in milliseconds into a sampler returning seconds:
+# "fixed:300", "uniform:200,600", "normal:500,100" or "lognormal:800,0.4"
+# (lognormal takes the median and the sigma of the underlying normal)
+def parse_latency(spec: str):
+    kind, _, params = spec.partition(':')
+    values = [float(value) for value in params.split(',')] if params else []
+    try:
+        if kind == 'fixed':
+            return lambda rng: values[0] / 1000
+        if kind == 'uniform':
+            return lambda rng: rng.uniform(values[0], values[1]) / 1000
+        if kind == 'normal':
+            return lambda rng: max(0.0, rng.gauss(values[0], values[1])) / 1000
+        if kind == 'lognormal':
+            return lambda rng: values[0] * rng.lognormvariate(0, values[1]) / 1000
+    except IndexError:
+        pass
+    raise ValueError(f"Invalid latency spec: {spec!r}")
+
+
+# Parses "model=factor[@start-end],..." into {model: (factor, start, end)}: the
+# model's latencies are multiplied by factor, only between start and end seconds
+# after startup when a window is given (to rehearse a slowdown and its recovery)
+def parse_model_slowdowns(spec: str):
+    slowdowns = {}
+    for item in filter(None, (item.strip() for item in spec.split(','))):
+        try:
+            model, _, rest = item.partition('=')
+            factor, _, window = rest.partition('@')
+            start, _, end = window.partition('-') if window else ('0', '', '')
+            slowdowns[model] = (float(factor), float(start), float(end) if end else float('inf'))
+        except ValueError:
+            raise ValueError(f"Invalid model slowdown: {item!r}")
+    return slowdowns
+
+
+# Reads canned audio as 16-bit mono PCM (a WAV file, or raw PCM otherwise)
+def load_canned_audio(path: str):
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != b'RIFF':
+        return data
+    with wave.open(io.BytesIO(data)) as wf:
+        return wf.readframes(wf.getnframes())
+
+
+FAKE_TRANSCRIPTS = [
+    "Where am I?",
+    "Who are you?",
+    "I don't remember this place.",
+    "What happened to me?",
+]
+
+FAKE_REPLIES = [
+    "You are safe here, Vincent. Take a slow breath with me.",
+    "It's me, Owen. I've been waiting for you. Look around, take your time.",
+    "Those lights mean something to you. What do you feel when you see them?",
+    "You're doing well. Stay with this memory a little longer.",
+]
+
+
+class FakeGeminiBackend:
+    """
+    Local stand-in for the Gemini API. Each call sleeps for a latency drawn
+    from its stage's distribution ('stt', 'llm', 'fused', 'tts'), fails with
+    a 503 at error_rate, and returns canned text or audio. model_slowdowns
+    (see parse_model_slowdowns) makes individual models slower.
+    """
+
+    def __init__(self, latencies=None, error_rate: float = 0.0, seed=None, audio_pcm: bytes = None,
+                 sample_rate: int = 24000, speech_chars_per_second: float = 15.0, model_slowdowns: dict = None):
+        default = parse_latency("fixed:0")
+        self.latencies = {stage: default for stage in ('stt', 'llm', 'fused', 'tts', 'cache')}
+        self.latencies.update(latencies or {})
+        self.error_rate = error_rate
+        self.audio_pcm = audio_pcm            # canned TTS audio; synthesized per reply when None
+        self.sample_rate = sample_rate
+        self.speech_chars_per_second = speech_chars_per_second
+        self.model_slowdowns = model_slowdowns or {}
+        self._started = time.monotonic()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counter = 0
+        self.stats = {stage: 0 for stage in self.latencies}
+        self.stats['injected_errors'] = 0
+        self.stats['probes'] = 0
+
+    # Which pipeline stage a request belongs to
+    def _stage(self, contents, config):
+        if config is not None and config.response_modalities and "AUDIO" in config.response_modalities:
+            return 'tts'
+        if config is not None and config.response_mime_type == "application/json":
+            return 'fused'
+        for item in contents:
+            parts = item.parts if isinstance(item, types.Content) else [item]
+            if any(isinstance(part, types.Part) and part.inline_data for part in parts or []):
+                return 'stt'
+        return 'llm'
+
+    # Samples the stage's latency and whether to inject a 503
+    def _draw(self, stage, model=None):
+        with self._lock:
+            self.stats[stage] += 1
+            self._counter += 1
+            delay = self.latencies[stage](self._rng)
+            if model in self.model_slowdowns:
+                factor, start, end = self.model_slowdowns[model]
+                if start <= time.monotonic() - self._started < end:
+                    delay *= factor
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.stats['injected_errors'] += 1
+            return delay, fail, self._counter
+
+    def _simulate(self, stage, model=None):
+        delay, fail, counter = self._draw(stage, model)
+        time.sleep(delay)
+        if fail:
+            raise ServiceUnavailable("Injected 503 from the fake Gemini backend")
+        return counter
+
+    async def _asimulate(self, stage, model=None):
+        delay, fail, counter = self._draw(stage, model)
+        await asyncio.sleep(delay)
+        if fail:
+            raise ServiceUnavailable("Injected 503 from the fake Gemini backend")
+        return counter
+
+    def _speech(self, text):
+        if self.audio_pcm is not None:
+            return self.audio_pcm
+        # A quiet tone as long as the text would take to say
+        duration = max(0.2, len(text) / self.speech_chars_per_second)
+        t = np.arange(int(duration * self.sample_rate)) / self.sample_rate
+        return (np.sin(2 * np.pi * 220 * t) * 2000).astype('<i2').tobytes()
+
+    @staticmethod
+    def _response(part):
+        return types.GenerateContentResponse(candidates=[
+            types.Candidate(content=types.Content(role='model', parts=[part]))
+        ])
+
+    def _answer(self, stage, counter, contents):
+        transcript = FAKE_TRANSCRIPTS[counter % len(FAKE_TRANSCRIPTS)]
+        reply = FAKE_REPLIES[counter % len(FAKE_REPLIES)]
+        if stage == 'tts':
+            text = next((item for item in contents if isinstance(item, str)), "")
+            return self._response(types.Part(inline_data=types.Blob(
+                data=self._speech(text), mime_type=f"audio/L16;codec=pcm;rate={self.sample_rate}")))
+        if stage == 'fused':
+            return self._response(types.Part(text=json.dumps({'transcript': transcript, 'reply': reply})))
+        return self._response(types.Part(text=transcript if stage == 'stt' else reply))
+
+    def generate_content(self, model, contents, config=None):
+        stage = self._stage(contents, config)
+        return self._answer(stage, self._simulate(stage, model), contents)
+
+    async def agenerate_content(self, model, contents, config=None):
+        stage = self._stage(contents, config)
+        return self._answer(stage, await self._asimulate(stage, model), contents)
+
+    def generate_content_stream(self, model, contents, config=None):
+        counter = self._simulate('llm', model)
+        reply = FAKE_REPLIES[counter % len(FAKE_REPLIES)]
+        # The sampled latency is time to first text; the rest streams in word by word
+        for word in reply.split(' '):
+            yield self._response(types.Part(text=word + ' '))
+            time.sleep(0.01)
+
+    async def agenerate_content_stream(self, model, contents, config=None):
+        counter = await self._asimulate('llm', model)
+        reply = FAKE_REPLIES[counter % len(FAKE_REPLIES)]
+        for word in reply.split(' '):
+            yield self._response(types.Part(text=word + ' '))
+            await asyncio.sleep(0.01)
+
+    def create_cached_content(self, model, config):
+        counter = self._simulate('cache')
+        return types.CachedContent(name=f"cachedContents/fake-{counter}", model=model)
+
+    def connect(self):
+        pass
+
+    # Probes answer at once and never fail: warm-up is not what the fake backend load-tests
+    def probe(self, model):
+        with self._lock:
+            self.stats['probes'] += 1
+        return types.Model(name=f"models/{model}")
+
+    async def aprobe(self, model):
+        return self.probe(model)
+
+
+# Builds the backend named by `kind` ('genai' or 'fake'); fake options come from
+# `options`, and GenaiBackend's pool and timeout settings from `client_options`
+def make_backend(kind: str = 'genai', options: dict = None, client_options: dict = None):
+    if kind == 'genai':
+        return GenaiBackend(**(client_options or {}))
+    if kind != 'fake':
+        raise ValueError(f"Unknown Gemini backend: {kind}")
+    options = options or {}
+    latencies = {stage: parse_latency(spec) for stage, spec in options.get('latencies', {}).items() if spec}
+    audio_path = options.get('audio_path')
+    print(f"Using the fake Gemini backend (error rate {options.get('error_rate', 0.0)})")
+    return FakeGeminiBackend(
+        latencies=latencies,
+        error_rate=options.get('error_rate', 0.0),
+        seed=options.get('seed'),
+        audio_pcm=load_canned_audio(audio_path) if audio_path else None,
+        model_slowdowns=parse_model_slowdowns(options.get('model_slowdowns') or "")
+    )
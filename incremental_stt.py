@@ -0,0 +1,236 @@
+import time
+import threading
+
+from startup import LazyModule
+
+np = LazyModule('numpy')
+
+# =================================================================
+# Incremental transcription and endpointing
+# =================================================================
+# While the player is still holding push-to-talk, the growing recording is
+# transcribed in the background and interim transcripts are pushed to the
+# client. When the stream stops, only the part that has not been
+# transcribed yet still needs an STT call.
+#
+# Raw 16-bit PCM ('pcm16') can be cut anywhere, so it is transcribed in
+# consecutive windows that are committed one after another, each cut at a
+# quiet frame so words are not split. If a window's STT call fails, no more
+# windows are sent and the whole recording is transcribed at stop time, so
+# its audio is never lost from the transcript. Compressed containers (WebM/Opus)
+# cannot be decoded from the middle, so for those the whole prefix is
+# re-transcribed periodically for interim display, and the last interim
+# result is reused at stop time if no audio arrived after it.
+#
+# Re-sending the prefix makes the STT work for WebM grow with the square of
+# the utterance length (window k uploads k windows of audio). Only the first
+# max_prefix_windows prefixes are sent; after that the interim transcript
+# stops updating and the whole recording is transcribed once at stop time.
+# Long utterances get continuous interim transcripts from 'pcm16' input only.
+#
+# Endpointing (PCM only) watches frame energy and reports the end of speech
+# once enough trailing silence follows detected speech.
+
+FRAME_MS = 20
+
+
+# Root-mean-square energy of each FRAME_MS frame of 16-bit mono PCM (bytes or a sample array)
+def frame_energies(pcm, sample_rate: int):
+    samples = pcm if isinstance(pcm, np.ndarray) else np.frombuffer(pcm, dtype='<i2', count=len(pcm) // 2)
+    frame_len = max(1, sample_rate * FRAME_MS // 1000)
+    n_frames = len(samples) // frame_len
+    if n_frames == 0:
+        return np.zeros(0)
+    frames = samples[:n_frames * frame_len].reshape(n_frames, frame_len).astype(np.float32)
+    return np.sqrt(np.mean(frames * frames, axis=1))
+
+
+class IncrementalTranscriber:
+    def __init__(self, audio_io, transcribe_fn, executor, on_partial, input_format: str = 'pcm16',
+                 sample_rate: int = 16000, window_seconds: float = 3.0, endpointing: bool = False,
+                 endpoint_silence_ms: int = 700, energy_threshold: float = 500.0, max_prefix_windows: int = 4):
+        self.audio_io = audio_io              # the session's BytesIO recording buffer
+        self.transcribe_fn = transcribe_fn    # transcribe_fn(audio_bytes, is_pcm, window) -> text or None
+        self.executor = executor
+        self.on_partial = on_partial          # on_partial(text_so_far)
+        self.is_pcm = input_format == 'pcm16'
+        self.sample_rate = sample_rate
+        self.window_seconds = window_seconds
+        self.endpointing = endpointing and self.is_pcm
+        self.endpoint_silence_frames = max(1, endpoint_silence_ms // FRAME_MS)
+        self.energy_threshold = energy_threshold
+        self.max_prefix_windows = max_prefix_windows   # compressed input: interim prefixes sent at most
+
+        self._lock = threading.Lock()
+        self._inflight = None        # Future of the window currently being transcribed
+        self._closed = False
+        # pcm16 state
+        self._committed_offset = 0   # PCM bytes already handed to STT
+        self._committed_text = []
+        self._window_failed = False  # a window's STT call failed: finish() transcribes everything
+        # compressed-container state
+        self._partial_text = None
+        self._partial_size = 0       # buffer size the last interim result covers
+        self._last_submit = time.monotonic()
+        # endpointing state
+        self._analyzed_offset = 0
+        self._speech_seen = False
+        self._silent_frames = 0
+        self._endpoint_reported = False
+        self.stats = {'windows': 0, 'skipped_silent': 0, 'tail_bytes': 0, 'failed_windows': 0, 'prefix_capped': 0}
+
+    # --- Buffer access ---
+
+    def _size(self):
+        return self.audio_io.getbuffer().nbytes
+
+    def _read(self, start, end):
+        with self.audio_io.getbuffer() as view:
+            return bytes(view[start:end])
+
+    def _has_speech(self, pcm):
+        energies = frame_energies(pcm, self.sample_rate)
+        return energies.size > 0 and float(energies.max()) >= self.energy_threshold
+
+    # --- Feeding ---
+
+    def append(self, chunk: bytes):
+        """
+        Append a chunk to the recording buffer and start background
+        transcription of a new window when one is due. Returns True exactly
+        once, when endpointing detects the end of speech.
+        """
+        with self._lock:
+            # Writes and reads share the lock: BytesIO cannot grow while a view is exported
+            self.audio_io.write(chunk)
+            if self._closed:
+                return False
+            size = self._size()
+            endpoint = self._detect_endpoint(size) if self.endpointing else False
+            if self._inflight is None or self._inflight.done():
+                if self.is_pcm:
+                    self._maybe_submit_pcm_window(size)
+                else:
+                    self._maybe_submit_prefix(size)
+            return endpoint
+
+    def _detect_endpoint(self, size):
+        frame_bytes = self.sample_rate * FRAME_MS // 1000 * 2
+        end = self._analyzed_offset + (size - self._analyzed_offset) // frame_bytes * frame_bytes
+        if end <= self._analyzed_offset:
+            return False
+        energies = frame_energies(self._read(self._analyzed_offset, end), self.sample_rate)
+        self._analyzed_offset = end
+        for energy in energies:
+            if energy >= self.energy_threshold:
+                self._speech_seen = True
+                self._silent_frames = 0
+            else:
+                self._silent_frames += 1
+        if (self._speech_seen and not self._endpoint_reported
+                and self._silent_frames >= self.endpoint_silence_frames):
+            self._endpoint_reported = True
+            return True
+        return False
+
+    def _maybe_submit_pcm_window(self, size):
+        window_bytes = int(self.window_seconds * self.sample_rate) * 2
+        if self._window_failed or size - self._committed_offset < window_bytes:
+            return
+        start = self._committed_offset
+        end = start + window_bytes
+        # Cut at the quietest frame in the last half second of the window
+        search_bytes = min(window_bytes // 2, self.sample_rate)  # 0.5 s of 16-bit samples
+        search_start = end - search_bytes
+        energies = frame_energies(self._read(search_start, end), self.sample_rate)
+        if energies.size:
+            frame_bytes = self.sample_rate * FRAME_MS // 1000 * 2
+            end = search_start + (int(np.argmin(energies)) + 1) * frame_bytes
+        pcm = self._read(start, end)
+        self._committed_offset = end
+        self.stats['windows'] += 1
+        if not self._has_speech(pcm):
+            self.stats['skipped_silent'] += 1
+            return
+        self._inflight = self.executor.submit(self._transcribe_window, pcm)
+
+    def _transcribe_window(self, pcm):
+        try:
+            text = self.transcribe_fn(pcm, True, True)
+        except Exception as e:
+            print(f"Warning: Interim transcription failed, the full buffer will be transcribed at stop: {e}")
+            with self._lock:
+                self._window_failed = True
+                self.stats['failed_windows'] += 1
+            return
+        with self._lock:
+            if self._closed:
+                return
+            if text:
+                self._committed_text.append(text)
+            partial = " ".join(self._committed_text)
+        if partial:
+            self.on_partial(partial)
+
+    def _maybe_submit_prefix(self, size):
+        if time.monotonic() - self._last_submit < self.window_seconds or size == self._partial_size:
+            return
+        if self.stats['windows'] >= self.max_prefix_windows:
+            # Past the cap: finish() transcribes the whole recording once
+            self.stats['prefix_capped'] = 1
+            return
+        self._last_submit = time.monotonic()
+        self.stats['windows'] += 1
+        self._inflight = self.executor.submit(self._transcribe_prefix, self._read(0, size))
+
+    def _transcribe_prefix(self, data):
+        size = len(data)
+        text = self.transcribe_fn(data, False, True)
+        with self._lock:
+            if self._closed or not text:
+                return
+            self._partial_text = text
+            self._partial_size = size
+        self.on_partial(text)
+
+    # --- Finishing ---
+
+    def finish(self):
+        """Transcribe whatever is left and return the full transcript (or None)"""
+        inflight = self._inflight
+        if inflight is not None:
+            try:
+                inflight.result()
+            except Exception as e:
+                print(f"Warning: Interim transcription failed, falling back to full buffer: {e}")
+                return self._transcribe_all()
+
+        with self._lock:
+            window_failed = self._window_failed
+            size = self._size()
+            if self.is_pcm:
+                tail = self._read(self._committed_offset, size)
+                committed = list(self._committed_text)
+            elif self._partial_text and self._partial_size == size:
+                return self._partial_text
+            else:
+                tail = None
+
+        if not self.is_pcm or window_failed:
+            return self._transcribe_all()
+
+        self.stats['tail_bytes'] = len(tail)
+        if tail and self._has_speech(tail):
+            text = self.transcribe_fn(tail, True, False)
+            if text:
+                committed.append(text)
+        return " ".join(committed) or None
+
+    def _transcribe_all(self):
+        with self._lock:
+            data = self._read(0, self._size())
+        return self.transcribe_fn(data, self.is_pcm, False)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
@@ -0,0 +1,335 @@
+import os
+import sys
+import time
+import wave
+import argparse
+import threading
+import subprocess
+import statistics
+from urllib.parse import urlparse
+
+import numpy as np
+import requests
+import socketio
+
+# =================================================================
+# Load test: N simulated players against the server
+# =================================================================
+# Each simulated player connects over Socket.IO, loads a memory scene and
+# then runs turns: streams a recorded utterance as 16-bit PCM chunks,
+# sends stop_stream, waits for the reply and downloads its audio from
+# /audio/<id> (or receives it pushed over the socket with --push). Reports
+# p50/p95/p99 turn latency (stop_stream to the last clip received),
+# throughput, failures and the server's peak RSS.
+#
+# With --spawn the server is started here with the fake Gemini backend, so
+# no API key or spend is needed:
+#
+#   python load_test.py --spawn --clients 100 --turns 3 --fake-latency-llm lognormal:800,0.4
+#   python load_test.py --spawn --server async --clients 50 --idle-clients 500   # memory per connection
+#   python load_test.py --url http://localhost:5000 --clients 10    # an already running server
+
+PCM_SAMPLE_RATE = 16000
+FAILURE_STATUSES = ('Service temporarily unavailable', 'Server processing error')
+
+
+# The utterance to send: a 16-bit mono WAV file's samples, or a synthesized tone
+def load_utterance(path, seconds):
+    if path:
+        with wave.open(path, "rb") as wf:
+            if wf.getsampwidth() != 2 or wf.getnchannels() != 1:
+                raise ValueError("Recording must be 16-bit mono WAV")
+            return wf.readframes(wf.getnframes()), wf.getframerate()
+    t = np.arange(int(seconds * PCM_SAMPLE_RATE)) / PCM_SAMPLE_RATE
+    return (np.sin(2 * np.pi * 180 * t) * 6000).astype('<i2').tobytes(), PCM_SAMPLE_RATE
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class SimulatedPlayer:
+    def __init__(self, index, args, pcm, sample_rate, results):
+        self.index = index
+        self.args = args
+        self.pcm = pcm
+        self.sample_rate = sample_rate
+        self.results = results        # shared dict of lists, guarded by results['lock']
+        self.http = requests.Session()
+        self.sio = socketio.Client(reconnection=False)
+        self._cond = threading.Condition()
+        self._clips = []              # audio urls (or pushed audio bytes) received for the current turn
+        self._done = False
+        self._failed = None
+        self.sio.on('memory_scene', self._on_memory_scene)
+        self.sio.on('audio_ready', self._on_audio_ready)
+        self.sio.on('audio_segment', lambda data: self._on_clip(data.get('data') or data['audio_url']))
+        self.sio.on('audio_complete', lambda data: self._finish())
+        self.sio.on('status', self._on_status)
+        self.sio.on('error', lambda data: self._finish(failed=data.get('message', 'error')))
+        self._scene_loaded = threading.Event()
+
+    def _on_memory_scene(self, data):
+        self._scene_loaded.set()
+
+    def _on_clip(self, url):
+        with self._cond:
+            self._clips.append(url)
+            self._cond.notify_all()
+
+    def _on_audio_ready(self, data):
+        self._on_clip(data.get('data') or data['audio_url'])
+        self._finish()
+
+    def _on_status(self, data):
+        if data.get('busy'):
+            self._finish(failed='busy')
+        elif data.get('message', '').startswith(FAILURE_STATUSES):
+            self._finish(failed='upstream')
+
+    def _finish(self, failed=None):
+        with self._cond:
+            self._done = True
+            self._failed = failed
+            self._cond.notify_all()
+
+    def _record(self, key, value):
+        with self.results['lock']:
+            self.results[key].append(value)
+
+    def _send_utterance(self):
+        chunk_bytes = int(self.sample_rate * self.args.chunk_ms / 1000) * 2
+        self.sio.emit('start_stream', {
+            'format': 'pcm16',
+            'sample_rate': self.sample_rate,
+            'streaming': self.args.streaming,
+            'incremental': self.args.incremental,
+            'audio_delivery': 'push' if self.args.push else 'url',
+            'audio_format': self.args.push
+        })
+        for start in range(0, len(self.pcm), chunk_bytes):
+            self.sio.send(self.pcm[start:start + chunk_bytes])
+            if self.args.realtime:
+                time.sleep(self.args.chunk_ms / 1000)
+
+    def _fetch(self, url):
+        if isinstance(url, bytes):
+            # Pushed over the socket: nothing to download
+            self._record('bytes', len(url))
+            return
+        # The server builds absolute URLs from the Host header; keep the path only
+        path = url.split('/audio/', 1)[1]
+        response = self.http.get(f"{self.args.url}/audio/{path}", timeout=self.args.timeout)
+        response.raise_for_status()
+        self._record('bytes', len(response.content))
+
+    def run_turn(self):
+        with self._cond:
+            self._clips = []
+            self._done = False
+            self._failed = None
+        self._send_utterance()
+        stopped = time.perf_counter()
+        self.sio.emit('stop_stream', {})
+
+        fetched = 0
+        first_audio = None
+        deadline = stopped + self.args.timeout
+        while True:
+            with self._cond:
+                while fetched == len(self._clips) and not self._done:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        self._record('failures', 'timeout')
+                        return
+                if self._failed:
+                    self._record('failures', self._failed)
+                    return
+                pending = self._clips[fetched:]
+                done = self._done
+            for url in pending:
+                self._fetch(url)
+                fetched += 1
+                if first_audio is None:
+                    first_audio = time.perf_counter() - stopped
+            if done and fetched == len(self._clips):
+                break
+        self._record('latencies', time.perf_counter() - stopped)
+        if first_audio is not None:
+            self._record('first_audio', first_audio)
+
+    def run(self):
+        try:
+            # websocket only: batched long-polling cannot carry a stream of audio chunks
+            self.sio.connect(self.args.url, transports=['websocket'], wait_timeout=self.args.timeout)
+            self.sio.emit('load_memory', {'memory_id': self.args.memory})
+            if not self._scene_loaded.wait(self.args.timeout):
+                self._record('failures', 'load_memory')
+                return
+            for _ in range(self.args.turns):
+                self.run_turn()
+                if self.args.think_seconds:
+                    time.sleep(self.args.think_seconds)
+        except Exception as e:
+            self._record('failures', type(e).__name__)
+        finally:
+            if self.sio.connected:
+                self.sio.disconnect()
+
+
+# A connected player that loads a scene and then stays idle until released,
+# so the server's memory per open connection can be measured
+def run_idle_player(args, release, results):
+    client = socketio.Client(reconnection=False)
+    scene_loaded = threading.Event()
+    client.on('memory_scene', lambda data: scene_loaded.set())
+    try:
+        client.connect(args.url, transports=['websocket'], wait_timeout=args.timeout)
+        client.emit('load_memory', {'memory_id': args.memory})
+        if not scene_loaded.wait(args.timeout):
+            raise TimeoutError()
+        with results['lock']:
+            results['idle_connected'] += 1
+        release.wait()
+    except Exception as e:
+        with results['lock']:
+            results['failures'].append(f"idle {type(e).__name__}")
+    finally:
+        if client.connected:
+            client.disconnect()
+
+
+# Starts server.py (or server_async.py) with the fake backend and waits until it accepts requests
+def spawn_server(args):
+    try:
+        requests.get(f"{args.url}/stats/turns", timeout=1)
+        raise RuntimeError(f"A server is already listening on {args.url}; stop it or drop --spawn")
+    except requests.ConnectionError:
+        pass
+    env = dict(os.environ, GEMINI_BACKEND='fake', PRERENDER_ON_STARTUP='0', SPAN_LOG='0',
+               FAKE_GEMINI_ERROR_RATE=str(args.fake_error_rate), PORT=str(urlparse(args.url).port or 5000))
+    for stage in ('stt', 'llm', 'fused', 'tts'):
+        spec = getattr(args, f'fake_latency_{stage}')
+        if spec:
+            env[f'FAKE_GEMINI_LATENCY_{stage.upper()}'] = spec
+    script = 'server_async.py' if args.server == 'async' else 'server.py'
+    server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+    process = subprocess.Popen([sys.executable, server_path], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Wait until it is warmed up (/readyz), as an orchestrator would before sending players
+    started = time.monotonic()
+    while time.monotonic() < started + 30 and process.poll() is None:
+        try:
+            if requests.get(f"{args.url}/readyz", timeout=1).status_code == 200:
+                print(f"Spawned {script} ready in {time.monotonic() - started:.2f}s")
+                return process
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Spawned server did not become ready")
+
+
+# Current (VmRSS) or peak (VmHWM) RSS in MB of a local server process
+def rss_mb(pid, field='VmHWM'):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(f'{field}:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+# Options shared with replay_sessions.py: where the server is, or how to spawn one on the fake backend
+def add_server_arguments(parser):
+    parser.add_argument("--url", default="http://localhost:5000", help="server base URL")
+    parser.add_argument("--spawn", action="store_true", help="start server.py locally with the fake Gemini backend")
+    parser.add_argument("--server", choices=('threading', 'async'), default='threading',
+                        help="(--spawn) server.py or the asyncio server_async.py")
+    parser.add_argument("--server-pid", type=int, help="pid of a local server to report peak RSS for")
+    parser.add_argument("--fake-error-rate", type=float, default=0.0, help="(--spawn) injected 503 rate")
+    for stage in ('stt', 'llm', 'fused', 'tts'):
+        parser.add_argument(f"--fake-latency-{stage}", help=f"(--spawn) {stage} latency spec, e.g. lognormal:800,0.4")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive N simulated players through full conversation turns.")
+    add_server_arguments(parser)
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--idle-clients", type=int, default=0,
+                        help="extra connections that load a scene and stay idle for the whole run")
+    parser.add_argument("--turns", type=int, default=3, help="turns per client")
+    parser.add_argument("--ramp-seconds", type=float, default=1.0, help="spread client start over this long")
+    parser.add_argument("--think-seconds", type=float, default=0.0, help="pause between a client's turns")
+    parser.add_argument("--memory", default="3", help="memory scene id to load")
+    parser.add_argument("--recording", help="16-bit mono WAV utterance (default: synthesized tone)")
+    parser.add_argument("--utterance-seconds", type=float, default=2.0, help="length of the synthesized utterance")
+    parser.add_argument("--chunk-ms", type=int, default=100, help="audio per 'message' chunk")
+    parser.add_argument("--realtime", action="store_true", help="pace chunks in real time like a live microphone")
+    parser.add_argument("--streaming", action="store_true", help="request sentence-streamed replies")
+    parser.add_argument("--incremental", action="store_true", help="request incremental transcription")
+    parser.add_argument("--push", choices=('opus', 'pcm16', 'wav'), help="receive reply audio pushed over the socket")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-turn timeout in seconds")
+    args = parser.parse_args()
+    args.url = args.url.rstrip('/')
+
+    pcm, sample_rate = load_utterance(args.recording, args.utterance_seconds)
+    process = spawn_server(args) if args.spawn else None
+    server_pid = process.pid if process else args.server_pid
+    baseline_rss = rss_mb(server_pid, 'VmRSS') if server_pid else None
+    results = {'lock': threading.Lock(), 'latencies': [], 'first_audio': [], 'failures': [], 'bytes': [],
+               'idle_connected': 0}
+
+    release_idle = threading.Event()
+    idle_threads = [threading.Thread(target=run_idle_player, args=(args, release_idle, results), daemon=True)
+                    for _ in range(args.idle_clients)]
+    for thread in idle_threads:
+        thread.start()
+    idle_deadline = time.monotonic() + args.timeout
+    while (results['idle_connected'] + len(results['failures']) < args.idle_clients
+           and time.monotonic() < idle_deadline):
+        time.sleep(0.1)
+
+    players = [SimulatedPlayer(i, args, pcm, sample_rate, results) for i in range(args.clients)]
+    threads = [threading.Thread(target=player.run, daemon=True) for player in players]
+    started = time.perf_counter()
+    for i, thread in enumerate(threads):
+        thread.start()
+        if args.clients > 1 and args.ramp_seconds:
+            time.sleep(args.ramp_seconds / (args.clients - 1) if i < args.clients - 1 else 0)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    rss = rss_mb(server_pid) if server_pid else None
+    release_idle.set()
+    for thread in idle_threads:
+        thread.join()
+    if process:
+        process.terminate()
+        process.wait()
+
+    latencies = results['latencies']
+    print(f"\nclients {args.clients}, turns/client {args.turns}, elapsed {elapsed:.1f}s")
+    print(f"completed turns {len(latencies)}, failed {len(results['failures'])}", end="")
+    if results['failures']:
+        counts = {reason: results['failures'].count(reason) for reason in set(results['failures'])}
+        print(f" {counts}", end="")
+    print(f"\nthroughput {len(latencies) / elapsed:.2f} turns/s, audio received {sum(results['bytes']) / 1e6:.1f} MB")
+    for name, values in (('turn latency', latencies), ('first audio', results['first_audio'])):
+        if values:
+            print(f"{name:<14} p50 {percentile(values, 50):.3f}s  p95 {percentile(values, 95):.3f}s  "
+                  f"p99 {percentile(values, 99):.3f}s  mean {statistics.mean(values):.3f}s  max {max(values):.3f}s")
+    if rss is not None:
+        connections = args.clients + results['idle_connected']
+        print(f"server peak RSS {rss:.1f} MB (baseline {baseline_rss:.1f} MB, "
+              f"{(rss - baseline_rss) * 1024 / max(1, connections):.0f} KB per connection over {connections})")
+    return 0 if latencies else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
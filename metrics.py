@@ -0,0 +1,277 @@
+import sys
+import json
+import time
+import queue
+import logging
+import threading
+import contextvars
+import logging.handlers
+from contextlib import contextmanager
+
+# =================================================================
+# Latency spans and Prometheus metrics
+# =================================================================
+# Every stage of a turn (STT, LLM, TTS, WAV packing, audio fetch...) is
+# timed as a span carrying sid, memory_id, bytes in/out and retry count.
+# Spans are handed to a logging QueueHandler, so the hot path only does a
+# queue put; a background QueueListener writes them out as JSON lines.
+# The same spans feed latency histograms that /metrics renders in the
+# Prometheus text format, alongside counters and live gauges.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def values(self):
+        """{labels tuple: value} snapshot"""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {}   # label key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series):
+                    labels = _format_labels(key + (('le', _format_value(bound)),))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]!r}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose samples are read from a callback at render time"""
+
+    def __init__(self, name, help_text, read_fn):
+        self.name = name
+        self.help_text = help_text
+        self.read_fn = read_fn   # returns a number, or a list of (labels dict, value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        try:
+            samples = self.read_fn()
+        except Exception as e:
+            print(f"Warning: Could not read gauge {self.name}: {e}")
+            return lines
+        if not isinstance(samples, list):
+            samples = [({}, samples)]
+        for labels, value in samples:
+            lines.append(f"{self.name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+stage_latency = registry.register(Histogram(
+    "chatbot_stage_latency_seconds", "Latency of each pipeline stage"))
+stage_bytes_in = registry.register(Counter(
+    "chatbot_stage_bytes_in_total", "Bytes sent into each pipeline stage"))
+stage_bytes_out = registry.register(Counter(
+    "chatbot_stage_bytes_out_total", "Bytes produced by each pipeline stage"))
+gemini_retries = registry.register(Counter(
+    "chatbot_gemini_retries_total", "Gemini calls retried after an error"))
+gemini_errors = registry.register(Counter(
+    "chatbot_gemini_errors_total", "Gemini call errors by model and error type"))
+gemini_hedges = registry.register(Counter(
+    "chatbot_gemini_hedged_calls_total", "Hedged Gemini calls by stage and which request answered first"))
+gemini_short_circuits = registry.register(Counter(
+    "chatbot_gemini_short_circuits_total", "Gemini calls refused by an open circuit breaker"))
+turn_fallbacks = registry.register(Counter(
+    "chatbot_turn_fallbacks_total", "Turns answered with the fallback line, by reason"))
+gemini_routes = registry.register(Counter(
+    "chatbot_gemini_routes_total", "Gemini calls by stage, model and routing decision"))
+gemini_pool_wait = registry.register(Histogram(
+    "chatbot_gemini_pool_wait_seconds", "Time Gemini requests waited for a free pooled connection",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)))
+
+
+# =================================================================
+# Turn context and spans
+# =================================================================
+
+# Who the current work belongs to; copied into worker threads with the context
+turn_context = contextvars.ContextVar('turn_context', default=None)
+
+
+def new_turn_context(sid, memory_id):
+    return {'sid': sid, 'memory_id': memory_id, 'retries': 0, 'routes': {}}
+
+
+# Wraps fn so it runs with the given turn context (for callbacks run on other threads)
+def bind_turn_context(context, fn):
+    def bound(*args, **kwargs):
+        token = turn_context.set(context)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            turn_context.reset(token)
+    return bound
+
+
+def note_retry(model):
+    gemini_retries.inc(model=model)
+    context = turn_context.get()
+    if context is not None:
+        context['retries'] += 1
+
+
+def note_gemini_error(model, error):
+    gemini_errors.inc(model=model, error=type(error).__name__)
+
+
+span_logger = logging.getLogger("chatbot.spans")
+span_logger.propagate = False
+_span_listener = None
+
+
+def start_span_logging(path=None):
+    """Route span records through a queue to a background writer (stderr or a file)"""
+    global _span_listener
+    if _span_listener is not None:
+        return
+    target = logging.FileHandler(path) if path else logging.StreamHandler(sys.stderr)
+    target.setFormatter(logging.Formatter("%(message)s"))
+    span_queue = queue.SimpleQueue()
+    span_logger.addHandler(logging.handlers.QueueHandler(span_queue))
+    span_logger.setLevel(logging.INFO)
+    _span_listener = logging.handlers.QueueListener(span_queue, target)
+    _span_listener.start()
+
+
+def stop_span_logging():
+    global _span_listener
+    if _span_listener is not None:
+        _span_listener.stop()
+        _span_listener = None
+
+
+# The server's own log (per-turn detail at debug level) goes through a queue the same way
+detail_logger = logging.getLogger("chatbot")
+_detail_listener = None
+
+
+def start_detail_logging(level="INFO", path=None):
+    """Route records of the "chatbot" logger at `level` and above through a queue to a background writer"""
+    global _detail_listener
+    if _detail_listener is not None:
+        return
+    target = logging.FileHandler(path) if path else logging.StreamHandler(sys.stderr)
+    target.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    detail_queue = queue.SimpleQueue()
+    detail_logger.addHandler(logging.handlers.QueueHandler(detail_queue))
+    detail_logger.setLevel(level)
+    detail_logger.propagate = False
+    _detail_listener = logging.handlers.QueueListener(detail_queue, target)
+    _detail_listener.start()
+
+
+def stop_detail_logging():
+    global _detail_listener
+    if _detail_listener is not None:
+        _detail_listener.stop()
+        _detail_listener = None
+
+
+def record_span(stage, seconds, bytes_in=0, bytes_out=0, retries=0, **fields):
+    context = turn_context.get() or {}
+    stage_latency.observe(seconds, stage=stage)
+    if bytes_in:
+        stage_bytes_in.inc(bytes_in, stage=stage)
+    if bytes_out:
+        stage_bytes_out.inc(bytes_out, stage=stage)
+    if span_logger.handlers:
+        span_logger.info(json.dumps({
+            'ts': round(time.time(), 3),
+            'sid': context.get('sid'),
+            'memory_id': context.get('memory_id'),
+            'stage': stage,
+            'ms': round(seconds * 1000, 1),
+            'bytes_in': bytes_in,
+            'bytes_out': bytes_out,
+            'retries': retries,
+            **fields
+        }))
+
+
+@contextmanager
+def span(stage, bytes_in=0, **fields):
+    """
+    Time a block as one span. The yielded dict may be updated inside the
+    block (e.g. span_info['bytes_out'] = len(result)).
+    """
+    context = turn_context.get()
+    retries_before = context['retries'] if context else 0
+    span_info = {'bytes_in': bytes_in, 'bytes_out': 0}
+    started = time.perf_counter()
+    try:
+        yield span_info
+    finally:
+        retries = (context['retries'] - retries_before) if context else 0
+        record_span(stage, time.perf_counter() - started, span_info['bytes_in'], span_info['bytes_out'],
+                    retries, **fields)
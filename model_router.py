@@ -0,0 +1,163 @@
+import time
+import threading
+from collections import deque
+
+# =================================================================
+# Latency-SLO model routing with fallback tiers
+# =================================================================
+# Each pipeline stage (stt, llm, fused, tts...) has an ordered list of
+# models: the primary first, then faster or cheaper fallbacks. The router
+# keeps a rolling window of call latencies and failures per stage and
+# model. When the model a stage is using breaches the stage's p95 latency
+# SLO, or fails too often, the stage moves down to the next tier.
+#
+# While a stage runs on a fallback, one call every probe_seconds is sent
+# to the tier above it. After probe_successes consecutive probes that
+# succeed within the SLO, the stage moves back up. A model whose circuit
+# breaker is open is skipped, whatever tier the stage is on.
+
+
+class ModelRouter:
+    def __init__(self, tiers: dict, slo_seconds: dict = None, max_error_ratio: float = 0.2,
+                 window_seconds: float = 60, min_calls: int = 20, probe_seconds: float = 10,
+                 probe_successes: int = 3, is_available=None):
+        self.tiers = {stage: list(models) for stage, models in tiers.items()}
+        self.slo_seconds = slo_seconds or {}    # stage -> p95 SLO in seconds (no entry: no latency SLO)
+        self.max_error_ratio = max_error_ratio
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.probe_seconds = probe_seconds
+        self.probe_successes = probe_successes
+        self.is_available = is_available        # model -> False while its circuit breaker rejects calls
+        self._active = {stage: 0 for stage in self.tiers}        # index of the tier in use
+        self._next_probe = {stage: 0.0 for stage in self.tiers}
+        self._probe_streak = {stage: 0 for stage in self.tiers}
+        self._moved_at = {stage: 0.0 for stage in self.tiers}
+        self._windows = {}                      # (stage, model) -> deque of (time, seconds, failed)
+        self._lock = threading.Lock()
+        self._stats = {stage: {'routed': {}, 'demotions': 0, 'failbacks': 0, 'last_change': None}
+                       for stage in self.tiers}
+
+    def _window(self, stage, model, now):
+        window = self._windows.setdefault((stage, model), deque())
+        while window and window[0][0] < now - self.window_seconds:
+            window.popleft()
+        return window
+
+    @staticmethod
+    def _summary(window):
+        latencies = sorted(seconds for _, seconds, failed in window if not failed)
+        failures = sum(1 for _, _, failed in window if failed)
+        p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))] if latencies else None
+        return {'calls': len(window), 'p95': p95, 'error_ratio': failures / len(window) if window else 0.0}
+
+    # Why (stage, model) is out of its SLO, or None
+    def _breach(self, stage, summary):
+        if summary['calls'] < self.min_calls:
+            return None
+        if summary['error_ratio'] > self.max_error_ratio:
+            return f"error ratio {summary['error_ratio']:.0%} > {self.max_error_ratio:.0%}"
+        slo = self.slo_seconds.get(stage)
+        if slo and summary['p95'] is not None and summary['p95'] > slo:
+            return f"p95 {summary['p95'] * 1000:.0f}ms > SLO {slo * 1000:.0f}ms"
+        return None
+
+    def _available(self, model):
+        return self.is_available is None or self.is_available(model)
+
+    def route(self, stage):
+        """(model, decision) for the next call of this stage; decision is 'primary', 'fallback' or 'probe'"""
+        tiers = self.tiers.get(stage)
+        if not tiers:
+            raise KeyError(f"No models configured for stage {stage!r}")
+        with self._lock:
+            active = self._active[stage]
+            now = time.monotonic()
+            if active > 0 and now >= self._next_probe[stage] and self._available(tiers[active - 1]):
+                self._next_probe[stage] = now + self.probe_seconds
+                model, decision = tiers[active - 1], 'probe'
+            else:
+                # The active tier, or the first one below it whose breaker lets calls through
+                index = next((i for i in range(active, len(tiers)) if self._available(tiers[i])), active)
+                model, decision = tiers[index], 'primary' if index == 0 else 'fallback'
+            routed = self._stats[stage]['routed']
+            routed[decision] = routed.get(decision, 0) + 1
+        return model, decision
+
+    def observe(self, stage, model, seconds: float, failed: bool, started: float = None):
+        """
+        Feed one call's outcome: its latency (without any wait for a
+        connection slot), whether it failed upstream, and when it started
+        (now - seconds if not given)
+        """
+        tiers = self.tiers.get(stage)
+        if not tiers or model not in tiers:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if (started if started is not None else now - seconds) < self._moved_at[stage]:
+                return   # started before the stage last changed tier: judged under the old routing
+            window = self._window(stage, model, now)
+            window.append((now, seconds, failed))
+            active = self._active[stage]
+            tier = tiers.index(model)
+            if tier == active and active < len(tiers) - 1:
+                reason = self._breach(stage, self._summary(window))
+                if reason:
+                    self._move(stage, active + 1, f"{model} {reason}", now)
+            elif tier == active - 1:
+                slo = self.slo_seconds.get(stage)
+                if failed or (slo and seconds > slo):
+                    self._probe_streak[stage] = 0
+                else:
+                    self._probe_streak[stage] += 1
+                    if self._probe_streak[stage] >= self.probe_successes:
+                        self._move(stage, active - 1, f"{model} healthy in {self.probe_successes} probes", now)
+
+    def _move(self, stage, tier, reason, now):
+        previous = self.tiers[stage][self._active[stage]]
+        demoted = tier > self._active[stage]
+        # Both models start from fresh windows: a failback is decided by probes, a new breach by new calls
+        for model in (previous, self.tiers[stage][tier]):
+            self._windows.pop((stage, model), None)
+        self._active[stage] = tier
+        self._probe_streak[stage] = 0
+        self._next_probe[stage] = now + self.probe_seconds
+        self._moved_at[stage] = now
+        stats = self._stats[stage]
+        if demoted:
+            stats['demotions'] += 1
+        else:
+            stats['failbacks'] += 1
+        stats['last_change'] = {'at': round(time.time(), 3), 'from': previous, 'to': self.tiers[stage][tier],
+                                'reason': reason}
+        print(f"Model router: {stage} now on {self.tiers[stage][tier]} (was {previous}: {reason})")
+
+    def active_tier(self, stage):
+        with self._lock:
+            return self._active[stage]
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            snapshot = {}
+            for stage, tiers in self.tiers.items():
+                models = {}
+                for model in tiers:
+                    summary = self._summary(self._window(stage, model, now))
+                    p95 = summary.pop('p95')
+                    summary['p95_ms'] = None if p95 is None else round(p95 * 1000, 1)
+                    summary['error_ratio'] = round(summary['error_ratio'], 3)
+                    models[model] = summary
+                slo = self.slo_seconds.get(stage)
+                snapshot[stage] = {
+                    'active': tiers[self._active[stage]],
+                    'tiers': list(tiers),
+                    'slo_p95_ms': round(slo * 1000) if slo else None,
+                    'models': models,
+                    'routed': dict(self._stats[stage]['routed']),
+                    'demotions': self._stats[stage]['demotions'],
+                    'failbacks': self._stats[stage]['failbacks'],
+                    'last_change': self._stats[stage]['last_change'],
+                }
+        return snapshot
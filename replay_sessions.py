@@ -0,0 +1,228 @@
+import sys
+import time
+import argparse
+import threading
+import statistics
+
+import socketio
+
+from load_test import add_server_arguments, spawn_server, load_utterance, percentile, rss_mb, FAILURE_STATUSES
+from session_recorder import load_recording
+
+# =================================================================
+# Replay recorded sessions against the server
+# =================================================================
+# Plays back a session recording (SESSION_RECORD_DIR, see session_recorder.py)
+# as new Socket.IO connections: the same events in the same order, with the
+# recorded gaps between them divided by --speed. At --speed max the gaps are
+# dropped, and each session waits for its scene to load and for every reply
+# before sending its next event, so a recording becomes a closed-loop benchmark.
+# Otherwise the replay is open-loop: events go out on schedule whatever the
+# server does, so a recorded barge-in is replayed as a barge-in.
+#
+# Audio chunks come from the recording's sidecar when audio was recorded, and
+# are otherwise synthesized at the recorded sizes. Against a server on the fake
+# backend (--spawn, plus FAKE_GEMINI_SEED for the same draws every run) the
+# same recording gives the same traffic shape every time:
+#
+#   python replay_sessions.py recordings/sessions-....events.jsonl --spawn --speed max
+#   python replay_sessions.py recordings/sessions-....events.jsonl --url http://localhost:5000 --speed 4 --copies 10
+
+REPLAYED_EVENTS = ('load_memory', 'reset_memory', 'start_stream', 'message', 'stop_stream')
+
+
+class ReplayedSession:
+    def __init__(self, events, args, audio_file, filler_pcm, results):
+        self.events = events
+        self.args = args
+        self.audio_file = audio_file          # open sidecar, or None to synthesize audio
+        self.filler_pcm = filler_pcm
+        self.results = results                # shared dict of lists, guarded by results['lock']
+        self.sio = socketio.Client(reconnection=False)
+        self._cond = threading.Condition()
+        self._pending_stops = []              # stop_stream times of turns without a reply yet
+        self._scene_loaded = False
+        self.sio.on('memory_scene', lambda data: self._on_scene())
+        self.sio.on('audio_ready', lambda data: self._turn_ended())
+        self.sio.on('audio_complete', lambda data: self._turn_ended())
+        self.sio.on('status', self._on_status)
+        self.sio.on('error', lambda data: self._turn_ended(failed=data.get('message', 'error')))
+
+    def _record(self, key, value):
+        with self.results['lock']:
+            self.results[key].append(value)
+
+    def _on_scene(self):
+        with self._cond:
+            self._scene_loaded = True
+            self._cond.notify_all()
+
+    def _on_status(self, data):
+        if data.get('busy'):
+            self._turn_ended(failed='busy')
+        elif data.get('message', '').startswith(FAILURE_STATUSES):
+            self._turn_ended(failed='upstream')
+
+    def _turn_ended(self, failed=None):
+        with self._cond:
+            if not self._pending_stops:
+                return   # e.g. an invalid load_memory
+            stopped = self._pending_stops.pop(0)
+            self._cond.notify_all()
+        if failed:
+            self._record('failures', failed)
+        else:
+            self._record('latencies', time.perf_counter() - stopped)
+
+    def _wait(self, predicate):
+        with self._cond:
+            if not self._cond.wait_for(predicate, timeout=self.args.timeout):
+                self._record('failures', 'timeout')
+
+    def _audio(self, event):
+        if self.audio_file is not None and 'audio' in event:
+            offset, length = event['audio']
+            self.audio_file.seek(offset)
+            return self.audio_file.read(length)
+        size = event.get('bytes', 0)
+        repeats = size // len(self.filler_pcm) + 1
+        return (self.filler_pcm * repeats)[:size]
+
+    def _send(self, event):
+        name = event['event']
+        if name == 'load_memory':
+            with self._cond:
+                self._scene_loaded = False
+            self.sio.emit('load_memory', {'memory_id': event.get('memory_id')})
+            if self.args.speed is None:
+                self._wait(lambda: self._scene_loaded)
+        elif name == 'start_stream':
+            with self._cond:
+                if self._pending_stops:
+                    # The player spoke again before the reply came: the server cancels that turn
+                    self._record('barge_ins', len(self._pending_stops))
+                    self._pending_stops.clear()
+            self.sio.emit('start_stream', event.get('data', {}))
+        elif name == 'message':
+            self.sio.send(self._audio(event))
+        elif name == 'stop_stream':
+            with self._cond:
+                self._pending_stops.append(time.perf_counter())
+            self.sio.emit('stop_stream', {})
+            if self.args.speed is None:
+                self._wait(lambda: not self._pending_stops)
+        else:
+            self.sio.emit(name, {})
+
+    def run(self, start_at):
+        connect = self.events[0]
+        first_ts = connect['ts']
+        try:
+            self._sleep_until(start_at)
+            # A resumable session asks for a fresh server-issued key, so replays never resume each other's sessions
+            auth = {'session': None} if connect.get('keyed') else None
+            self.sio.connect(self.args.url, auth=auth, transports=['websocket'], wait_timeout=self.args.timeout)
+            for event in self.events[1:]:
+                if event['event'] not in REPLAYED_EVENTS:
+                    continue
+                if self.args.speed is not None:
+                    self._sleep_until(start_at + (event['ts'] - first_ts) / self.args.speed)
+                self._send(event)
+            if self._pending_stops:
+                self._wait(lambda: not self._pending_stops)
+        except Exception as e:
+            self._record('failures', type(e).__name__)
+        finally:
+            if self.sio.connected:
+                self.sio.disconnect()
+
+    @staticmethod
+    def _sleep_until(moment):
+        delay = moment - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def parse_speed(value):
+    """'max' (None: no gaps, wait for replies) or a positive factor"""
+    if value == 'max':
+        return None
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or 'max'")
+    return speed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded player sessions against the server.")
+    parser.add_argument("recording", help="a SESSION_RECORD_DIR .events.jsonl file")
+    add_server_arguments(parser)
+    parser.add_argument("--speed", type=parse_speed, default=1.0, help="1 (real time), N (N times faster) or max")
+    parser.add_argument("--sessions", type=int, help="replay only the first N sessions")
+    parser.add_argument("--copies", type=int, default=1, help="replay every session this many times at once")
+    parser.add_argument("--timeout", type=float, default=60.0, help="per-reply timeout in seconds")
+    args = parser.parse_args()
+    args.url = args.url.rstrip('/')
+
+    sessions, audio_path = load_recording(args.recording)
+    # Sessions whose connect was not recorded (recording started mid-session) cannot be replayed faithfully
+    recorded = sorted((events for events in sessions.values() if events[0]['event'] == 'connect'),
+                      key=lambda events: events[0]['ts'])[:args.sessions]
+    if not recorded:
+        print("No complete sessions in the recording")
+        return 1
+    filler_pcm, _ = load_utterance(None, 1.0)
+
+    process = spawn_server(args) if args.spawn else None
+    server_pid = process.pid if process else args.server_pid
+    results = {'lock': threading.Lock(), 'latencies': [], 'failures': [], 'barge_ins': []}
+    first_ts = recorded[0][0]['ts']
+    started = time.perf_counter()
+    threads = []
+    sessions_replayed = []
+    for events in recorded:
+        # At 'max' every session starts at once; otherwise at its recorded offset
+        offset = 0.0 if args.speed is None else (events[0]['ts'] - first_ts) / args.speed
+        for _ in range(args.copies):
+            # Each replay reads the sidecar through its own file object
+            session_audio = open(audio_path, "rb") if audio_path else None
+            session = ReplayedSession(events, args, session_audio, filler_pcm, results)
+            sessions_replayed.append(session)
+            threads.append(threading.Thread(target=session.run, args=(started + offset,), daemon=True))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    rss = rss_mb(server_pid) if server_pid else None
+    if process:
+        process.terminate()
+        process.wait()
+    for session in sessions_replayed:
+        if session.audio_file:
+            session.audio_file.close()
+
+    recorded_span = max(events[-1]['ts'] for events in recorded) - first_ts
+    latencies = results['latencies']
+    # Server-side turn latency (stop_stream to the end of the turn) of the original run
+    recorded_latencies = [event['ms'] / 1000 for events in recorded for event in events
+                          if event['event'] == 'turn_end']
+    print(f"\nreplayed {len(recorded)} sessions x {args.copies} at speed "
+          f"{'max' if args.speed is None else args.speed}: {elapsed:.1f}s (recorded {recorded_span:.1f}s)")
+    print(f"completed turns {len(latencies)}, failed {len(results['failures'])}", end="")
+    if results['failures']:
+        counts = {reason: results['failures'].count(reason) for reason in set(results['failures'])}
+        print(f" {counts}", end="")
+    print(f", barge-ins {sum(results['barge_ins'])}")
+    for name, values in (('turn latency', latencies), ('recorded turn', recorded_latencies)):
+        if values:
+            print(f"{name:<14} p50 {percentile(values, 50):.3f}s  p95 {percentile(values, 95):.3f}s  "
+                  f"p99 {percentile(values, 99):.3f}s  mean {statistics.mean(values):.3f}s  max {max(values):.3f}s")
+    if rss is not None:
+        print(f"server peak RSS {rss:.1f} MB")
+    return 0 if latencies else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,146 @@
+import re
+import time
+import zlib
+import threading
+from collections import OrderedDict
+
+from startup import LazyModule
+
+np = LazyModule('numpy')
+
+# =================================================================
+# Scene-aware reply cache
+# =================================================================
+# Players in the same memory scene keep asking the same things ("where am
+# I?", "who are you?"). Replies are cached per scene under the normalized
+# transcript, together with their rendered audio, so a repeated question
+# skips both the LLM and the TTS call.
+#
+# Matching is exact on the normalized text, or near-duplicate with either
+# token-set (Jaccard) similarity or a lightweight embedding (hashed
+# character trigrams, cosine similarity). To keep the character from
+# sounding robotic, each question collects up to `variety` different replies
+# before the cache starts answering it, and hits rotate among them.
+
+EMBEDDING_DIMS = 512
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s']+")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_transcript(text: str) -> str:
+    text = _PUNCTUATION_RE.sub(" ", text.lower())
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+# Hashed character-trigram vector, L2-normalized
+def embed_text(normalized: str):
+    vector = np.zeros(EMBEDDING_DIMS, dtype=np.float32)
+    padded = f"  {normalized}  "
+    for i in range(len(padded) - 2):
+        vector[zlib.crc32(padded[i:i + 3].encode("utf-8")) % EMBEDDING_DIMS] += 1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class _Question:
+    __slots__ = ('tokens', 'vector', 'replies', 'next_reply')
+
+    def __init__(self, normalized):
+        self.tokens = frozenset(normalized.split())
+        self.vector = embed_text(normalized)
+        self.replies = []        # (text, pcm_bytes, created_at)
+        self.next_reply = 0
+
+
+class ReplyCache:
+    def __init__(self, ttl_seconds: float = 3600, variety: int = 3, match: str = 'token_set',
+                 threshold: float = 0.8, max_questions_per_scene: int = 256):
+        if match not in ('exact', 'token_set', 'embedding'):
+            raise ValueError(f"Unknown reply cache match mode: {match}")
+        self.ttl_seconds = ttl_seconds
+        self.variety = max(1, variety)
+        self.match = match
+        self.threshold = threshold
+        self.max_questions_per_scene = max_questions_per_scene
+        self._scenes = {}   # memory_id -> OrderedDict(normalized transcript -> _Question)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'near_hits': 0, 'misses': 0, 'stores': 0}
+
+    def _similarity(self, question, normalized, tokens, vector):
+        if self.match == 'token_set':
+            union = len(tokens | question.tokens)
+            return len(tokens & question.tokens) / union if union else 0.0
+        return float(np.dot(vector, question.vector))
+
+    # Finds the cached question matching this transcript (call with the lock held)
+    def _find(self, memory_id, normalized):
+        questions = self._scenes.get(memory_id)
+        if not questions:
+            return None, False
+        question = questions.get(normalized)
+        if question is not None:
+            questions.move_to_end(normalized)
+            return question, False
+        if self.match == 'exact':
+            return None, False
+
+        tokens = frozenset(normalized.split())
+        vector = embed_text(normalized) if self.match == 'embedding' else None
+        best, best_score = None, self.threshold
+        for key, candidate in questions.items():
+            score = self._similarity(candidate, normalized, tokens, vector)
+            if score >= best_score:
+                best, best_score = key, score
+        if best is None:
+            return None, False
+        questions.move_to_end(best)
+        return questions[best], True
+
+    def _prune(self, question, now):
+        question.replies = [reply for reply in question.replies if now - reply[2] < self.ttl_seconds]
+
+    def lookup(self, memory_id, transcript):
+        """Return a cached (text, pcm_bytes) reply, or None if the turn must be generated"""
+        normalized = normalize_transcript(transcript)
+        if not normalized:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            question, near = self._find(memory_id, normalized)
+            if question is not None:
+                self._prune(question, now)
+            # Keep generating until this question has enough distinct replies to rotate
+            if question is None or len(question.replies) < self.variety:
+                self._stats['misses'] += 1
+                return None
+            text, pcm, _ = question.replies[question.next_reply % len(question.replies)]
+            question.next_reply += 1
+            self._stats['near_hits' if near else 'hits'] += 1
+            return text, pcm
+
+    def store(self, memory_id, transcript, text, pcm):
+        normalized = normalize_transcript(transcript)
+        if not normalized or not text:
+            return
+        now = time.monotonic()
+        with self._lock:
+            question, _ = self._find(memory_id, normalized)
+            if question is None:
+                questions = self._scenes.setdefault(memory_id, OrderedDict())
+                question = questions[normalized] = _Question(normalized)
+                while len(questions) > self.max_questions_per_scene:
+                    questions.popitem(last=False)
+            self._prune(question, now)
+            if len(question.replies) < self.variety and all(reply[0] != text for reply in question.replies):
+                question.replies.append((text, pcm, now))
+                self._stats['stores'] += 1
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['scenes'] = len(self._scenes)
+            snapshot['questions'] = sum(len(questions) for questions in self._scenes.values())
+        lookups = snapshot['hits'] + snapshot['near_hits'] + snapshot['misses']
+        snapshot['hit_ratio'] = round((lookups - snapshot['misses']) / lookups, 4) if lookups else 0.0
+        return snapshot
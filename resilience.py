@@ -0,0 +1,385 @@
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from google.api_core.exceptions import GoogleAPICallError
+from tenacity import wait_exponential, stop_after_attempt, retry_if_exception
+
+import metrics
+from startup import LazyModule
+
+errors = LazyModule('google.genai.errors')
+
+# =================================================================
+# Deadlines, hedged requests and circuit breakers for Gemini calls
+# =================================================================
+# A turn gets one latency budget (TURN_DEADLINE_SECONDS from stop_stream)
+# that STT, LLM and TTS share: every Gemini call waits at most for what is
+# left of it, and a retry is only attempted if its backoff still fits.
+#
+# A call can be hedged: if it has not answered after the stage's recent
+# p95 latency, an identical second request is sent and whichever answers
+# first wins. The loser is left to finish in the background.
+#
+# Each model has a circuit breaker. When too many recent calls failed it
+# opens and calls fail fast (CircuitOpen) without touching the API; after a
+# cool-down one probe call is let through to decide whether to close again.
+#
+# Time a request spends queued for a free connection (RequestSlots) is not
+# model latency. The slots record it in the request's QueueTiming, and the
+# hedger and the model router subtract it, so a saturated pool is not
+# mistaken for a slow model (which would fail over or hedge into the queue).
+
+current_deadline = contextvars.ContextVar('current_deadline', default=None)
+queue_timing = contextvars.ContextVar('queue_timing', default=None)
+
+
+class QueueTiming:
+    """How long one request waited for a connection slot, and whether it still is"""
+
+    def __init__(self):
+        self.waiting = False
+        self.seconds = 0.0
+
+
+# Runs fn (or awaits make_coro()) with its connection-slot wait recorded in `timing`
+def run_timed(timing: QueueTiming, fn):
+    token = queue_timing.set(timing)
+    try:
+        return fn()
+    finally:
+        queue_timing.reset(token)
+
+
+async def arun_timed(timing: QueueTiming, make_coro):
+    token = queue_timing.set(timing)
+    try:
+        return await make_coro()
+    finally:
+        queue_timing.reset(token)
+
+
+# Adds a finished request's slot wait to the caller's QueueTiming, if it keeps one
+def note_queue_wait(seconds: float):
+    timing = queue_timing.get()
+    if timing is not None:
+        timing.seconds += seconds
+
+
+class DeadlineExceeded(Exception):
+    """The turn's latency budget ran out before the call could finish"""
+
+
+class CircuitOpen(Exception):
+    """The model's circuit breaker is open; the call was not attempted"""
+
+
+class Deadline:
+    def __init__(self, seconds: float, started_at: float = None):
+        self.expires_at = (started_at if started_at is not None else time.monotonic()) + seconds
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def check(self):
+        if self.remaining() <= 0:
+            raise DeadlineExceeded()
+
+
+# Transient upstream errors worth retrying: 5xx and 429 from either client library
+def is_retryable_error(error):
+    if isinstance(error, GoogleAPICallError):
+        return True
+    if isinstance(error, errors.ServerError):
+        return True
+    return isinstance(error, errors.ClientError) and error.code == 429
+
+
+# Tenacity stop condition: give up when the next backoff would not leave
+# min_attempt_seconds of the turn's budget for another attempt
+def stop_at_deadline(min_attempt_seconds: float = 0.5):
+    def stop(retry_state):
+        deadline = current_deadline.get()
+        return deadline is not None and deadline.remaining() < retry_state.upcoming_sleep + min_attempt_seconds
+    return stop
+
+
+# Tenacity arguments shared by every Gemini call of both servers (retry,
+# Retrying or AsyncRetrying): transient errors are retried with exponential
+# backoff, up to 5 attempts and only within the turn deadline. `retryable`
+# narrows which errors qualify (a stream that already yielded text must not
+# be retried); retries are counted against `model`, or the call's model argument
+def retry_policy(model: str = None, retryable=is_retryable_error):
+    return dict(
+        wait=wait_exponential(min=1, max=30),   # 1s, 2s, 4s... up to 30s
+        stop=stop_after_attempt(5) | stop_at_deadline(),
+        retry=retry_if_exception(retryable),
+        before_sleep=lambda retry_state: metrics.note_retry(model or retry_state.kwargs.get('model')),
+        reraise=True   # the last error reaches the turn, which answers with the fallback line
+    )
+
+
+class LatencyTracker:
+    """Recent successful call latencies, for the hedge delay"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float):
+        """None until enough samples were seen"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, window_seconds: float = 30, min_calls: int = 10, failure_ratio: float = 0.5,
+                 open_seconds: float = 15):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.open_seconds = open_seconds
+        self.state = 'closed'          # 'closed', 'open' or 'half_open'
+        self._calls = deque()          # (time, failed) within the window
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+        self._stats = {'opened': 0, 'short_circuited': 0}
+
+    def _open(self, now):
+        self.state = 'open'
+        self._opened_at = now
+        self._calls.clear()
+        self._stats['opened'] += 1
+        print(f"Circuit breaker for {self.name} opened")
+
+    def allow(self):
+        """Whether a call may go out now (counts it as short-circuited if not)"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'open' and now - self._opened_at >= self.open_seconds:
+                self.state = 'half_open'
+                self._probe_in_flight = False
+            if self.state == 'closed':
+                return True
+            # A probe that never reported back (abandoned stream, lost hedge) is written off after the cool-down
+            if self.state == 'half_open' and (not self._probe_in_flight
+                                              or now - self._probe_started >= self.open_seconds):
+                self._probe_in_flight = True
+                self._probe_started = now
+                return True
+            self._stats['short_circuited'] += 1
+            return False
+
+    def rejecting(self):
+        """Whether the breaker is open and still cooling down (no state change, unlike allow())"""
+        with self._lock:
+            return self.state == 'open' and time.monotonic() - self._opened_at < self.open_seconds
+
+    def record(self, failed: bool):
+        with self._lock:
+            now = time.monotonic()
+            if self.state == 'half_open':
+                self._probe_in_flight = False
+                if failed:
+                    self._open(now)
+                else:
+                    self.state = 'closed'
+                    print(f"Circuit breaker for {self.name} closed")
+                return
+            if self.state == 'open':
+                return   # a call that was already in flight when the breaker opened
+            self._calls.append((now, failed))
+            while self._calls and self._calls[0][0] < now - self.window_seconds:
+                self._calls.popleft()
+            failures = sum(1 for _, call_failed in self._calls if call_failed)
+            if len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.failure_ratio:
+                self._open(now)
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['state'] = self.state
+            snapshot['window_calls'] = len(self._calls)
+            snapshot['window_failures'] = sum(1 for _, failed in self._calls if failed)
+        return snapshot
+
+
+class HedgedCaller:
+    """
+    Runs blocking calls bounded by the current deadline, hedging them after
+    the stage's p95 latency when enabled. Calls run on a private pool; with
+    neither a deadline nor hedging they run inline. acall() does the same
+    for coroutines.
+    """
+
+    def __init__(self, hedging: bool = False, hedge_percentile: float = 95, min_hedge_delay: float = 0.2,
+                 max_workers: int = 32):
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini-call")
+        self._trackers = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _tracker(self, stage):
+        with self._lock:
+            if stage not in self._trackers:
+                self._trackers[stage] = LatencyTracker()
+                self._stats[stage] = {'calls': 0, 'hedged': 0, 'hedge_wins': 0, 'timeouts': 0}
+            return self._trackers[stage]
+
+    def _count(self, stage, name):
+        with self._lock:
+            self._stats[stage][name] += 1
+
+    def hedge_delay(self, stage):
+        if not self.hedging:
+            return None
+        p95 = self._tracker(stage).percentile(self.hedge_percentile)
+        return None if p95 is None else max(self.min_hedge_delay, p95)
+
+    # How long to wait before something has to happen (deadline or hedge), or None.
+    # The hedge clock starts once the primary request has a connection slot.
+    @staticmethod
+    def _wait_timeout(deadline, started, hedge_delay, hedged, primary_timing):
+        timeout = None if deadline is None else deadline.remaining()
+        if not hedged and hedge_delay is not None:
+            if primary_timing.waiting:
+                until_hedge = hedge_delay   # look again later
+            else:
+                until_hedge = max(0.0, started + primary_timing.seconds + hedge_delay - time.monotonic())
+            timeout = until_hedge if timeout is None else min(timeout, until_hedge)
+        return timeout
+
+    def _won(self, stage, tracker, started, timing, by_hedge, hedged):
+        tracker.observe(time.monotonic() - started - timing.seconds)
+        note_queue_wait(timing.seconds)
+        if by_hedge:
+            self._count(stage, 'hedge_wins')
+            metrics.gemini_hedges.inc(stage=stage, winner='hedge')
+        elif hedged:
+            metrics.gemini_hedges.inc(stage=stage, winner='primary')
+
+    def _timed_out(self, stage, deadline):
+        if deadline is not None and deadline.remaining() <= 0:
+            self._count(stage, 'timeouts')
+            raise DeadlineExceeded(f"{stage} did not answer within the turn deadline")
+
+    # A primary request still queued for a slot is not hedged: the pool is full,
+    # and a second request would only queue behind it
+    def _should_hedge(self, stage, started, hedge_delay, hedged, primary_timing):
+        if (hedged or hedge_delay is None or primary_timing.waiting
+                or time.monotonic() - started - primary_timing.seconds < hedge_delay):
+            return False
+        self._count(stage, 'hedged')
+        return True
+
+    def call(self, stage, fn):
+        tracker = self._tracker(stage)
+        self._count(stage, 'calls')
+        deadline = current_deadline.get()
+        hedge_delay = self.hedge_delay(stage)
+        started = time.monotonic()
+        if deadline is None and hedge_delay is None:
+            timing = QueueTiming()
+            result = run_timed(timing, fn)
+            self._won(stage, tracker, started, timing, False, False)
+            return result
+
+        # Pool threads inherit the caller's context (turn spans, deadline)
+        timings = {}
+
+        def submit():
+            timing = QueueTiming()
+            future = self._executor.submit(contextvars.copy_context().run, run_timed, timing, fn)
+            timings[future] = timing
+            return future
+
+        primary = submit()
+        pending = {primary}
+        hedge = None
+        failures = []
+        while pending:
+            timeout = self._wait_timeout(deadline, started, hedge_delay, hedge is not None, timings[primary])
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failures.append(e)
+                    continue
+                self._won(stage, tracker, started, timings[future], future is hedge, hedge is not None)
+                for loser in pending:
+                    loser.cancel()
+                return result
+            if pending:
+                self._timed_out(stage, deadline)
+                if self._should_hedge(stage, started, hedge_delay, hedge is not None, timings[primary]):
+                    hedge = submit()
+                    pending.add(hedge)
+        raise failures[0]
+
+    async def acall(self, stage, make_coro):
+        """
+        asyncio variant of call(): make_coro() returns a new coroutine per
+        request. The losing request of a hedge is cancelled.
+        """
+        tracker = self._tracker(stage)
+        self._count(stage, 'calls')
+        deadline = current_deadline.get()
+        hedge_delay = self.hedge_delay(stage)
+        started = time.monotonic()
+        timings = {}
+
+        def start():
+            timing = QueueTiming()
+            task = asyncio.ensure_future(arun_timed(timing, make_coro))
+            timings[task] = timing
+            return task
+
+        primary = start()
+        pending = {primary}
+        hedge = None
+        failures = []
+        try:
+            while pending:
+                timeout = self._wait_timeout(deadline, started, hedge_delay, hedge is not None, timings[primary])
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        failures.append(task.exception())
+                        continue
+                    self._won(stage, tracker, started, timings[task], task is hedge, hedge is not None)
+                    return task.result()
+                if pending:
+                    self._timed_out(stage, deadline)
+                    if self._should_hedge(stage, started, hedge_delay, hedge is not None, timings[primary]):
+                        hedge = start()
+                        pending.add(hedge)
+            raise failures[0]
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        with self._lock:
+            snapshot = {stage: dict(counts) for stage, counts in self._stats.items()}
+        for stage, counts in snapshot.items():
+            delay = self.hedge_delay(stage)
+            counts['hedge_delay_ms'] = None if delay is None else round(delay * 1000, 1)
+        return snapshot
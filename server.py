@@ -1,13 +1,46 @@
+import os
+import sys
 import json
+import queue
+import struct
+import atexit
 import wave
+import time
 import uuid
+import secrets
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+import startup   # first of the heavy imports: the startup report times the ones below
 from flask import Flask, request, Response
 from flask_socketio import SocketIO, emit
-from google import genai
-from google.genai import types
-from google.api_core.exceptions import GoogleAPICallError 
-from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_exception_type
+from tenacity import retry, Retrying
+from tts_cache import TTSCache, make_tts_key
+from turn_scheduler import TurnScheduler, TurnCancelled
+from audio_store import AudioStore
+from state_store import MemoryStateStore, RedisStateStore
+from incremental_stt import IncrementalTranscriber
+from reply_cache import ReplyCache
+from conversation import ConversationHistory, PromptPrefixCache
+from gemini_backend import make_backend, PooledBackend, RequestSlots
+from audio_codec import PUSH_FORMATS, MIN_SAMPLE_RATE, MAX_SAMPLE_RATE, parse_sample_rate, ffmpeg_available
+from audio_ingest import AudioIngest
+from session_recorder import SessionRecorder
+from model_router import ModelRouter
+from resilience import (DeadlineExceeded, CircuitOpen, CircuitBreaker, HedgedCaller, QueueTiming, current_deadline,
+                        run_timed, is_retryable_error, retry_policy)
+from turn_pipeline import (turn_scope, classify_turn_error, fallback_audio, SentenceStream, SegmentProgress,
+                           pushed_audio_fields, plan_audio_response, iter_buffer_range, iter_with_fetch_span)
+import metrics
+
+# google-genai is imported on first use or by the warm-up, off the startup path (see startup.py)
+types = startup.LazyModule('google.genai.types')
+
+# Per-turn and per-call detail (stage progress, latencies, routing decisions)
+# is logged at debug level through a queue, off stdout (see LOG_LEVEL)
+log = logging.getLogger("chatbot")
 
 # =================================================================
 # Initial settings
@@ -17,6 +50,163 @@ from tenacity import retry, wait_exponential, stop_after_attempt, retry_if_excep
 # API_KEY = ""
 MODEL_NAME = "gemini-2.5-flash-preview-09-2025"
 TTS_MODEL_NAME = "gemini-2.5-flash-preview-tts"
+TTS_VOICE_NAME = "Charon"  # male: Puck, female: Zephyr/Kore
+TTS_SAMPLE_RATE = 24000
+
+# TTS cache: scene intros never change, so they are rendered once and reused
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", "tts_cache")
+TTS_CACHE_MEMORY_ENTRIES = int(os.environ.get("TTS_CACHE_MEMORY_ENTRIES", "64"))
+PRERENDER_ON_STARTUP = os.environ.get("PRERENDER_ON_STARTUP", "1") == "1"
+
+# Startup warm-up (see startup.py): load the deferred imports, create the Gemini
+# client and probe every configured model; /readyz answers 200 only after that
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "1") == "1"
+WARMUP_RETRY_SECONDS = float(os.environ.get("WARMUP_RETRY_SECONDS", "5"))
+readiness = startup.Readiness(retry_seconds=WARMUP_RETRY_SECONDS)
+readiness.mark('imports')
+
+# Streaming replies: split the LLM output at sentence boundaries and synthesize
+# each sentence while the rest is still being generated. Clients opt in per
+# stream with start_stream {'streaming': true}; this is the default otherwise.
+STREAM_RESPONSES = os.environ.get("STREAM_RESPONSES", "0") == "1"
+STREAM_MIN_SEGMENT_CHARS = 20   # merge very short sentences into the next one
+STREAM_TTS_WORKERS = int(os.environ.get("STREAM_TTS_WORKERS", "4"))
+
+# Pipeline mode: "three_call" runs STT, LLM and TTS as separate calls; "fused"
+# sends the recorded audio straight to the LLM and gets back both the
+# transcript and the reply in one structured response (falls back to
+# three_call if that response cannot be used)
+PIPELINE_MODE = os.environ.get("PIPELINE_MODE", "three_call")
+
+# Reply cache (opt-in): repeated questions within a scene reuse an earlier
+# reply and its audio. Match mode is "exact", "token_set" or "embedding";
+# VARIETY distinct replies are collected per question and then rotated.
+REPLY_CACHE_ENABLED = os.environ.get("REPLY_CACHE", "0") == "1"
+REPLY_CACHE_TTL_SECONDS = float(os.environ.get("REPLY_CACHE_TTL_SECONDS", "3600"))
+REPLY_CACHE_VARIETY = int(os.environ.get("REPLY_CACHE_VARIETY", "3"))
+REPLY_CACHE_MATCH = os.environ.get("REPLY_CACHE_MATCH", "token_set")
+REPLY_CACHE_THRESHOLD = float(os.environ.get("REPLY_CACHE_THRESHOLD", "0.8"))
+
+# Conversation memory: recent turns are sent verbatim, older ones are folded
+# into a running summary once the history exceeds the token budget. The
+# static persona + scene prefix is registered with explicit context caching
+# where the API accepts it.
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "800"))
+HISTORY_KEEP_TURNS = int(os.environ.get("HISTORY_KEEP_TURNS", "2"))
+CONTEXT_CACHING = os.environ.get("CONTEXT_CACHING", "1") == "1"
+CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+
+# Turn scheduling: caps how many turns hit Gemini at once and how many may wait
+TURN_MAX_CONCURRENCY = int(os.environ.get("TURN_MAX_CONCURRENCY", "8"))
+TURN_MAX_QUEUE = int(os.environ.get("TURN_MAX_QUEUE", "32"))
+
+# Turn deadline: STT, LLM and TTS share one latency budget counted from
+# stop_stream; retries stop once it is spent (0 disables). Hedging (opt-in)
+# sends a second identical request when a call is slower than the stage's
+# recent p95. A model's circuit breaker opens when too many of its recent
+# calls fail; turns then get FALLBACK_LINE instead of waiting on retries.
+TURN_DEADLINE_SECONDS = float(os.environ.get("TURN_DEADLINE_SECONDS", "20"))
+HEDGE_REQUESTS = os.environ.get("HEDGE_REQUESTS", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_DELAY_MS = int(os.environ.get("HEDGE_MIN_DELAY_MS", "200"))
+GEMINI_CALL_WORKERS = int(os.environ.get("GEMINI_CALL_WORKERS", "32"))
+BREAKER_WINDOW_SECONDS = float(os.environ.get("BREAKER_WINDOW_SECONDS", "30"))
+BREAKER_MIN_CALLS = int(os.environ.get("BREAKER_MIN_CALLS", "10"))
+BREAKER_FAILURE_RATIO = float(os.environ.get("BREAKER_FAILURE_RATIO", "0.5"))
+BREAKER_OPEN_SECONDS = float(os.environ.get("BREAKER_OPEN_SECONDS", "15"))
+FALLBACK_LINE = os.environ.get("FALLBACK_LINE", "Sorry, Vincent... the memory slipped away for a moment. Tell me again?")
+
+# Model routing: each stage uses the first model of its comma-separated list
+# and moves to the next (faster or cheaper) one while the current one breaches
+# the stage's p95 latency SLO (ROUTER_SLO_P95_MS_<STAGE>, 0 = none) or error
+# ratio. While on a fallback, one call per ROUTER_PROBE_SECONDS tries the tier
+# above; ROUTER_PROBE_SUCCESSES good probes in a row move the stage back up.
+STT_MODELS = [model.strip() for model in os.environ.get("STT_MODELS", MODEL_NAME).split(',') if model.strip()]
+LLM_MODELS = [model.strip() for model in os.environ.get("LLM_MODELS", MODEL_NAME).split(',') if model.strip()]
+TTS_MODELS = [model.strip() for model in os.environ.get("TTS_MODELS", TTS_MODEL_NAME).split(',') if model.strip()]
+ROUTER_SLO_P95_MS = {stage: int(os.environ.get(f"ROUTER_SLO_P95_MS_{stage.upper()}", "0"))
+                     for stage in ('stt', 'llm', 'fused', 'tts')}
+ROUTER_MAX_ERROR_RATIO = float(os.environ.get("ROUTER_MAX_ERROR_RATIO", "0.2"))
+ROUTER_WINDOW_SECONDS = float(os.environ.get("ROUTER_WINDOW_SECONDS", "60"))
+ROUTER_MIN_CALLS = int(os.environ.get("ROUTER_MIN_CALLS", "20"))
+ROUTER_PROBE_SECONDS = float(os.environ.get("ROUTER_PROBE_SECONDS", "10"))
+ROUTER_PROBE_SUCCESSES = int(os.environ.get("ROUTER_PROBE_SUCCESSES", "3"))
+
+# Incremental STT: transcribe the recording in the background while the player
+# is still speaking. Clients opt in per stream with start_stream
+# {'incremental': true}; endpointing ({'endpointing': true}, raw 'pcm16' input
+# only) starts the turn on its own once the player stops talking.
+INCREMENTAL_STT = os.environ.get("INCREMENTAL_STT", "0") == "1"
+STT_WINDOW_SECONDS = float(os.environ.get("STT_WINDOW_SECONDS", "3.0"))
+# WebM/Ogg interim transcripts re-send the whole prefix, so only this many are sent per recording
+STT_MAX_PREFIX_WINDOWS = int(os.environ.get("STT_MAX_PREFIX_WINDOWS", "4"))
+STT_WORKERS = int(os.environ.get("STT_WORKERS", "4"))
+ENDPOINT_SILENCE_MS = int(os.environ.get("ENDPOINT_SILENCE_MS", "700"))
+VAD_ENERGY_THRESHOLD = float(os.environ.get("VAD_ENERGY_THRESHOLD", "500"))  # RMS of 16-bit samples
+PCM_INPUT_SAMPLE_RATE = 16000   # default rate for 'pcm16' input when the client does not say
+
+# Inbound audio normalization before STT (silence trimming, downmix/resample, duration cap)
+INGEST_ENABLED = os.environ.get("INGEST", "1") == "1"
+INGEST_SAMPLE_RATE = int(os.environ.get("INGEST_SAMPLE_RATE", "16000"))   # Gemini STT works at 16 kHz
+INGEST_MAX_SECONDS = float(os.environ.get("INGEST_MAX_SECONDS", "30"))
+INGEST_PAD_MS = int(os.environ.get("INGEST_PAD_MS", "200"))   # silence kept around detected speech
+
+# Audio store for /audio/<audio_id>: memory budget, spill budget and lifetimes
+AUDIO_STORE_MEMORY_MB = int(os.environ.get("AUDIO_STORE_MEMORY_MB", "64"))
+AUDIO_STORE_DISK_MB = int(os.environ.get("AUDIO_STORE_DISK_MB", "512"))
+AUDIO_TTL_SECONDS = float(os.environ.get("AUDIO_TTL_SECONDS", "300"))       # never fetched
+AUDIO_GRACE_SECONDS = float(os.environ.get("AUDIO_GRACE_SECONDS", "30"))    # after first fetch
+AUDIO_CHUNK_BYTES = 64 * 1024   # response body is streamed in chunks of this size
+
+# Session, recording and clip state: 'memory' (one worker) or 'redis' (shared by
+# every worker behind a load balancer, together with a Socket.IO message queue)
+STATE_BACKEND = os.environ.get("STATE_BACKEND", "memory")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+STATE_PREFIX = os.environ.get("STATE_PREFIX", "chatbot")
+SESSION_TTL_SECONDS = int(os.environ.get("SESSION_TTL_SECONDS", "3600"))   # kept this long for a reconnect
+AUDIO_SHARED_DIR = os.environ.get("AUDIO_SHARED_DIR")   # volume all workers mount; clips stay out of Redis
+SOCKETIO_MESSAGE_QUEUE = os.environ.get("SOCKETIO_MESSAGE_QUEUE")   # e.g. redis://localhost:6379/1
+
+# Pushed reply audio: a client may ask in start_stream for reply audio as binary
+# socket frames ('opus', 'pcm16' or 'wav') instead of URLs to download from /audio
+AUDIO_PUSH_WORKERS = int(os.environ.get("AUDIO_PUSH_WORKERS", "2"))
+OPUS_BITRATE = os.environ.get("OPUS_BITRATE", "24k")
+FFMPEG_PATH = os.environ.get("FFMPEG_PATH", "ffmpeg")
+
+# Gemini backend: 'genai' (the real API) or 'fake' (local canned answers, for load tests)
+GEMINI_BACKEND_KIND = os.environ.get("GEMINI_BACKEND", "genai")
+FAKE_GEMINI_OPTIONS = {
+    'latencies': {stage: os.environ.get(f"FAKE_GEMINI_LATENCY_{stage.upper()}")   # e.g. "lognormal:800,0.4"
+                  for stage in ('stt', 'llm', 'fused', 'tts')},
+    'error_rate': float(os.environ.get("FAKE_GEMINI_ERROR_RATE", "0")),          # fraction of calls failing with 503
+    'seed': os.environ.get("FAKE_GEMINI_SEED"),
+    'audio_path': os.environ.get("FAKE_GEMINI_AUDIO"),                           # canned TTS audio (WAV or raw PCM)
+    'model_slowdowns': os.environ.get("FAKE_GEMINI_MODEL_SLOWDOWN"),             # e.g. "gemini-x=4@30-90"
+}
+
+# Gemini connection pool: at most GEMINI_POOL_SIZE requests in flight per worker,
+# each on a kept-alive connection; a request waits up to GEMINI_POOL_ACQUIRE_TIMEOUT
+# seconds for a free one. The warm-up opens GEMINI_POOL_WARM_CONNECTIONS of them.
+GEMINI_POOL_SIZE = int(os.environ.get("GEMINI_POOL_SIZE", "16"))
+GEMINI_POOL_ACQUIRE_TIMEOUT = float(os.environ.get("GEMINI_POOL_ACQUIRE_TIMEOUT", "10"))
+GEMINI_POOL_WARM_CONNECTIONS = int(os.environ.get("GEMINI_POOL_WARM_CONNECTIONS", "4"))
+GEMINI_KEEPALIVE_SECONDS = float(os.environ.get("GEMINI_KEEPALIVE_SECONDS", "60"))
+GEMINI_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_TIMEOUT_SECONDS", "60"))   # per HTTP request
+
+# Latency spans (one JSON line per pipeline stage, written by a background thread)
+SPAN_LOG = os.environ.get("SPAN_LOG", "1") == "1"
+SPAN_LOG_FILE = os.environ.get("SPAN_LOG_FILE")   # default: stderr
+
+# Server log (also written by a background thread); LOG_LEVEL=DEBUG adds per-turn detail
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FILE = os.environ.get("LOG_FILE")   # default: stderr
+
+# Session traffic recording (opt-in): every inbound event of a sampled share of
+# sessions is appended to a log in SESSION_RECORD_DIR, for replay_sessions.py.
+# Audio payloads are only kept (in a binary sidecar) with SESSION_RECORD_AUDIO=1.
+SESSION_RECORD_DIR = os.environ.get("SESSION_RECORD_DIR")
+SESSION_RECORD_AUDIO = os.environ.get("SESSION_RECORD_AUDIO", "0") == "1"
+SESSION_RECORD_SAMPLE = float(os.environ.get("SESSION_RECORD_SAMPLE", "1"))
 
 # Define the persona
 BASE_SYSTEM_INSTRUCTION = """
@@ -102,6 +292,32 @@ MEMORY_SCENES = {
     }
 }
 
+# Builds the full system instruction for a memory scene (None = no scene loaded)
+def build_scene_system_instruction(memory_id):
+    system_instruction = BASE_SYSTEM_INSTRUCTION
+    if memory_id is None:
+        return system_instruction
+
+    memory_scene = MEMORY_SCENES.get(memory_id, {})
+    memory_description = memory_scene.get('description', '')
+    memory_guidance = memory_scene.get('guidance', '')
+    system_instruction += f"\n\nCURRENT MEMORY CONTEXT (Memory {memory_id}):\n{memory_description}"
+    if memory_guidance:
+        system_instruction += f"\n\nYOUR GUIDANCE FOR THIS MEMORY:\n{memory_guidance}"
+    system_instruction += "\n\nRespond to Vincent based on this memory context and your guidance. Stay in character as the AI assistant while subtly guiding him."
+    return system_instruction
+
+
+# The scene prompts never change, so they are built once at startup
+SCENE_SYSTEM_INSTRUCTIONS = {memory_id: build_scene_system_instruction(memory_id) for memory_id in MEMORY_SCENES}
+SCENE_SYSTEM_INSTRUCTIONS[None] = build_scene_system_instruction(None)
+
+HISTORY_SUMMARY_PROMPT = (
+    "Update the running summary of a conversation between Vincent and his guide. "
+    "Keep names, feelings and memories he has recovered; drop small talk. "
+    "Answer with the updated summary only, at most 80 words."
+)
+
 __firebase_config_str = globals().get('__firebase_config', '{}')
 APP_ID = globals().get('__app_id', 'default-app-id')
 INITIAL_AUTH_TOKEN = globals().get('__initial_auth_token', None)
@@ -117,152 +333,594 @@ except json.JSONDecodeError:
 app = Flask(__name__)
 socketio = SocketIO(app, 
                     cors_allowed_origins="*",  # allow CORS
-                    async_mode='threading')
+                    async_mode='threading',
+                    message_queue=SOCKETIO_MESSAGE_QUEUE)  # lets any worker emit to any client
 
-# Storage for incoming audio chunks 
-audio_buffers = {}
-audio_files = {}
-session_contexts = {}  # Store memory context per session
 
-# Initialize the Gemini Client globally
-GEMINI_CLIENT = None
-try:
-    # GEMINI_CLIENT = genai.Client(api_key=API_KEY)
-    GEMINI_CLIENT = genai.Client()
-    print("Gemini Client initialized successfully.")
-except Exception as e:
-    print(f"Warning: Could not initialize Gemini Client immediately: {e}")
+# Session contexts, recording buffers and reply clips (see state_store.py)
+def make_state_store():
+    if STATE_BACKEND == 'redis':
+        return RedisStateStore.from_url(
+            REDIS_URL,
+            prefix=STATE_PREFIX,
+            session_ttl_seconds=SESSION_TTL_SECONDS,
+            audio_ttl_seconds=int(AUDIO_TTL_SECONDS),
+            audio_grace_seconds=int(AUDIO_GRACE_SECONDS),
+            audio_dir=AUDIO_SHARED_DIR,
+            object_fields={'history': ConversationHistory}
+        )
+    if STATE_BACKEND != 'memory':
+        raise ValueError(f"Unknown STATE_BACKEND: {STATE_BACKEND}")
+    return MemoryStateStore(AudioStore(
+        max_memory_bytes=AUDIO_STORE_MEMORY_MB * 1024 * 1024,
+        max_disk_bytes=AUDIO_STORE_DISK_MB * 1024 * 1024,
+        ttl_seconds=AUDIO_TTL_SECONDS,
+        grace_seconds=AUDIO_GRACE_SECONDS
+    ), session_ttl_seconds=SESSION_TTL_SECONDS, object_fields={'history': ConversationHistory})
+
+
+state_store = make_state_store()
+session_keys = {}  # sid -> state store key of its session (a server-issued key survives reconnects)
+transcribers = {}  # Incremental transcriber per session (opt-in); the connection is sticky, so kept locally
+history_locks = {}  # sid -> lock ordering a turn's history save against scene loads and resets
+
+
+# A session is stored under its Socket.IO sid, or under a key the server
+# issued the client, so that it survives a reconnect (possibly to another worker)
+def session_key(sid):
+    return session_keys.get(sid, sid)
+
+
+# Resumable sessions: a client opts in with auth {'session': key} or
+# ?session=key, where key is the one the server sent it in a 'session_key'
+# event on an earlier connect (empty or null the first time). Returns the
+# presented key, '' for a client asking for its first key, or None for a
+# client that did not opt in.
+def requested_session_key(auth, query):
+    if isinstance(auth, dict) and 'session' in auth:
+        return str(auth['session'] or '')
+    if 'session' in query:
+        return query.get('session') or ''
+    return None
+
+
+# Points the connection at its session: the presented key's session if it is
+# live, else a new session under sid or, for a client that opted in, under a
+# fresh random key. A key is only adopted once the server has issued it, so a
+# session cannot be taken over by guessing or choosing its key.
+# Returns (session or None for a new one, newly issued key or None).
+def attach_session(sid, requested_key):
+    if requested_key:
+        session_keys[sid] = f"client:{requested_key}"
+        session = get_session(sid)
+        if session:
+            return session, None
+    issued_key = secrets.token_urlsafe(32) if requested_key is not None else None
+    session_keys[sid] = f"client:{issued_key}" if issued_key else sid
+    return None, issued_key
+
+
+# The session's context as a dict (a copy: save changes with update_session)
+def get_session(sid):
+    return state_store.load_session(session_key(sid)) or {}
+
+
+def update_session(sid, **fields):
+    state_store.update_session(session_key(sid), fields)
+
+
+def new_history():
+    return ConversationHistory(token_budget=HISTORY_TOKEN_BUDGET, keep_recent_turns=HISTORY_KEEP_TURNS)
+
+
+# Logs an event of a recorded session (no-op unless SESSION_RECORD_DIR is set)
+def record_event(sid, event, audio=None, **fields):
+    if session_recorder is not None:
+        session_recorder.record(sid, event, audio=audio, **fields)
+
+
+tts_cache = TTSCache(cache_dir=TTS_CACHE_DIR, max_memory_entries=TTS_CACHE_MEMORY_ENTRIES)
+reply_cache = ReplyCache(
+    ttl_seconds=REPLY_CACHE_TTL_SECONDS,
+    variety=REPLY_CACHE_VARIETY,
+    match=REPLY_CACHE_MATCH,
+    threshold=REPLY_CACHE_THRESHOLD
+)
+prompt_prefix_cache = PromptPrefixCache(lambda model, config: create_context_cache(model, config), MODEL_NAME,
+                                         ttl_seconds=CONTEXT_CACHE_TTL_SECONDS)
+audio_ingest = AudioIngest(
+    target_rate=INGEST_SAMPLE_RATE,
+    max_seconds=INGEST_MAX_SECONDS,
+    energy_threshold=VAD_ENERGY_THRESHOLD,
+    pad_ms=INGEST_PAD_MS,
+    ffmpeg_path=FFMPEG_PATH
+)
+# Started with the worker (see start_worker): the turn scheduler and executors
+# of the threading server, and the session recorder
+turn_scheduler = None
+tts_executor = stt_executor = encode_executor = None
+session_recorder = None
+
+# Initialize the Gemini backend globally (the real client unless GEMINI_BACKEND=fake),
+# with every request going through the connection pool's slots
+gemini_slots = RequestSlots(GEMINI_POOL_SIZE, acquire_timeout=GEMINI_POOL_ACQUIRE_TIMEOUT,
+                            on_wait=metrics.gemini_pool_wait.observe)
+GEMINI_BACKEND = PooledBackend(make_backend(GEMINI_BACKEND_KIND, FAKE_GEMINI_OPTIONS, client_options={
+    'pool_size': GEMINI_POOL_SIZE,
+    'keepalive_seconds': GEMINI_KEEPALIVE_SECONDS,
+    'timeout_seconds': GEMINI_TIMEOUT_SECONDS,
+}), gemini_slots)
+
+# Deadline-bounded (and optionally hedged) calls, and one circuit breaker per model
+gemini_caller = HedgedCaller(hedging=HEDGE_REQUESTS, hedge_percentile=HEDGE_PERCENTILE,
+                             min_hedge_delay=HEDGE_MIN_DELAY_MS / 1000, max_workers=GEMINI_CALL_WORKERS)
+circuit_breakers = {
+    model: CircuitBreaker(model, window_seconds=BREAKER_WINDOW_SECONDS, min_calls=BREAKER_MIN_CALLS,
+                          failure_ratio=BREAKER_FAILURE_RATIO, open_seconds=BREAKER_OPEN_SECONDS)
+    for model in dict.fromkeys([MODEL_NAME, TTS_MODEL_NAME] + STT_MODELS + LLM_MODELS + TTS_MODELS)
+}
+
+# Which model each stage's calls go to (summaries and fused turns use the LLM tiers)
+model_router = ModelRouter(
+    tiers={'stt': STT_MODELS, 'llm': LLM_MODELS, 'fused': LLM_MODELS, 'summarize': LLM_MODELS, 'tts': TTS_MODELS},
+    slo_seconds={stage: ms / 1000 for stage, ms in ROUTER_SLO_P95_MS.items() if ms},
+    max_error_ratio=ROUTER_MAX_ERROR_RATIO,
+    window_seconds=ROUTER_WINDOW_SECONDS,
+    min_calls=ROUTER_MIN_CALLS,
+    probe_seconds=ROUTER_PROBE_SECONDS,
+    probe_successes=ROUTER_PROBE_SUCCESSES,
+    is_available=lambda model: not circuit_breakers[model].rejecting()
+)
+
+
+# =================================================================
+# Startup warm-up and readiness
+# =================================================================
+
+# Models to probe at startup: every model a stage can be routed to (so a typo in
+# a fallback tier shows up at startup), cycled until GEMINI_POOL_WARM_CONNECTIONS
+# probes run at once, each opening a pooled connection the first turns then reuse
+def warmup_probes():
+    models = list(circuit_breakers)
+    count = min(GEMINI_POOL_SIZE, max(len(models), GEMINI_POOL_WARM_CONNECTIONS))
+    return [models[i % len(models)] for i in range(count)]
+
+
+def probe_models():
+    probes = warmup_probes()
+    with ThreadPoolExecutor(max_workers=len(probes), thread_name_prefix="warm-up-probe") as executor:
+        list(executor.map(GEMINI_BACKEND.probe, probes))
+
+
+if WARMUP_ON_STARTUP:
+    readiness.add_check('imports', startup.load_deferred_modules)
+    readiness.add_check('gemini_client', GEMINI_BACKEND.connect)
+    readiness.add_check('models', probe_models)
 
 
 # =================================================================
 # Retry-Enabled API Wrapper Function (for 503 Service Unavailable)
 # =================================================================
 
-# Listens specifically for GoogleAPICallError (includes 503)
-@retry(
-    wait=wait_exponential(min=1, max=30),  # Exponential backoff: wait 1s, 2s, 4s... up to 30s
-    stop=stop_after_attempt(5),            # Retry up to 5 times total
-    retry=retry_if_exception_type(GoogleAPICallError), 
-    reraise=True  # If all 5 attempts fail, raise the exception so the main loop catches it
-)
-def get_gemini_response_with_retry(model: str, contents: list, config: types.GenerateContentConfig = None):
-    global GEMINI_CLIENT
-    if not GEMINI_CLIENT:
-        try:
-            GEMINI_CLIENT = genai.Client()
-        except Exception:
-            raise Exception("Gemini Client not initialized.")
-            
+# Checks the turn deadline and the model's circuit breaker before a Gemini call
+def admit_gemini_call(model: str):
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.check()
+    breaker = circuit_breakers.get(model)
+    if breaker is not None and not breaker.allow():
+        metrics.gemini_short_circuits.inc(model=model)
+        raise CircuitOpen(f"Circuit breaker for {model} is open")
+    return breaker
+
+
+# Feeds a call's outcome to the breaker and, given the stage and start time, to
+# the model router: upstream errors and timeouts count as failures. The call's
+# wait for a connection slot (`queued`) is not held against the model.
+def settle_gemini_call(model: str, breaker, error=None, stage: str = None, started: float = None,
+                       queued: QueueTiming = None):
+    if error is not None:
+        metrics.note_gemini_error(model, error)
+    failed = error is not None and (is_retryable_error(error) or isinstance(error, DeadlineExceeded))
+    if breaker is not None:
+        breaker.record(failed=failed)
+    if stage is not None and started is not None:
+        waited = queued.seconds if queued is not None else 0.0
+        model_router.observe(stage, model, time.monotonic() - started - waited, failed, started=started)
+
+
+# Picks the model for a stage's next call and notes the decision in the turn's metadata
+def route_model(stage: str):
+    model, decision = model_router.route(stage)
+    metrics.gemini_routes.inc(stage=stage, model=model, decision=decision)
+    context = metrics.turn_context.get()
+    if context is not None:
+        context['routes'][stage] = {'model': model, 'decision': decision}
+    if decision != 'primary':
+        log.debug("[%s] %s routed to %s (%s)", context['sid'] if context else '-', stage, model, decision)
+    return model
+
+
+# Retries transient errors (5xx, 429) with exponential backoff, but only
+# while the turn's deadline leaves room for the wait and another attempt.
+# `stage` names the pipeline stage for hedge latency tracking (defaults to the model).
+@retry(**retry_policy())
+def get_gemini_response_with_retry(model: str, contents: list, config: 'types.GenerateContentConfig' = None,
+                                   stage: str = None):
     # The actual API call happens here
     # Tenacity will re-run this specific line if a 503 occurs
-    return GEMINI_CLIENT.models.generate_content(
-        model=model,
-        contents=contents, 
-        config=config
-    )
+    breaker = admit_gemini_call(model)
+    started = time.monotonic()
+    queued = QueueTiming()
+    try:
+        response = run_timed(queued, lambda: gemini_caller.call(
+            stage or model, lambda: GEMINI_BACKEND.generate_content(
+                model=model,
+                contents=contents, 
+                config=config
+            )))
+    except Exception as e:
+        settle_gemini_call(model, breaker, e, stage, started, queued)
+        raise
+    settle_gemini_call(model, breaker, stage=stage, started=started, queued=queued)
+    return response
+
+
+# Yields a Gemini stream's chunks. With a deadline, the stream is read on a
+# reader thread and every wait for a chunk (the first one included) is bounded
+# by what is left of it, so a stalled stream fails the turn's budget instead of
+# running into the transport timeout. The first read, which waits for a
+# connection slot, is timed in `queued`.
+def read_stream_within_deadline(chunks, deadline, queued: QueueTiming):
+    if deadline is None:
+        chunk = run_timed(queued, lambda: next(chunks, None))
+        while chunk is not None:
+            yield chunk
+            chunk = next(chunks, None)
+        return
+
+    reads = queue.Queue()
+    stopped = threading.Event()
+
+    def reader():
+        try:
+            chunk = run_timed(queued, lambda: next(chunks, None))
+            while chunk is not None and not stopped.is_set():
+                reads.put((chunk, None))
+                chunk = next(chunks, None)
+        except Exception as e:
+            reads.put((None, e))
+            return
+        finally:
+            chunks.close()   # releases the connection slot when the caller stopped reading
+        reads.put((None, None))
+
+    threading.Thread(target=contextvars.copy_context().run, args=(reader,), name="gemini-stream",
+                     daemon=True).start()
+    try:
+        while True:
+            try:
+                chunk, error = reads.get(timeout=max(0.0, deadline.remaining()))
+            except queue.Empty:
+                raise DeadlineExceeded("Gemini stream stalled past the turn deadline")
+            if error is not None:
+                raise error
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        stopped.set()
+
+
+# Streaming variant: yields text chunks as the model produces them.
+# A failed stream is retried only while nothing has been yielded yet,
+# otherwise the caller would receive duplicated text. Streams are not
+# hedged; waiting for each chunk is bounded by the deadline.
+def get_gemini_stream_with_retry(model: str, contents: list, config: 'types.GenerateContentConfig' = None,
+                                 stage: str = 'llm'):
+    yielded = False
+    for attempt in Retrying(**retry_policy(model, lambda e: is_retryable_error(e) and not yielded)):
+        with attempt:
+            breaker = admit_gemini_call(model)
+            deadline = current_deadline.get()
+            started = time.monotonic()
+            queued = QueueTiming()
+            try:
+                for chunk in read_stream_within_deadline(GEMINI_BACKEND.generate_content_stream(
+                    model=model,
+                    contents=contents,
+                    config=config
+                ), deadline, queued):
+                    if deadline is not None:
+                        deadline.check()
+                    if chunk.text:
+                        yielded = True
+                        yield chunk.text
+            except Exception as e:
+                settle_gemini_call(model, breaker, e, stage, started, queued)
+                raise
+            settle_gemini_call(model, breaker, stage=stage, started=started, queued=queued)
+
+
+# Creates an explicit context cache like any other Gemini call: behind the
+# model's circuit breaker, with the turn's remaining budget as the request timeout
+def create_context_cache(model: str, config: 'types.CreateCachedContentConfig'):
+    breaker = admit_gemini_call(model)
+    deadline = current_deadline.get()
+    if deadline is not None:
+        timeout_ms = max(1, int(deadline.remaining() * 1000))
+        config = config.model_copy(update={'http_options': types.HttpOptions(timeout=timeout_ms)})
+    try:
+        cache = GEMINI_BACKEND.create_cached_content(model, config)
+    except Exception as e:
+        if deadline is not None and deadline.remaining() <= 0:
+            e = DeadlineExceeded(f"Context cache creation outlived the turn deadline: {e}")
+        settle_gemini_call(model, breaker, e)
+        raise e
+    settle_gemini_call(model, breaker)
+    return cache
 
 
 # =================================================================
 # Function definitions
 # =================================================================
 
+NO_TRANSCRIPT = "Could not transcribe audio."
+STT_PROMPT = "Transcribe this audio clip exactly as spoken."
+
+
 # Transcribes audio using the Gemini API (with retry)
 def transcribe_audio(audio_io: BytesIO, mime_type: str = 'audio/webm'):
-    print(f"Starting Transcription for {audio_io.getbuffer().nbytes} bytes.")
+    log.debug("Starting transcription for %d bytes", audio_io.getbuffer().nbytes)
     audio_part = types.Part.from_bytes(
         data=audio_io.getvalue(),
         mime_type=mime_type
     )
-    response = get_gemini_response_with_retry(
-        model=MODEL_NAME,
-        contents=[audio_part, "Transcribe this audio clip exactly as spoken."],
-    )
-    return response.text.strip() if response.text else "Could not transcribe audio."
+    model = route_model('stt')
+    with metrics.span('stt', bytes_in=len(audio_part.inline_data.data), model=model) as stt_span:
+        response = get_gemini_response_with_retry(
+            model=model,
+            contents=[audio_part, STT_PROMPT],
+            stage='stt'
+        )
+        text = response.text.strip() if response.text else NO_TRANSCRIPT
+        stt_span['bytes_out'] = len(text.encode())
+    return text
+
+
+# Transcribes a complete recording (or an incremental STT window of one) given
+# as bytes, normalized exactly like a whole recording first (see ingest_recording):
+# resampled to the STT rate and trimmed of silence. Returns None when nothing
+# could be transcribed, or there was no speech to transcribe.
+def transcribe_recording(sid, data: bytes, is_pcm: bool, window: bool = False,
+                         sample_rate: int = PCM_INPUT_SAMPLE_RATE):
+    audio = ingest_recording(sid, data, 'pcm16' if is_pcm else None, sample_rate, window=window)
+    if audio is None:
+        return None
+    text = transcribe_audio(BytesIO(audio[0]), mime_type=audio[1])
+    return None if text == NO_TRANSCRIPT else text
+
+
+# Text generation config: references the cached persona prefix when there is
+# one, otherwise sends the system instruction inline. The prefix cache belongs
+# to MODEL_NAME, so a call routed to another model gets the instruction inline.
+def make_text_config(system_instruction: str, cached_content: str = None, model: str = MODEL_NAME, **kwargs):
+    if cached_content and model == prompt_prefix_cache.model:
+        return types.GenerateContentConfig(cached_content=cached_content, **kwargs)
+    return types.GenerateContentConfig(system_instruction=system_instruction, **kwargs)
+
+
+# History contents followed by the new user message
+def conversation_contents(history, *parts):
+    user_parts = [types.Part(text=part) if isinstance(part, str) else part for part in parts]
+    return list(history or []) + [types.Content(role='user', parts=user_parts)]
 
 
 # Generates LLM text response and then TTS audio based on the text.
 # Returns raw PCM bytes instead of base64.
-def generate_response_and_tts(text_prompt: str, system_instruction: str):
-    print(f"Starting LLM and TTS Generation for prompt: '{text_prompt[:50]}...'")
+def generate_response_and_tts(text_prompt: str, system_instruction: str, history: list = None,
+                              cached_content: str = None):
+    log.debug("Starting LLM and TTS generation for prompt: '%s...'", text_prompt[:50])
 
     # 1. Generate TEXT Response using the standard LLM
-    text_config = types.GenerateContentConfig(
-        system_instruction=system_instruction
-    )
-    llm_response = get_gemini_response_with_retry(
-        model=MODEL_NAME, 
-        contents=[text_prompt],
-        config=text_config 
-    )
-    generated_text = llm_response.text.strip()
+    model = route_model('llm')
+    text_config = make_text_config(system_instruction, cached_content, model=model)
+    with metrics.span('llm', bytes_in=len(text_prompt.encode()), model=model) as llm_span:
+        llm_response = get_gemini_response_with_retry(
+            model=model, 
+            contents=conversation_contents(history, text_prompt),
+            config=text_config,
+            stage='llm'
+        )
+        generated_text = llm_response.text.strip()
+        llm_span['bytes_out'] = len(generated_text.encode())
     
     # 2. Generate AUDIO (TTS) Response
-    tts_config = types.GenerateContentConfig(
-        response_modalities=["AUDIO"], 
-        speech_config=types.SpeechConfig(
-            voice_config=types.VoiceConfig(
-                prebuilt_voice_config=types.PrebuiltVoiceConfig(
-                    voice_name="Charon") # male: Puck, female: Zephyr/Kore
-            )
+    audio_bytes = synthesize_speech(generated_text)
+
+    return generated_text, audio_bytes
+
+
+# Streams the LLM response and synthesizes each sentence as soon as it is
+# complete, so TTS of sentence N overlaps generation of sentence N+1.
+# on_segment(index, text, pcm_bytes) is called in order from the calling thread.
+# Returns the full generated text.
+# If reply_text is given (fused mode already generated it), only the TTS part runs.
+def generate_streaming_response_and_tts(text_prompt: str, system_instruction: str, on_segment, cancel_token=None,
+                                        reply_text: str = None, history: list = None, cached_content: str = None):
+    if reply_text is not None:
+        text_chunks = [reply_text + " "]
+    else:
+        log.debug("Starting streaming LLM and TTS generation for prompt: '%s...'", text_prompt[:50])
+        model = route_model('llm')
+        text_config = make_text_config(system_instruction, cached_content, model=model)
+        text_chunks = get_gemini_stream_with_retry(
+            model=model,
+            contents=conversation_contents(history, text_prompt),
+            config=text_config
         )
+
+    pending = []   # (text, future) in sentence order
+    next_index = 0
+    sentence_stream = SentenceStream(text_prompt, STREAM_MIN_SEGMENT_CHARS, replayed=reply_text is not None)
+
+    def submit(sentence):
+        # The TTS worker inherits this turn's context so its span is attributed to the turn
+        pending.append((sentence, tts_executor.submit(contextvars.copy_context().run, synthesize_speech, sentence)))
+
+    def drain(block):
+        nonlocal next_index
+        while pending and (block or pending[0][1].done()):
+            sentence, future = pending.pop(0)
+            on_segment(next_index, sentence, future.result())
+            next_index += 1
+
+    try:
+        for chunk_text in text_chunks:
+            if cancel_token:
+                cancel_token.raise_if_cancelled()
+            for sentence in sentence_stream.feed(chunk_text):
+                submit(sentence)
+            drain(block=False)
+
+        for sentence in sentence_stream.finish():
+            submit(sentence)
+        drain(block=True)
+    finally:
+        for _, future in pending:
+            future.cancel()
+    return sentence_stream.text
+
+
+FUSED_PROMPT = (
+    "This audio clip is Vincent speaking to you. First transcribe exactly what he says, "
+    "then reply to him in character. Return the transcript and your reply."
+)
+
+# A plain dict (validated into types.Schema by the config), so building it does not import google-genai
+FUSED_RESPONSE_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'transcript': {'type': 'STRING'},
+        'reply': {'type': 'STRING'},
+    },
+    'required': ['transcript', 'reply']
+}
+
+
+# Fused mode: one LLM call that listens to the audio and answers it.
+# Returns (transcript, reply); raises ValueError if the structured output is unusable.
+def generate_fused_response(audio_bytes: bytes, mime_type: str, system_instruction: str, history: list = None,
+                            cached_content: str = None):
+    log.debug("Starting fused transcription and response for %d bytes", len(audio_bytes))
+    audio_part = types.Part.from_bytes(
+        data=audio_bytes,
+        mime_type=mime_type
     )
-    tts_response = get_gemini_response_with_retry(
-        model=TTS_MODEL_NAME, 
-        contents=[generated_text],
-        config=tts_config 
+    model = route_model('fused')
+    with metrics.span('fused', bytes_in=len(audio_bytes), model=model) as fused_span:
+        response = get_gemini_response_with_retry(
+            model=model,
+            contents=conversation_contents(history, audio_part, FUSED_PROMPT),
+            config=make_fused_config(system_instruction, cached_content, model),
+            stage='fused'
+        )
+        fused_span['bytes_out'] = len((response.text or "").encode())
+    return parse_fused_response(response)
+
+
+def make_fused_config(system_instruction: str, cached_content: str = None, model: str = MODEL_NAME):
+    return make_text_config(
+        system_instruction,
+        cached_content,
+        model=model,
+        response_mime_type="application/json",
+        response_schema=FUSED_RESPONSE_SCHEMA
     )
 
-    # 3. Extract audio data - raw bytes, not base64
-    audio_data_part = next((part for part in tts_response.candidates[0].content.parts if part.inline_data and part.inline_data.mime_type.startswith("audio/")), None)
-    if audio_data_part:
-        audio_bytes = audio_data_part.inline_data.data
-        print(f"TTS audio generated, raw bytes size: {len(audio_bytes)}")
-    else:
-        audio_bytes = None
-        print("Warning: TTS audio data not found in response.")
 
-    return generated_text, audio_bytes
+# (transcript, reply) from a fused response; ValueError if it is unusable
+def parse_fused_response(response):
+    try:
+        result = json.loads(response.text)
+        transcript = result['transcript'].strip()
+        reply = result['reply'].strip()
+    except (TypeError, KeyError, AttributeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Unusable fused response: {e}")
+    if not reply:
+        raise ValueError("Fused response has an empty reply")
+    return transcript or NO_TRANSCRIPT, reply
 
 
-def generate_tts_only(text: str):
-    """Generate TTS audio from pre-written text without LLM processing"""
-    print(f"Generating TTS for pre-defined text: '{text[:50]}...'")
-    
-    tts_config = types.GenerateContentConfig(
+def make_tts_config():
+    return types.GenerateContentConfig(
         response_modalities=["AUDIO"], 
         speech_config=types.SpeechConfig(
             voice_config=types.VoiceConfig(
                 prebuilt_voice_config=types.PrebuiltVoiceConfig(
-                    voice_name="Charon"
+                    voice_name=TTS_VOICE_NAME
                 )
             )
         )
     )
-    tts_response = get_gemini_response_with_retry(
-        model=TTS_MODEL_NAME, 
-        contents=[text],
-        config=tts_config 
-    )
 
-    audio_data_part = next((part for part in tts_response.candidates[0].content.parts 
-                           if part.inline_data and part.inline_data.mime_type.startswith("audio/")), None)
+
+# The audio part of a TTS response, or None
+def find_audio_part(tts_response):
+    return next((part for part in tts_response.candidates[0].content.parts 
+                 if part.inline_data and part.inline_data.mime_type.startswith("audio/")), None)
+
+
+# Calls the TTS model and returns raw PCM bytes (or None if no audio came back)
+def synthesize_speech(text: str):
+    model = route_model('tts')
+    with metrics.span('tts', bytes_in=len(text.encode()), model=model) as tts_span:
+        tts_response = get_gemini_response_with_retry(
+            model=model, 
+            contents=[text],
+            config=make_tts_config(),
+            stage='tts'
+        )
+
+        audio_data_part = find_audio_part(tts_response)
+        tts_span['bytes_out'] = len(audio_data_part.inline_data.data) if audio_data_part else 0
     if audio_data_part:
         audio_bytes = audio_data_part.inline_data.data
-        print(f"TTS audio generated, raw bytes size: {len(audio_bytes)}")
+        log.debug("TTS audio generated, raw bytes size: %d", len(audio_bytes))
         return audio_bytes
     else:
-        print("Warning: TTS audio data not found in response.")
+        log.warning("TTS audio data not found in response")
         return None
 
 
-# Create WAV file from raw PCM bytes
-def create_wav_from_pcm(pcm_bytes, sample_rate=24000, num_channels=1):
-    import struct
+def generate_tts_only(text: str):
+    """Generate TTS audio from pre-written text without LLM processing (cached)"""
+    log.debug("Generating TTS for pre-defined text: '%s...'", text[:50])
+    # Keyed by the primary TTS model whichever tier renders it, so a slow spell does not empty the cache
+    return tts_cache.get_or_render(text, TTS_VOICE_NAME, TTS_MODEL_NAME, TTS_SAMPLE_RATE, synthesize_speech)
+
+
+# Renders every scene intro (and the fallback line) into the TTS cache so
+# load_memory never waits on TTS and a failing turn always has something to say
+def prerender_scene_intros():
+    for memory_id, memory_scene in MEMORY_SCENES.items():
+        try:
+            generate_tts_only(memory_scene['intro_text'])
+        except Exception as e:
+            print(f"Warning: Could not pre-render intro for M-{memory_id}: {e}")
+    try:
+        generate_tts_only(FALLBACK_LINE)
+    except Exception as e:
+        print(f"Warning: Could not pre-render the fallback line: {e}")
+    print(f"Scene intro pre-render finished. TTS cache stats: {tts_cache.stats()}")
+
+
+# Build the 44-byte WAV header for a PCM body of data_size bytes
+def create_wav_header(data_size, sample_rate=TTS_SAMPLE_RATE, num_channels=1):
     bits_per_sample = 16
     byte_rate = sample_rate * num_channels * bits_per_sample // 8
     block_align = num_channels * bits_per_sample // 8
-    data_size = len(pcm_bytes)
-    wav_header = struct.pack(
+    return struct.pack(
         '<4sI4s4sIHHIIHH4sI',
         b'RIFF',
         36 + data_size,  # chunk size
@@ -278,7 +936,12 @@ def create_wav_from_pcm(pcm_bytes, sample_rate=24000, num_channels=1):
         b'data',
         data_size
     )
-    return wav_header + pcm_bytes
+
+
+# Create WAV file from raw PCM bytes
+# (copies the PCM; publish_audio keeps header and body as separate buffers instead)
+def create_wav_from_pcm(pcm_bytes, sample_rate=TTS_SAMPLE_RATE, num_channels=1):
+    return create_wav_header(len(pcm_bytes), sample_rate, num_channels) + pcm_bytes
 
 
 # Helper function to save audio Base64 bytes to wave file
@@ -290,49 +953,246 @@ def wave_file(filename, pcm, channels=1, rate=24000, sample_width=2):
         wf.writeframes(pcm)
 
 
+# Stores a PCM clip as WAV for download and returns (audio_id, audio_url, duration).
+# Header and PCM are stored as separate buffers, so the PCM is never copied.
+# Pass a stable audio_id for content that repeats (scene intros) so clients can revalidate.
+def publish_audio(pcm_bytes, host, audio_id=None):
+    with metrics.span('wav', bytes_in=len(pcm_bytes)) as wav_span:
+        wav_header = create_wav_header(len(pcm_bytes), sample_rate=TTS_SAMPLE_RATE)
+        audio_id = audio_id or str(uuid.uuid4())
+        state_store.put_audio(audio_id, (wav_header, pcm_bytes))
+        wav_span['bytes_out'] = len(wav_header) + len(pcm_bytes)
+    audio_url = f"http://{host}/audio/{audio_id}"
+    return audio_id, audio_url, len(pcm_bytes) / (TTS_SAMPLE_RATE * 2)
+
+
+# The pushed PCM rate a client asked for, capped at the TTS rate (replies are
+# never upsampled); a missing, malformed or out of range rate gets the TTS rate
+def push_sample_rate(value):
+    sample_rate = parse_sample_rate(value)
+    return TTS_SAMPLE_RATE if sample_rate is None else min(sample_rate, TTS_SAMPLE_RATE)
+
+
+INVALID_SAMPLE_RATE = f"Invalid sample_rate: expected {MIN_SAMPLE_RATE}-{MAX_SAMPLE_RATE} Hz."
+
+
+# Picks the reply-audio delivery for a start_stream request: None (URLs, the
+# default) or {'format', 'sample_rate'} for pushed binary frames
+def negotiate_audio_delivery(data):
+    if data.get('audio_delivery') != 'push':
+        return None
+    audio_format = data.get('audio_format', 'pcm16')
+    if audio_format not in PUSH_FORMATS or (audio_format == 'opus' and not ffmpeg_available(FFMPEG_PATH)):
+        audio_format = 'pcm16'
+    sample_rate = push_sample_rate(data.get('audio_sample_rate', TTS_SAMPLE_RATE))
+    return {'format': audio_format, 'sample_rate': 48000 if audio_format == 'opus' else sample_rate}
+
+
+# Sends a reply clip to the session as `event`, merged into `payload`: an
+# /audio URL by default, or the encoded clip itself when the session asked
+# for pushed audio. Encoding runs on the encode executor; a clip whose turn
+# was cancelled meanwhile is dropped. Returns (audio_id, duration, future),
+# where future completes once a pushed clip is sent (None for URLs).
+def deliver_audio(sid, event, pcm_bytes, host, payload, audio_id=None, cancel_token=None):
+    delivery = get_session(sid).get('delivery')
+    if delivery is None:
+        audio_id, audio_url, duration = publish_audio(pcm_bytes, host, audio_id=audio_id)
+        socketio.emit(event, {**payload, 'audio_url': audio_url, 'audio_id': audio_id, 'duration': duration}, room=sid)
+        return audio_id, duration, None
+
+    audio_id = audio_id or str(uuid.uuid4())
+    duration = len(pcm_bytes) / (TTS_SAMPLE_RATE * 2)
+
+    def encode_and_emit():
+        try:
+            fields = pushed_audio_fields(audio_id, pcm_bytes, TTS_SAMPLE_RATE, delivery, OPUS_BITRATE, FFMPEG_PATH)
+        except Exception as e:
+            log.error("[%s] Error encoding pushed audio: %s", sid, e)
+            return
+        if cancel_token and cancel_token.cancelled:
+            return
+        socketio.emit(event, {**payload, **fields}, room=sid)
+
+    future = encode_executor.submit(contextvars.copy_context().run, encode_and_emit)
+    return audio_id, duration, future
+
+
+# Live values read at scrape time, next to the span histograms and counters;
+# the turn gauges describe `turns`, the worker's turn scheduler
+def register_gauges(turns):
+    metrics.registry.register(metrics.Gauge(
+        "chatbot_active_sessions", "Socket.IO sessions connected to this worker", lambda: len(session_keys)))
+    metrics.registry.register(metrics.Gauge(
+        "chatbot_turn_queue_depth", "Turns waiting for a scheduler worker", lambda: turns.stats()['queued']))
+    metrics.registry.register(metrics.Gauge(
+        "chatbot_turns_running", "Turns currently running", lambda: turns.stats()['running']))
+    metrics.registry.register(metrics.Gauge(
+        "chatbot_audio_store_bytes", "Bytes held by the audio store",
+        lambda: [({'tier': tier}, state_store.audio_stats()[f'{tier}_bytes']) for tier in ('memory', 'disk')]))
+    metrics.registry.register(metrics.Gauge(
+        "chatbot_circuit_breaker_state", "Gemini circuit breaker per model (0 closed, 1 half-open, 2 open)",
+        lambda: [({'model': model}, ('closed', 'half_open', 'open').index(breaker.state))
+                 for model, breaker in circuit_breakers.items()]))
+    metrics.registry.register(metrics.Gauge(
+        "chatbot_router_tier", "Model tier each stage is routed to (0 = primary)",
+        lambda: [({'stage': stage}, model_router.active_tier(stage)) for stage in model_router.tiers]))
+    metrics.registry.register(metrics.Gauge(
+        "chatbot_audio_store_entries", "Clips held by the audio store", lambda: state_store.audio_stats()['entries']))
+    metrics.registry.register(metrics.Gauge(
+        "chatbot_gemini_pool_in_use", "Gemini request slots (pooled connections) in use",
+        lambda: gemini_slots.stats()['in_use']))
+    metrics.registry.register(metrics.Gauge(
+        "chatbot_gemini_pool_waiting", "Gemini requests waiting for a free pooled connection",
+        lambda: gemini_slots.stats()['waiting']))
+    metrics.registry.register(metrics.Gauge(
+        "chatbot_ready", "Whether every startup warm-up check has passed (1) or not (0)", lambda: int(readiness.ready)))
+
+
 # =================================================================
 # WebSocket Handlers
 # =================================================================
 
 @app.route('/audio/<audio_id>')
 def get_audio(audio_id):
-    """Serve audio file directly"""
-    if audio_id in audio_files:
-        audio_data = audio_files[audio_id]
-        del audio_files[audio_id] # Clean up
-        response = Response(audio_data, mimetype='audio/wav')
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Accept-Ranges'] = 'bytes'
-        return response
-    return "Audio not found", 404
+    """Serve audio file directly, with Range and ETag support"""
+    fetch_started = time.perf_counter()
+    # The store keeps the clip for a short grace window after this read, then drops it
+    audio_parts = state_store.get_audio(audio_id)
+    if audio_parts is None:
+        return "Audio not found", 404
+
+    total_size = sum(len(part) for part in audio_parts)
+    status, headers, byte_range = plan_audio_response(
+        audio_id, total_size, request.headers.get('If-None-Match'), request.headers.get('Range'),
+        request.headers.get('If-Range'))
+    if byte_range is None:
+        return Response(status=status, headers=headers)
+
+    body = iter_with_fetch_span(iter_buffer_range(audio_parts, *byte_range, AUDIO_CHUNK_BYTES), fetch_started,
+                                audio_id, status)
+    return Response(body, status=status, headers=headers, direct_passthrough=True)
+
+@app.route('/stats/tts_cache')
+def get_tts_cache_stats():
+    """TTS cache hit/miss statistics"""
+    return tts_cache.stats()
+
+@app.route('/stats/audio_store')
+def get_audio_store_stats():
+    """Audio store size and eviction counters"""
+    return state_store.audio_stats()
+
+@app.route('/stats/resilience')
+def get_resilience_stats():
+    """Turn deadline, retry, hedge and circuit breaker counters for tuning"""
+    return {
+        'turn_deadline_seconds': TURN_DEADLINE_SECONDS,
+        'hedging': HEDGE_REQUESTS,
+        'retries': {dict(labels).get('model'): count for labels, count in metrics.gemini_retries.values().items()},
+        'fallbacks': {dict(labels).get('reason'): count for labels, count in metrics.turn_fallbacks.values().items()},
+        'calls': gemini_caller.stats(),
+        'circuit_breakers': {model: breaker.stats() for model, breaker in circuit_breakers.items()}
+    }
+
+@app.route('/stats/state')
+def get_state_stats():
+    """State backend and stored session count"""
+    return state_store.stats()
+
+@app.route('/stats/reply_cache')
+def get_reply_cache_stats():
+    """Reply cache hit/miss statistics"""
+    return reply_cache.stats()
+
+@app.route('/stats/ingest')
+def get_ingest_stats():
+    """Inbound audio normalization: bytes saved, silence trimmed, capped recordings"""
+    return audio_ingest.stats()
+
+@app.route('/stats/router')
+def get_router_stats():
+    """Per-stage model tiers, rolling latency/error windows and routing decisions"""
+    return model_router.stats()
+
+@app.route('/stats/gemini_pool')
+def get_gemini_pool_stats():
+    """Gemini connection pool: slots in use, acquire waits, utilization and connection reuse"""
+    pool = gemini_slots.stats()
+    if hasattr(GEMINI_BACKEND, 'connection_stats'):
+        pool['connections'] = GEMINI_BACKEND.connection_stats()
+    return pool
+
+@app.route('/stats/recorder')
+def get_recorder_stats():
+    """Session traffic recorder: sessions and events logged, audio bytes kept"""
+    return session_recorder.stats() if session_recorder is not None else {'enabled': False}
+
+@app.route('/stats/turns')
+def get_turn_stats():
+    """Turn scheduler queue depth and counters"""
+    return turn_scheduler.stats()
+
+@app.route('/healthz')
+def get_health():
+    """Liveness: the process is up and serving requests (it may still be warming up)"""
+    return {'status': 'ok', 'uptime_seconds': readiness.stats()['uptime_seconds']}
+
+@app.route('/readyz')
+def get_readiness():
+    """Readiness: 200 once every warm-up check has passed, 503 (with the failing check) until then"""
+    status = readiness.stats()
+    return status, 200 if status['ready'] else 503
+
+@app.route('/metrics')
+def get_metrics():
+    """Stage latency histograms, counters and gauges in the Prometheus text format"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
 
 @socketio.on('connect')
-def handle_connect():
+def handle_connect(auth=None):
     """Handles new WebSocket connections."""
-    print(f"Client connected: {request.sid}")
-    audio_buffers[request.sid] = BytesIO()
-    session_contexts[request.sid] = {
-        'memory_id': None,
-        'memory_description': None
-    }
+    sid = request.sid
+    log.info("Client connected: %s", sid)
+    # A client that opted in (see requested_session_key) picks its session up again after a reconnect
+    requested_key = requested_session_key(auth, request.args)
+    history_locks[sid] = threading.Lock()
+    state_store.reset_buffer(sid)
+    session, issued_key = attach_session(sid, requested_key)
+    if session:
+        log.info("[%s] Resumed session (M-%s)", sid, session.get('memory_id'))
+        emit('session_resumed', {'memory_id': session.get('memory_id')})
+    else:
+        update_session(sid, memory_id=None, memory_description=None, streaming=STREAM_RESPONSES, history=new_history())
+    if issued_key:
+        emit('session_key', {'key': issued_key})
+    if session_recorder is not None:
+        session_recorder.start_session(sid, keyed=requested_key is not None, resumed=bool(session))
     emit('status', {'message': 'Connected. Ready to receive audio stream.'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handles client disconnections."""
-    print(f"Client disconnected: {request.sid}")
-    if request.sid in audio_buffers:
-        del audio_buffers[request.sid]
-    if request.sid in session_contexts:
-        del session_contexts[request.sid]
+    log.info("Client disconnected: %s", request.sid)
+    if session_recorder is not None:
+        session_recorder.end_session(request.sid)
+    turn_scheduler.cancel(request.sid)
+    history_locks.pop(request.sid, None)
+    transcriber = transcribers.pop(request.sid, None)
+    if transcriber:
+        transcriber.close()
+    state_store.delete_buffer(request.sid)
+    # A session under an issued key waits (up to its TTL) for the client to reconnect
+    if session_keys.pop(request.sid, request.sid) == request.sid:
+        state_store.delete_session(request.sid)
 
 @socketio.on('load_memory')
 def handle_load_memory(data):
     """Handle memory scene loading"""
     sid = request.sid
     memory_id = data.get('memory_id')
+    record_event(sid, 'load_memory', memory_id=memory_id)
     
-    print(f"[{sid}] Loading memory scene: M-{memory_id}")
+    log.info("[%s] Loading memory scene: M-%s", sid, memory_id)
     
     if memory_id not in MEMORY_SCENES:
         emit('error', {'message': f'Invalid memory ID: {memory_id}'}, room=sid)
@@ -340,8 +1200,11 @@ def handle_load_memory(data):
     
     # Store the memory context for this session
     memory_scene = MEMORY_SCENES[memory_id]
-    session_contexts[sid]['memory_id'] = memory_id
-    session_contexts[sid]['memory_description'] = memory_scene['description']
+    # The client starts a fresh conversation view for every scene; a turn of the previous one is stale
+    with history_locks[sid]:
+        turn_scheduler.cancel(sid)
+        update_session(sid, memory_id=memory_id, memory_description=memory_scene['description'],
+                       history=new_history())
     
     # Get the intro text
     intro_text = memory_scene['intro_text']
@@ -358,25 +1221,20 @@ def handle_load_memory(data):
         
         # Send audio with DIFFERENT event name
         if audio_bytes:
-            wav_data = create_wav_from_pcm(audio_bytes, sample_rate=24000)
-            audio_id = str(uuid.uuid4())
-            audio_files[audio_id] = wav_data
-            audio_url = f"http://{request.host}/audio/{audio_id}"
+            # Intro audio id is derived from its content, so the URL (and ETag) is stable
+            intro_audio_id = "intro-" + make_tts_key(intro_text, TTS_VOICE_NAME, TTS_MODEL_NAME, TTS_SAMPLE_RATE)[:32]
             
             # CHANGE THIS: Use a different event name for memory audio
-            emit('memory_audio_ready', {  # Changed from 'audio_ready'
-                'audio_url': audio_url,
-                'audio_id': audio_id,
-                'duration': len(audio_bytes) / (24000 * 2),
+            deliver_audio(sid, 'memory_audio_ready', audio_bytes, request.host, {  # Changed from 'audio_ready'
                 'memory_id': memory_id  # Include memory ID for context
-            }, room=sid)
+            }, audio_id=intro_audio_id)
             
-            print(f"[{sid}] Memory scene audio sent for M-{memory_id}")
+            log.debug("[%s] Memory scene audio sent for M-%s", sid, memory_id)
         
         emit('status', {'message': f'Memory {memory_id} loaded successfully.'}, room=sid)
         
     except Exception as e:
-        print(f"[{sid}] Error loading memory: {e}")
+        log.error("[%s] Error loading memory: %s", sid, e)
         emit('error', {'message': 'Failed to load memory scene'}, room=sid)
 
 
@@ -384,18 +1242,68 @@ def handle_load_memory(data):
 def handle_reset_memory():
     """Reset memory context"""
     sid = request.sid
-    print(f"[{sid}] Resetting memory context")
-    session_contexts[sid] = {
-        'memory_id': None,
-        'memory_description': None
-    }
+    log.info("[%s] Resetting memory context", sid)
+    record_event(sid, 'reset_memory')
+    with history_locks[sid]:
+        turn_scheduler.cancel(sid)
+        update_session(sid, memory_id=None, memory_description=None, history=new_history())
     emit('status', {'message': 'Memory context reset.'}, room=sid)
 
 @socketio.on('start_stream')
 def handle_start_stream(data):
     """Handles the client signaling the start of a new audio stream."""
-    print(f"[{request.sid}] Stream started with format: {data.get('format', 'unknown')}")
-    audio_buffers[request.sid] = BytesIO()
+    sid = request.sid
+    log.debug("[%s] Stream started with format: %s", sid, data.get('format', 'unknown'))
+    record_event(sid, 'start_stream', data=data)
+    # Barge-in: the player is speaking again, so any reply still in the works is stale
+    if turn_scheduler.cancel(sid):
+        log.debug("[%s] Cancelled in-flight turn (barge-in)", sid)
+
+    # Remember the input format for this stream ('pcm16' is raw 16-bit mono PCM)
+    input_format = data.get('format', 'unknown')
+    sample_rate = parse_sample_rate(data.get('sample_rate', PCM_INPUT_SAMPLE_RATE))
+
+    # Set up the recording before any state store round trip: the first chunks are right behind this event
+    previous = transcribers.pop(sid, None)
+    if previous:
+        previous.close()
+    if sample_rate is None:
+        # No recording: the stream's chunks and its stop_stream are ignored
+        state_store.delete_buffer(sid)
+        emit('error', {'message': INVALID_SAMPLE_RATE}, room=sid)
+        return
+    stream_context = None
+    if data.get('incremental', INCREMENTAL_STT):
+        stream_context = metrics.new_turn_context(sid, None)
+        # The recording stays in this worker: it is transcribed while it streams in
+        transcribers[sid] = IncrementalTranscriber(
+            BytesIO(),
+            transcribe_fn=metrics.bind_turn_context(
+                stream_context,
+                lambda audio, is_pcm, window: transcribe_recording(sid, audio, is_pcm, window, sample_rate)),
+            executor=stt_executor,
+            on_partial=lambda text: socketio.emit('transcript', {'transcript': text, 'final': False}, room=sid),
+            input_format=input_format,
+            sample_rate=sample_rate,
+            window_seconds=STT_WINDOW_SECONDS,
+            endpointing=bool(data.get('endpointing', False)),
+            endpoint_silence_ms=ENDPOINT_SILENCE_MS,
+            energy_threshold=VAD_ENERGY_THRESHOLD,
+            max_prefix_windows=STT_MAX_PREFIX_WINDOWS
+        )
+    state_store.reset_buffer(sid)
+
+    session_fields = {'input': {'format': input_format, 'sample_rate': sample_rate}, 'endpointed': False}
+    if 'streaming' in data:
+        session_fields['streaming'] = bool(data['streaming'])
+    # Reply audio delivery: URLs unless the client asks for pushed binary frames
+    if 'audio_delivery' in data:
+        delivery = negotiate_audio_delivery(data)
+        session_fields['delivery'] = delivery
+        emit('audio_delivery', {'mode': 'push', **delivery} if delivery else {'mode': 'url'})
+    update_session(sid, **session_fields)
+    if stream_context is not None:
+        stream_context['memory_id'] = get_session(sid).get('memory_id')
     emit('status', {'message': 'Listening...'})
 
 @socketio.on('message')
@@ -406,111 +1314,333 @@ def handle_audio_chunk(data):
     Appends the incoming binary data (data) to the session's BytesIO buffer. 
     The buffer grows as the user speaks.
     """
-    if request.sid not in audio_buffers:
-        print(f"[{request.sid}] Error: No buffer initialized.")
-        return
-
     if isinstance(data, bytes):  # check if data is bytes (raw audio chunk)
-        audio_buffers[request.sid].write(data)
+        record_event(request.sid, 'message', audio=data)
+        transcriber = transcribers.get(request.sid)
+        if transcriber is None:
+            if not state_store.append_buffer(request.sid, data):
+                log.warning("[%s] Audio chunk without a recording: no buffer initialized", request.sid)
+        elif transcriber.append(data):
+            # Server-side endpointing: the player stopped talking, start the turn now
+            log.debug("[%s] End of speech detected", request.sid)
+            update_session(request.sid, endpointed=True)
+            emit('endpoint', {}, room=request.sid)
+            begin_turn(request.sid, request.host)
         # Debug: log audio chunk size
         # print(f"[{request.sid}] Received audio chunk: {len(data)} bytes")
     else:
-        print(f"[{request.sid}] Received non-binary data: {type(data)}")
+        log.warning("[%s] Received non-binary data: %s", request.sid, type(data))
+
+
+# Streaming reply: emits each sentence as an ordered 'audio_segment' as soon as
+# its TTS is done, then 'audio_complete' with time-to-first-audio and total latency.
+# Returns (text, list of segment PCM buffers).
+def stream_response_segments(sid, user_query, system_instruction, host, turn_started, cancel_token, reply_text=None,
+                             history=None, cached_content=None):
+    segments = SegmentProgress(sid, turn_started)
+    pushes = []   # pushed segments still being encoded
+
+    def on_segment(index, text, pcm_bytes):
+        cancel_token.raise_if_cancelled()
+        segment_index = segments.add(pcm_bytes)
+        if segment_index is None:
+            return
+        _, _, push = deliver_audio(sid, 'audio_segment', pcm_bytes, host, {
+            'index': segment_index,
+            'text': text
+        }, cancel_token=cancel_token)
+        if push:
+            pushes.append(push)
+
+    llm_response_text = generate_streaming_response_and_tts(user_query, system_instruction, on_segment, cancel_token,
+                                                            reply_text=reply_text, history=history,
+                                                            cached_content=cached_content)
+    socketio.emit('response_text', {
+        'text': llm_response_text,
+        'status': 'text_complete'
+    }, room=sid)
+
+    # 'audio_complete' must not overtake the last pushed segment
+    for push in pushes:
+        push.result()
+    socketio.emit('audio_complete', segments.complete(), room=sid)
+    return llm_response_text, segments.audio
+
+
+# Sends a complete reply: the text, then one WAV clip for the whole audio
+def send_reply(sid, text, pcm_bytes, host, cancel_token=None):
+    # 4. Send text response
+    socketio.emit('response_text', {
+        'text': text,
+        'status': 'text_complete'
+    }, room=sid)
+    
+    # 5. Send audio
+    if pcm_bytes:
+        log.debug("[%s] Audio raw bytes size: %d", sid, len(pcm_bytes))
+        audio_id, duration, _ = deliver_audio(sid, 'audio_ready', pcm_bytes, host, {}, cancel_token=cancel_token)
+        log.debug("[%s] Audio %s sent, estimated duration: %.2fs", sid, audio_id, duration)
+
+
+# Answers a turn that ran out of its deadline, or found a circuit breaker
+# open, with the fallback line (see turn_pipeline.fallback_audio)
+def send_fallback_reply(sid, host, reason, cancel_token=None):
+    pcm_bytes = fallback_audio(sid, reason, tts_cache,
+                               make_tts_key(FALLBACK_LINE, TTS_VOICE_NAME, TTS_MODEL_NAME, TTS_SAMPLE_RATE))
+    send_reply(sid, FALLBACK_LINE, pcm_bytes, host, cancel_token)
+
+
+# Returns the precomputed persona system instruction for the session's memory scene
+def build_system_instruction(sid):
+    memory_id = get_session(sid).get('memory_id')
+    if memory_id:
+        log.debug("[%s] Using memory context: M-%s with guidance", sid, memory_id)
+    return SCENE_SYSTEM_INSTRUCTIONS.get(memory_id, SCENE_SYSTEM_INSTRUCTIONS[None])
+
+
+# Folds older turns into the session summary (one small LLM call)
+def summarize_history(previous_summary, turns):
+    transcript = "\n".join(f"Vincent: {user_text}\nYou: {model_text}" for user_text, model_text in turns)
+    model = route_model('summarize')
+    with metrics.span('summarize', bytes_in=len(transcript.encode()), model=model) as summary_span:
+        response = get_gemini_response_with_retry(
+            model=model,
+            contents=[f"{HISTORY_SUMMARY_PROMPT}\n\nCurrent summary: {previous_summary or '(none)'}\n\nNew exchanges:\n{transcript}"],
+            stage='summarize'
+        )
+        summary_span['bytes_out'] = len((response.text or "").encode())
+    return response.text.strip() if response.text else previous_summary
+
+
+# Normalizes a finished recording, or an interim window of one (see
+# audio_ingest.py), and returns (audio_bytes, mime_type), or None when it holds no speech
+def ingest_recording(sid, data, input_format, sample_rate, window=False):
+    if not INGEST_ENABLED:
+        kind = 'wav' if input_format == 'pcm16' or data[:4] == b'RIFF' else 'webm'
+        if input_format == 'pcm16':
+            data = create_wav_header(len(data), sample_rate=sample_rate) + data
+        return data, f'audio/{kind}'
+    with metrics.span('ingest', bytes_in=len(data)) as ingest_span:
+        audio, ingest_stats = audio_ingest.process(data, input_format, sample_rate, window=window)
+        ingest_span['bytes_out'] = ingest_stats['bytes_out']
+    log.debug("[%s] Ingest (%s): %d -> %d bytes, trimmed %.2fs%s", sid, ingest_stats['format'],
+              ingest_stats['bytes_in'], ingest_stats['bytes_out'], ingest_stats['trimmed_seconds'],
+              ' (capped)' if ingest_stats['capped'] else '')
+    return audio
+
+
+# Runs one conversation turn (STT -> LLM -> TTS) on a turn scheduler worker.
+# Checks the cancel token between stages so a superseded turn stops before
+# paying for the next Gemini call. Either `transcribe` (incremental STT) or
+# `recording` ((bytes, input_format, sample_rate) of the whole recording,
+# normalized here before STT; fused mode needs it) is given.
+def run_turn(sid, transcribe, host, turn_started, cancel_token, recording=None):
+    session = get_session(sid)
+    memory_id = session.get('memory_id')
+    # Spans are tagged with the turn and its Gemini calls share one deadline (see turn_pipeline.turn_scope)
+    with turn_scope(sid, memory_id, turn_started, TURN_DEADLINE_SECONDS, record_event) as turn:
+        try:
+            # 1. Build system instruction with memory context, plus conversation history
+            system_instruction = build_system_instruction(sid)
+            conversation = session.get('history')
+            history = conversation.as_contents() if conversation else []
+            cached_content = None
+            if CONTEXT_CACHING:
+                cached_content = prompt_prefix_cache.get(f"scene-{memory_id or 'none'}", system_instruction)
+
+            # 2. STT Processing (fused mode gets the reply in the same call)
+            audio = None
+            if recording is not None:
+                audio = ingest_recording(sid, *recording)
+                # No speech at all: nothing worth an STT call
+                transcribe = (lambda: transcribe_audio(BytesIO(audio[0]), mime_type=audio[1])) if audio else (lambda: None)
+            fused_reply = None
+            if PIPELINE_MODE == 'fused' and audio is not None:
+                try:
+                    user_query, fused_reply = generate_fused_response(audio[0], audio[1], system_instruction,
+                                                                      history, cached_content)
+                except ValueError as e:
+                    log.warning("[%s] Fused mode failed (%s), falling back to separate STT and LLM calls", sid, e)
+            if fused_reply is None:
+                user_query = transcribe() or NO_TRANSCRIPT
+            cancel_token.raise_if_cancelled()
+            socketio.emit('transcript', {'transcript': user_query, 'final': True}, room=sid)
+            socketio.emit('status', {'message': 'Processing (Generating Response)...'}, room=sid)
+        
+            # 3. Generate response with context (or reuse a cached reply to a repeated question)
+            use_reply_cache = REPLY_CACHE_ENABLED and user_query != NO_TRANSCRIPT
+            cached_reply = None
+            if use_reply_cache and fused_reply is None:
+                cached_reply = reply_cache.lookup(memory_id, user_query)
+
+            if cached_reply is not None:
+                log.debug("[%s] Reply cache hit, skipping LLM and TTS", sid)
+                llm_response_text, llm_audio_bytes = cached_reply
+                send_reply(sid, llm_response_text, llm_audio_bytes, host, cancel_token)
+            elif session.get('streaming'):
+                llm_response_text, segment_audio = stream_response_segments(
+                    sid, user_query, system_instruction, host, turn_started, cancel_token, reply_text=fused_reply,
+                    history=history, cached_content=cached_content)
+                llm_audio_bytes = b"".join(segment_audio) if use_reply_cache else None
+            else:
+                if fused_reply is not None:
+                    llm_response_text, llm_audio_bytes = fused_reply, synthesize_speech(fused_reply)
+                else:
+                    llm_response_text, llm_audio_bytes = generate_response_and_tts(user_query, system_instruction,
+                                                                                   history, cached_content)
+                cancel_token.raise_if_cancelled()
+                # ***** Turned ON for debug: save Base64 bytes to wave file
+                # wave_file("out.wav", llm_audio_bytes) 
+                send_reply(sid, llm_response_text, llm_audio_bytes, host, cancel_token)
+
+            if cached_reply is None:
+                log.debug("[%s] Turn latency: %.2fs", sid, time.monotonic() - turn_started)
+                if use_reply_cache and llm_audio_bytes:
+                    reply_cache.store(memory_id, user_query, llm_response_text, llm_audio_bytes)
+
+            log.debug("[%s] Query: %s | Response: %s", sid, user_query, llm_response_text)
+            socketio.emit('status', {'message': 'Response sent successfully.'}, room=sid)
+            turn['outcome'] = 'cached' if cached_reply is not None else 'ok'
+
+            # 6. Remember the exchange; compaction runs after the reply is out, off the latency path
+            # (and outside the turn's deadline)
+            current_deadline.set(None)
+            if conversation and user_query != NO_TRANSCRIPT:
+                conversation.add_turn(user_query, llm_response_text)
+                if conversation.needs_compaction():
+                    conversation.compact(summarize_history)
+                # The session holds a copy of the history; save it back unless the client has left, or the
+                # player has since loaded another scene or reset it (both cancel the turn under the lock)
+                lock = history_locks.get(sid)
+                if lock is not None:
+                    with lock:
+                        if not cancel_token.cancelled and get_session(sid).get('memory_id') == memory_id:
+                            update_session(sid, history=conversation)
+
+        except TurnCancelled:
+            turn['outcome'] = 'cancelled'
+            log.info("[%s] Turn cancelled after %.2fs", sid, time.monotonic() - turn_started)
+            raise
+
+        except Exception as e:
+            turn['outcome'], fallback_reason, message = classify_turn_error(sid, e, turn_started)
+            if fallback_reason:
+                send_fallback_reply(sid, host, fallback_reason, cancel_token)
+            else:
+                socketio.emit('status', {'message': message}, room=sid)
+
+
+# Hands the session's recording to the turn scheduler (called on stop_stream,
+# or from handle_audio_chunk when server-side endpointing fires)
+def begin_turn(sid, host):
+    turn_started = time.monotonic()
+    transcriber = transcribers.pop(sid, None)
+    if transcriber:
+        recorded = None
+        buffer_size = transcriber.audio_io.getbuffer().nbytes
+    else:
+        # The recording is handed to the turn; the session gets a fresh buffer
+        recorded = state_store.take_buffer(sid) or b""
+        buffer_size = len(recorded)
+    log.debug("[%s] Stream stopped. Buffer size: %d bytes", sid, buffer_size)
+
+    if buffer_size == 0:
+        if transcriber:
+            transcriber.close()
+        emit('error', {'message': 'No audio recorded. Try again.'}, room=sid)
+        return
+
+    input_info = get_session(sid).get('input', {})
+    transcribe = recording = None
+    if transcriber:
+        # Most of the recording is already transcribed; only the tail is left
+        transcribe = transcriber.finish
+    else:
+        # Format (pcm16, Unity WAV or browser WebM) is sorted out by the ingest stage on the worker
+        recording = (recorded, input_info.get('format'),
+                     input_info.get('sample_rate', PCM_INPUT_SAMPLE_RATE))
+
+    token, position = turn_scheduler.submit(
+        sid, lambda cancel_token: run_turn(sid, transcribe, host, turn_started, cancel_token, recording=recording)
+    )
+    if token is None:
+        log.warning("[%s] Turn rejected: scheduler queue full", sid)
+        emit('status', {'message': 'Server busy. Please try again in a moment.', 'busy': True}, room=sid)
+    elif position > 0:
+        log.debug("[%s] Turn queued at position %d", sid, position)
+        emit('status', {'message': f'Queued at position {position}...', 'queue_position': position}, room=sid)
+    else:
+        emit('status', {'message': 'Processing (Transcribing Audio)...'}, room=sid)
 
 
 @socketio.on('stop_stream')
 def handle_stop_stream(data=None):
     """Handles the client signaling the end of the audio stream."""
     sid = request.sid
-    if sid not in audio_buffers:
+    record_event(sid, 'stop_stream')
+    if not state_store.has_buffer(sid):
         return
-    
-    audio_data_io = audio_buffers[sid]
-    audio_data_io.seek(0)
-    buffer_size = audio_data_io.getbuffer().nbytes
-    print(f"[{sid}] Stream stopped. Buffer size: {buffer_size} bytes.")
-    emit('status', {'message': 'Processing (Transcribing Audio)...'}, room=sid)
 
-    if buffer_size == 0:
-        emit('error', {'message': 'No audio recorded. Try again.'}, room=sid)
-        audio_buffers[sid] = BytesIO()
+    # Endpointing already started this turn; the push-to-talk release is redundant
+    if get_session(sid).get('endpointed'):
+        update_session(sid, endpointed=False)
         return
 
-    # Detect if this is Unity client (WAV) or Web client (WebM)
-    mime_type = 'audio/webm'  # default
-    
-    # Check first few bytes to detect format
-    first_bytes = audio_data_io.read(4)
-    audio_data_io.seek(0)
-    
-    if first_bytes == b'RIFF':  # WAV format
-        mime_type = 'audio/wav'
-        print(f"[{sid}] Detected WAV audio")
-    else:
-        print(f"[{sid}] Detected WebM audio")
+    begin_turn(sid, request.host)
 
-    try:
-        # 1. STT Processing
-        user_query = transcribe_audio(audio_data_io, mime_type=mime_type)
-        emit('transcript', {'transcript': user_query, 'final': True}, room=sid)
-        emit('status', {'message': 'Processing (Generating Response)...'}, room=sid)
-        
-        # 2. Build system instruction with memory context
-        system_instruction = BASE_SYSTEM_INSTRUCTION
-        
-        if sid in session_contexts and session_contexts[sid]['memory_id']:
-            memory_id = session_contexts[sid]['memory_id']
-            memory_scene = MEMORY_SCENES.get(memory_id, {})
-            memory_description = memory_scene.get('description', '')
-            memory_guidance = memory_scene.get('guidance', '')
-            system_instruction += f"\n\nCURRENT MEMORY CONTEXT (Memory {memory_id}):\n{memory_description}"
-            if memory_guidance:
-                system_instruction += f"\n\nYOUR GUIDANCE FOR THIS MEMORY:\n{memory_guidance}"
-            system_instruction += "\n\nRespond to Vincent based on this memory context and your guidance. Stay in character as the AI assistant while subtly guiding him."
-            
-            print(f"[{sid}] Using memory context: M-{memory_id} with guidance")
-        
-        # 3. Generate response with context
-        llm_response_text, llm_audio_bytes = generate_response_and_tts(user_query, system_instruction)
-        # ***** Turned ON for debug: save Base64 bytes to wave file
-        # wave_file("out.wav", llm_audio_bytes) 
-
-        # 4. Send text response
-        emit('response_text', {
-            'text': llm_response_text,
-            'status': 'text_complete'
-        }, room=sid)
-        
-        # 5. Send audio
-        if llm_audio_bytes:
-            print(f"[{sid}] Audio raw bytes size: {len(llm_audio_bytes)}")
-            wav_data = create_wav_from_pcm(llm_audio_bytes, sample_rate=24000)
-            audio_id = str(uuid.uuid4())
-            audio_files[audio_id] = wav_data
-            audio_url = f"http://{request.host}/audio/{audio_id}"
-            emit('audio_ready', {
-                'audio_url': audio_url,
-                'audio_id': audio_id,
-                'duration': len(llm_audio_bytes) / (24000 * 2)
-            }, room=sid)
-            print(f"[{sid}] Audio URL sent: {audio_url}, estimated duration: {len(llm_audio_bytes) / (24000 * 2):.2f}s")
-
-        print(f"\n--- Response for SID {sid} ---\nQuery: {user_query}\nResponse: {llm_response_text}\n---\n")
-        emit('status', {'message': 'Response sent successfully.'}, room=sid)
-
-    except GoogleAPICallError as e:
-        print(f"[{sid}] API Error: {e}")
-        emit('status', {'message': 'Service temporarily unavailable. Please try again.'}, room=sid)
-        
-    except Exception as e:
-        print(f"[{sid}] Error: {e}")
-        emit('status', {'message': 'Server processing error.'}, room=sid)
 
-    audio_buffers[sid] = BytesIO()
+# =================================================================
+# Worker startup
+# =================================================================
+# Importing this module only builds its objects (server_async.py and
+# bench_pipeline.py reuse them); a serving worker starts its threads here.
+
+# Background work of any serving worker: the state store sweeper, span and
+# server logging, the session recorder, the gauges and the warm-up. `turns`
+# is the worker's turn scheduler (TurnScheduler, or server_async.AsyncTurns)
+def start_worker(turns):
+    global session_recorder
+    state_store.start_sweeper()
+    atexit.register(state_store.close)  # remove spilled clips on shutdown
+    if SPAN_LOG:
+        metrics.start_span_logging(SPAN_LOG_FILE)
+        atexit.register(metrics.stop_span_logging)  # flush queued spans on shutdown
+    metrics.start_detail_logging(LOG_LEVEL, LOG_FILE)
+    atexit.register(metrics.stop_detail_logging)
+    if SESSION_RECORD_DIR:
+        session_recorder = SessionRecorder(SESSION_RECORD_DIR, record_audio=SESSION_RECORD_AUDIO,
+                                           sample_rate=SESSION_RECORD_SAMPLE)
+        atexit.register(session_recorder.close)  # write out queued events on shutdown
+    register_gauges(turns)
+
+    # Setup is done: warm up in the background while the server starts listening
+    readiness.mark('init')
+    if WARMUP_ON_STARTUP:
+        readiness.start()
+
+
+# The threading server's turn scheduler and executors, then the worker's background work
+def start_threading_worker():
+    global turn_scheduler, tts_executor, stt_executor, encode_executor
+    turn_scheduler = TurnScheduler(max_concurrent=TURN_MAX_CONCURRENCY, max_queued=TURN_MAX_QUEUE)
+    tts_executor = ThreadPoolExecutor(max_workers=STREAM_TTS_WORKERS, thread_name_prefix="tts")
+    stt_executor = ThreadPoolExecutor(max_workers=STT_WORKERS, thread_name_prefix="stt")
+    encode_executor = ThreadPoolExecutor(max_workers=AUDIO_PUSH_WORKERS, thread_name_prefix="encode")
+    start_worker(turn_scheduler)
 
 
 # --- Main Execution ---
 if __name__ == '__main__':
-    print(f"Starting WebSocket server on port 5000...")
-    socketio.run(app, host='0.0.0.0', port=5000, allow_unsafe_werkzeug=True)
+    # `python server.py --prerender` fills the TTS cache with all scene intros and exits
+    if '--prerender' in sys.argv:
+        prerender_scene_intros()
+        sys.exit(0)
+
+    start_threading_worker()
+    if PRERENDER_ON_STARTUP:
+        threading.Thread(target=prerender_scene_intros, daemon=True).start()
+
+    port = int(os.environ.get("PORT", "5000"))   # one port per worker when several run on a host
+    print(f"Starting WebSocket server on port {port}...")
+    socketio.run(app, host='0.0.0.0', port=port, allow_unsafe_werkzeug=True)
 
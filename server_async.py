@@ -0,0 +1,694 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import threading
+from urllib.parse import parse_qs
+
+import socketio
+
+import metrics
+import server
+import startup
+from server import (MEMORY_SCENES, TTS_MODEL_NAME, TTS_SAMPLE_RATE, NO_TRANSCRIPT, STT_PROMPT,
+                    FUSED_PROMPT, PIPELINE_MODE, CONTEXT_CACHING, REPLY_CACHE_ENABLED, STREAM_RESPONSES,
+                    PCM_INPUT_SAMPLE_RATE, FALLBACK_LINE, TURN_DEADLINE_SECONDS, TURN_MAX_CONCURRENCY,
+                    TURN_MAX_QUEUE, SOCKETIO_MESSAGE_QUEUE, OPUS_BITRATE, FFMPEG_PATH, TTS_VOICE_NAME,
+                    state_store, session_keys, tts_cache, reply_cache, get_session, update_session,
+                    new_history, record_event, route_model, log)
+from tenacity import AsyncRetrying
+from resilience import DeadlineExceeded, QueueTiming, current_deadline, arun_timed, is_retryable_error, retry_policy
+from audio_codec import parse_sample_rate
+from tts_cache import make_tts_key
+from turn_scheduler import SessionQueues
+from turn_pipeline import (turn_scope, classify_turn_error, fallback_audio, SentenceStream, SegmentProgress,
+                           pushed_audio_fields, plan_audio_response, iter_buffer_range, iter_with_fetch_span)
+
+types = startup.LazyModule('google.genai.types')
+
+# =================================================================
+# asyncio serving mode (python-socketio ASGI app under uvicorn)
+# =================================================================
+# The same Socket.IO events and /audio/<audio_id> route as server.py, but
+# served from one event loop: Gemini calls go through the async client
+# (client.aio), so a session waiting on STT, LLM or TTS costs a coroutine
+# instead of a thread. Configuration, state store, caches, metrics,
+# deadlines and circuit breakers are shared with server.py. With
+# STATE_BACKEND=redis every state store call is a network round trip, so
+# it runs on a thread (see store_call).
+#
+#   python server_async.py                 # or: uvicorn server_async:app --port 5000
+#
+# CPU work (ingest, Opus/PCM encoding), context cache creation, history
+# compaction and intro TTS cache misses still run on the default thread
+# pool. Incremental STT and server-side endpointing are thread-based and
+# only available in the threading server; here the whole recording is
+# transcribed on stop_stream.
+
+sio = socketio.AsyncServer(
+    async_mode='asgi',
+    cors_allowed_origins="*",
+    client_manager=socketio.AsyncRedisManager(SOCKETIO_MESSAGE_QUEUE) if SOCKETIO_MESSAGE_QUEUE else None
+)
+hosts = {}   # sid -> Host header of the connection, for /audio URLs
+event_locks = {}   # sid -> asyncio.Lock taken by each of its events, see session_events
+
+
+# Runs a (blocking) state store call off the loop when the store is Redis; the in-memory store is called inline
+async def store_call(fn, *args, **kwargs):
+    if server.STATE_BACKEND == 'memory':
+        return fn(*args, **kwargs)
+    return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+# Each event of a session runs as its own task. Taking the session's lock
+# before the first await keeps its state store calls in arrival order (the
+# lock is FIFO), so a chunk never lands before its start_stream's reset.
+def session_events(sid):
+    lock = event_locks.get(sid)
+    if lock is None:
+        lock = event_locks[sid] = asyncio.Lock()
+    return lock
+
+
+class AsyncTurns:
+    """
+    Turn concurrency for the event loop: at most max_concurrent turns call
+    Gemini at once and at most max_queued wait for a slot. Waiting turns are
+    served round-robin across sessions, in the same order as the threading
+    server's TurnScheduler. A session's turns can be cancelled (barge-in)
+    wherever they are awaiting.
+    """
+
+    def __init__(self, max_concurrent: int, max_queued: int):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self._waiting = SessionQueues()   # make_coro per session, served round-robin
+        self._tasks = {}                  # sid -> set of running turn tasks
+        self._running = 0
+        self._stats = {'submitted': 0, 'rejected': 0, 'cancelled': 0, 'completed': 0, 'failed': 0}
+
+    def submit(self, sid, make_coro):
+        """Queue a turn; returns its queue position (0 = runs now) or None if rejected"""
+        idle_slots = self.max_concurrent - self._running
+        if len(self._waiting) >= self.max_queued + idle_slots:
+            self._stats['rejected'] += 1
+            return None
+        self._waiting.push(sid, make_coro)
+        self._stats['submitted'] += 1
+        position = max(0, len(self._waiting) - idle_slots)
+        self._start_waiting()
+        return position
+
+    # Starts waiting turns while slots are free
+    def _start_waiting(self):
+        while self._waiting and self._running < self.max_concurrent:
+            sid, make_coro = self._waiting.pop()
+            self._running += 1
+            task = asyncio.ensure_future(make_coro())
+            self._tasks.setdefault(sid, set()).add(task)
+            # A done callback (not a finally) also runs for a task cancelled before its first step
+            task.add_done_callback(lambda task, sid=sid: self._finished(sid, task))
+
+    def _finished(self, sid, task):
+        self._running -= 1
+        running = self._tasks.get(sid)
+        if running is not None:
+            running.discard(task)
+            if not running:
+                del self._tasks[sid]
+        if not task.cancelled():   # cancelled turns are counted by cancel()
+            if task.exception() is None:
+                self._stats['completed'] += 1
+            else:
+                self._stats['failed'] += 1
+                log.error("[%s] Turn failed: %s", sid, task.exception())
+        self._start_waiting()
+
+    def cancel(self, sid):
+        """Drop sid's waiting turns and cancel its running ones; returns True if there were any"""
+        dropped = self._waiting.drop(sid)
+        cancelled = sum(task.cancel() for task in self._tasks.pop(sid, ()))
+        self._stats['cancelled'] += len(dropped) + cancelled
+        return bool(dropped or cancelled)
+
+    def stats(self):
+        return {**self._stats, 'queued': len(self._waiting), 'running': self._running,
+                'max_concurrent': self.max_concurrent, 'max_queued': self.max_queued}
+
+
+turns = AsyncTurns(TURN_MAX_CONCURRENCY, TURN_MAX_QUEUE)
+
+
+# =================================================================
+# Async Gemini calls (retry, deadline, hedging and breakers as in server.py)
+# =================================================================
+
+async def agenerate_with_retry(model: str, contents: list, config: 'types.GenerateContentConfig' = None,
+                               stage: str = None):
+    async for attempt in AsyncRetrying(**retry_policy(model)):
+        with attempt:
+            breaker = server.admit_gemini_call(model)
+            started = time.monotonic()
+            queued = QueueTiming()
+            try:
+                response = await arun_timed(queued, lambda: server.gemini_caller.acall(
+                    stage or model, lambda: server.GEMINI_BACKEND.agenerate_content(
+                        model=model, contents=contents, config=config)))
+            except Exception as e:
+                server.settle_gemini_call(model, breaker, e, stage, started, queued)
+                raise
+            server.settle_gemini_call(model, breaker, stage=stage, started=started, queued=queued)
+            return response
+
+
+# Waits for a stream's next chunk no longer than the deadline allows (the
+# read is cancelled then), so a stalled stream does not run into the transport timeout
+async def read_within_deadline(read, deadline):
+    if deadline is None:
+        return await read
+    try:
+        return await asyncio.wait_for(read, max(0.0, deadline.remaining()))
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("Gemini stream stalled past the turn deadline")
+
+
+# Streaming variant: retried only while nothing has been yielded yet
+async def agenerate_stream_with_retry(model: str, contents: list, config: 'types.GenerateContentConfig' = None,
+                                      stage: str = 'llm'):
+    yielded = False
+    async for attempt in AsyncRetrying(**retry_policy(model, lambda e: is_retryable_error(e) and not yielded)):
+        with attempt:
+            breaker = server.admit_gemini_call(model)
+            deadline = current_deadline.get()
+            started = time.monotonic()
+            queued = QueueTiming()
+            try:
+                chunks = server.GEMINI_BACKEND.agenerate_content_stream(model=model, contents=contents, config=config)
+                # The first read is the one that waits for a connection slot
+                chunk = await read_within_deadline(arun_timed(queued, lambda: anext(chunks, None)), deadline)
+                while chunk is not None:
+                    if deadline is not None:
+                        deadline.check()
+                    if chunk.text:
+                        yielded = True
+                        yield chunk.text
+                    chunk = await read_within_deadline(anext(chunks, None), deadline)
+            except Exception as e:
+                server.settle_gemini_call(model, breaker, e, stage, started, queued)
+                raise
+            server.settle_gemini_call(model, breaker, stage=stage, started=started, queued=queued)
+
+
+async def transcribe_audio(audio_bytes: bytes, mime_type: str):
+    log.debug("Starting transcription for %d bytes", len(audio_bytes))
+    audio_part = types.Part.from_bytes(data=audio_bytes, mime_type=mime_type)
+    model = route_model('stt')
+    with metrics.span('stt', bytes_in=len(audio_bytes), model=model) as stt_span:
+        response = await agenerate_with_retry(model=model, contents=[audio_part, STT_PROMPT], stage='stt')
+        text = response.text.strip() if response.text else NO_TRANSCRIPT
+        stt_span['bytes_out'] = len(text.encode())
+    return text
+
+
+async def generate_response(text_prompt: str, system_instruction: str, history: list, cached_content: str):
+    model = route_model('llm')
+    with metrics.span('llm', bytes_in=len(text_prompt.encode()), model=model) as llm_span:
+        response = await agenerate_with_retry(
+            model=model,
+            contents=server.conversation_contents(history, text_prompt),
+            config=server.make_text_config(system_instruction, cached_content, model=model),
+            stage='llm'
+        )
+        generated_text = response.text.strip()
+        llm_span['bytes_out'] = len(generated_text.encode())
+    return generated_text
+
+
+async def generate_fused_response(audio_bytes: bytes, mime_type: str, system_instruction: str, history: list,
+                                  cached_content: str):
+    audio_part = types.Part.from_bytes(data=audio_bytes, mime_type=mime_type)
+    model = route_model('fused')
+    with metrics.span('fused', bytes_in=len(audio_bytes), model=model) as fused_span:
+        response = await agenerate_with_retry(
+            model=model,
+            contents=server.conversation_contents(history, audio_part, FUSED_PROMPT),
+            config=server.make_fused_config(system_instruction, cached_content, model),
+            stage='fused'
+        )
+        fused_span['bytes_out'] = len((response.text or "").encode())
+    return server.parse_fused_response(response)
+
+
+async def synthesize_speech(text: str):
+    model = route_model('tts')
+    with metrics.span('tts', bytes_in=len(text.encode()), model=model) as tts_span:
+        response = await agenerate_with_retry(model=model, contents=[text], config=server.make_tts_config(),
+                                              stage='tts')
+        audio_data_part = server.find_audio_part(response)
+        tts_span['bytes_out'] = len(audio_data_part.inline_data.data) if audio_data_part else 0
+    if audio_data_part is None:
+        log.warning("TTS audio data not found in response")
+        return None
+    return audio_data_part.inline_data.data
+
+
+# =================================================================
+# Sending replies
+# =================================================================
+
+# Like server.deliver_audio: an /audio URL, or the encoded clip pushed over the socket
+async def deliver_audio(sid, event, pcm_bytes, payload, audio_id=None):
+    delivery = (await store_call(get_session, sid)).get('delivery')
+    if delivery is None:
+        audio_id, audio_url, duration = await store_call(server.publish_audio, pcm_bytes, hosts.get(sid, 'localhost'),
+                                                         audio_id=audio_id)
+        await sio.emit(event, {**payload, 'audio_url': audio_url, 'audio_id': audio_id, 'duration': duration}, to=sid)
+        return audio_id, duration
+
+    audio_id = audio_id or str(uuid.uuid4())
+    fields = await asyncio.to_thread(pushed_audio_fields, audio_id, pcm_bytes, TTS_SAMPLE_RATE, delivery,
+                                     OPUS_BITRATE, FFMPEG_PATH)
+    await sio.emit(event, {**payload, **fields}, to=sid)
+    return audio_id, fields['duration']
+
+
+async def send_reply(sid, text, pcm_bytes):
+    await sio.emit('response_text', {'text': text, 'status': 'text_complete'}, to=sid)
+    if pcm_bytes:
+        audio_id, duration = await deliver_audio(sid, 'audio_ready', pcm_bytes, {})
+        log.debug("[%s] Audio %s sent, estimated duration: %.2fs", sid, audio_id, duration)
+
+
+async def send_fallback_reply(sid, reason):
+    pcm_bytes = fallback_audio(sid, reason, tts_cache,
+                               make_tts_key(FALLBACK_LINE, TTS_VOICE_NAME, TTS_MODEL_NAME, TTS_SAMPLE_RATE))
+    await send_reply(sid, FALLBACK_LINE, pcm_bytes)
+
+
+# Streams the LLM reply and synthesizes each sentence as soon as it is
+# complete; segments are emitted in order as 'audio_segment', then
+# 'audio_complete'. Returns (text, list of segment PCM buffers).
+async def stream_response_segments(sid, user_query, system_instruction, turn_started, reply_text=None,
+                                   history=None, cached_content=None):
+    if reply_text is not None:
+        async def replay():
+            yield reply_text + " "
+        text_chunks = replay()
+    else:
+        model = route_model('llm')
+        text_chunks = agenerate_stream_with_retry(
+            model=model,
+            contents=server.conversation_contents(history, user_query),
+            config=server.make_text_config(system_instruction, cached_content, model=model)
+        )
+
+    pending = []        # (sentence, TTS task) in sentence order
+    sentence_stream = SentenceStream(user_query, server.STREAM_MIN_SEGMENT_CHARS, replayed=reply_text is not None)
+    segments = SegmentProgress(sid, turn_started)
+
+    def submit(sentence):
+        pending.append((sentence, asyncio.ensure_future(synthesize_speech(sentence))))
+
+    async def drain(block):
+        while pending and (block or pending[0][1].done()):
+            sentence, task = pending.pop(0)
+            pcm_bytes = await task
+            segment_index = segments.add(pcm_bytes)
+            if segment_index is not None:
+                await deliver_audio(sid, 'audio_segment', pcm_bytes, {'index': segment_index, 'text': sentence})
+
+    try:
+        async for chunk_text in text_chunks:
+            for sentence in sentence_stream.feed(chunk_text):
+                submit(sentence)
+            await drain(block=False)
+        for sentence in sentence_stream.finish():
+            submit(sentence)
+        await drain(block=True)
+    finally:
+        for _, task in pending:
+            task.cancel()
+
+    await sio.emit('response_text', {'text': sentence_stream.text, 'status': 'text_complete'}, to=sid)
+    await sio.emit('audio_complete', segments.complete(), to=sid)
+    return sentence_stream.text, segments.audio
+
+
+# =================================================================
+# Turns
+# =================================================================
+
+# One conversation turn (ingest -> STT -> LLM -> TTS), as server.run_turn
+async def run_turn(sid, recording, turn_started):
+    session = await store_call(get_session, sid)
+    memory_id = session.get('memory_id')
+    with turn_scope(sid, memory_id, turn_started, TURN_DEADLINE_SECONDS, record_event) as turn:
+        try:
+            system_instruction = await store_call(server.build_system_instruction, sid)
+            conversation = session.get('history')
+            history = conversation.as_contents() if conversation else []
+            cached_content = None
+            if CONTEXT_CACHING:
+                cached_content = await asyncio.to_thread(
+                    server.prompt_prefix_cache.get, f"scene-{memory_id or 'none'}", system_instruction)
+
+            audio = await asyncio.to_thread(server.ingest_recording, sid, *recording)
+            fused_reply = None
+            if PIPELINE_MODE == 'fused' and audio is not None:
+                try:
+                    user_query, fused_reply = await generate_fused_response(audio[0], audio[1], system_instruction,
+                                                                            history, cached_content)
+                except ValueError as e:
+                    log.warning("[%s] Fused mode failed (%s), falling back to separate STT and LLM calls", sid, e)
+            if fused_reply is None:
+                user_query = (await transcribe_audio(*audio) if audio else None) or NO_TRANSCRIPT
+            await sio.emit('transcript', {'transcript': user_query, 'final': True}, to=sid)
+            await sio.emit('status', {'message': 'Processing (Generating Response)...'}, to=sid)
+
+            use_reply_cache = REPLY_CACHE_ENABLED and user_query != NO_TRANSCRIPT
+            cached_reply = None
+            if use_reply_cache and fused_reply is None:
+                cached_reply = reply_cache.lookup(memory_id, user_query)
+
+            if cached_reply is not None:
+                log.debug("[%s] Reply cache hit, skipping LLM and TTS", sid)
+                llm_response_text, llm_audio_bytes = cached_reply
+                await send_reply(sid, llm_response_text, llm_audio_bytes)
+            elif session.get('streaming'):
+                llm_response_text, segment_audio = await stream_response_segments(
+                    sid, user_query, system_instruction, turn_started, reply_text=fused_reply, history=history,
+                    cached_content=cached_content)
+                llm_audio_bytes = b"".join(segment_audio) if use_reply_cache else None
+            else:
+                llm_response_text = fused_reply
+                if llm_response_text is None:
+                    llm_response_text = await generate_response(user_query, system_instruction, history, cached_content)
+                llm_audio_bytes = await synthesize_speech(llm_response_text)
+                await send_reply(sid, llm_response_text, llm_audio_bytes)
+
+            if cached_reply is None:
+                log.debug("[%s] Turn latency: %.2fs", sid, time.monotonic() - turn_started)
+                if use_reply_cache and llm_audio_bytes:
+                    reply_cache.store(memory_id, user_query, llm_response_text, llm_audio_bytes)
+
+            await sio.emit('status', {'message': 'Response sent successfully.'}, to=sid)
+            turn['outcome'] = 'cached' if cached_reply is not None else 'ok'
+
+            # Remember the exchange; compaction (a rare, blocking call) runs on a thread, outside the deadline
+            current_deadline.set(None)
+            if conversation and user_query != NO_TRANSCRIPT:
+                conversation.add_turn(user_query, llm_response_text)
+                if conversation.needs_compaction():
+                    await asyncio.to_thread(conversation.compact, server.summarize_history)
+                # Not after the client left, nor over the fresh history of a scene loaded or reset since:
+                # those cancel this task while holding the session's lock
+                if sid in session_keys:
+                    async with session_events(sid):
+                        if (await store_call(get_session, sid)).get('memory_id') == memory_id:
+                            await store_call(update_session, sid, history=conversation)
+
+        except asyncio.CancelledError:
+            turn['outcome'] = 'cancelled'
+            log.info("[%s] Turn cancelled after %.2fs", sid, time.monotonic() - turn_started)
+            raise
+
+        except Exception as e:
+            turn['outcome'], fallback_reason, message = classify_turn_error(sid, e, turn_started)
+            if fallback_reason:
+                await send_fallback_reply(sid, fallback_reason)
+            else:
+                await sio.emit('status', {'message': message}, to=sid)
+
+
+# =================================================================
+# Socket.IO events
+# =================================================================
+
+@sio.event
+async def connect(sid, environ, auth=None):
+    log.info("Client connected: %s", sid)
+    hosts[sid] = environ.get('HTTP_HOST', 'localhost')
+    query = {name: values[0] for name, values in
+             parse_qs(environ.get('QUERY_STRING', ''), keep_blank_values=True).items()}
+    requested_key = server.requested_session_key(auth, query)
+    async with session_events(sid):
+        await store_call(state_store.reset_buffer, sid)
+        session, issued_key = await store_call(server.attach_session, sid, requested_key)
+        if not session:
+            await store_call(update_session, sid, memory_id=None, memory_description=None, streaming=STREAM_RESPONSES,
+                             history=new_history())
+    if session:
+        log.info("[%s] Resumed session (M-%s)", sid, session.get('memory_id'))
+        await sio.emit('session_resumed', {'memory_id': session.get('memory_id')}, to=sid)
+    if issued_key:
+        await sio.emit('session_key', {'key': issued_key}, to=sid)
+    if server.session_recorder is not None:
+        server.session_recorder.start_session(sid, keyed=requested_key is not None, resumed=bool(session))
+    await sio.emit('status', {'message': 'Connected. Ready to receive audio stream.'}, to=sid)
+
+
+@sio.event
+async def disconnect(sid, *args):
+    log.info("Client disconnected: %s", sid)
+    if server.session_recorder is not None:
+        server.session_recorder.end_session(sid)
+    turns.cancel(sid)
+    hosts.pop(sid, None)
+    async with session_events(sid):
+        await store_call(state_store.delete_buffer, sid)
+        if session_keys.pop(sid, sid) == sid:
+            await store_call(state_store.delete_session, sid)
+    event_locks.pop(sid, None)
+
+
+@sio.event
+async def load_memory(sid, data):
+    memory_id = data.get('memory_id')
+    record_event(sid, 'load_memory', memory_id=memory_id)
+    log.info("[%s] Loading memory scene: M-%s", sid, memory_id)
+    if memory_id not in MEMORY_SCENES:
+        await sio.emit('error', {'message': f'Invalid memory ID: {memory_id}'}, to=sid)
+        return
+
+    memory_scene = MEMORY_SCENES[memory_id]
+    async with session_events(sid):
+        turns.cancel(sid)   # a turn of the previous scene is stale
+        await store_call(update_session, sid, memory_id=memory_id, memory_description=memory_scene['description'],
+                         history=new_history())
+    intro_text = memory_scene['intro_text']
+    try:
+        # Intros are pre-rendered, so this is a TTS cache hit; a miss renders on a thread
+        audio_bytes = await asyncio.to_thread(server.generate_tts_only, intro_text)
+        await sio.emit('memory_scene', {'text': intro_text, 'memory_id': memory_id}, to=sid)
+        if audio_bytes:
+            intro_audio_id = "intro-" + make_tts_key(intro_text, TTS_VOICE_NAME, TTS_MODEL_NAME, TTS_SAMPLE_RATE)[:32]
+            await deliver_audio(sid, 'memory_audio_ready', audio_bytes, {'memory_id': memory_id},
+                                audio_id=intro_audio_id)
+        await sio.emit('status', {'message': f'Memory {memory_id} loaded successfully.'}, to=sid)
+    except Exception as e:
+        log.error("[%s] Error loading memory: %s", sid, e)
+        await sio.emit('error', {'message': 'Failed to load memory scene'}, to=sid)
+
+
+@sio.event
+async def reset_memory(sid, data=None):
+    log.info("[%s] Resetting memory context", sid)
+    record_event(sid, 'reset_memory')
+    async with session_events(sid):
+        turns.cancel(sid)
+        await store_call(update_session, sid, memory_id=None, memory_description=None, history=new_history())
+    await sio.emit('status', {'message': 'Memory context reset.'}, to=sid)
+
+
+@sio.event
+async def start_stream(sid, data):
+    log.debug("[%s] Stream started with format: %s", sid, data.get('format', 'unknown'))
+    record_event(sid, 'start_stream', data=data)
+    if turns.cancel(sid):
+        log.debug("[%s] Cancelled in-flight turn (barge-in)", sid)
+    input_format = data.get('format', 'unknown')
+    sample_rate = parse_sample_rate(data.get('sample_rate', PCM_INPUT_SAMPLE_RATE))
+    if sample_rate is None:
+        # No recording: the stream's chunks and its stop_stream are ignored
+        async with session_events(sid):
+            await store_call(state_store.delete_buffer, sid)
+        await sio.emit('error', {'message': server.INVALID_SAMPLE_RATE}, to=sid)
+        return
+    session_fields = {'input': {'format': input_format, 'sample_rate': sample_rate}, 'endpointed': False}
+    if 'streaming' in data:
+        session_fields['streaming'] = bool(data['streaming'])
+    if 'audio_delivery' in data:
+        session_fields['delivery'] = server.negotiate_audio_delivery(data)
+    async with session_events(sid):
+        await store_call(state_store.reset_buffer, sid)
+        await store_call(update_session, sid, **session_fields)
+    if 'delivery' in session_fields:
+        delivery = session_fields['delivery']
+        await sio.emit('audio_delivery', {'mode': 'push', **delivery} if delivery else {'mode': 'url'}, to=sid)
+    await sio.emit('status', {'message': 'Listening...'}, to=sid)
+
+
+@sio.on('message')
+async def audio_chunk(sid, data):
+    if not isinstance(data, bytes):
+        log.warning("[%s] Received non-binary data: %s", sid, type(data))
+        return
+    record_event(sid, 'message', audio=data)
+    async with session_events(sid):
+        appended = await store_call(state_store.append_buffer, sid, data)
+    if not appended:
+        log.warning("[%s] Audio chunk without a recording: no buffer initialized", sid)
+
+
+@sio.event
+async def stop_stream(sid, data=None):
+    turn_started = time.monotonic()
+    record_event(sid, 'stop_stream')
+    async with session_events(sid):
+        recorded = await store_call(state_store.take_buffer, sid)
+        input_info = (await store_call(get_session, sid)).get('input', {}) if recorded else None
+    if recorded is None:
+        return
+    log.debug("[%s] Stream stopped. Buffer size: %d bytes", sid, len(recorded))
+    if not recorded:
+        await sio.emit('error', {'message': 'No audio recorded. Try again.'}, to=sid)
+        return
+
+    recording = (recorded, input_info.get('format'), input_info.get('sample_rate', PCM_INPUT_SAMPLE_RATE))
+    position = turns.submit(sid, lambda: run_turn(sid, recording, turn_started))
+    if position is None:
+        log.warning("[%s] Turn rejected: queue full", sid)
+        await sio.emit('status', {'message': 'Server busy. Please try again in a moment.', 'busy': True}, to=sid)
+    elif position > 0:
+        await sio.emit('status', {'message': f'Queued at position {position}...', 'queue_position': position}, to=sid)
+    else:
+        await sio.emit('status', {'message': 'Processing (Transcribing Audio)...'}, to=sid)
+
+
+# =================================================================
+# Async client warm-up
+# =================================================================
+# The warm-up thread of server.py probes the models through the sync client.
+# The async client keeps its own connections, bound to this event loop, so it
+# is probed from the loop once it runs; the worker is not ready before that.
+
+if server.WARMUP_ON_STARTUP:
+    server.readiness.add_check('async_models')
+
+
+async def warm_async_client():
+    while True:
+        started = time.monotonic()
+        try:
+            # Creating the client imports google-genai: done off the loop
+            await asyncio.to_thread(server.GEMINI_BACKEND.connect)
+            await asyncio.gather(*(server.GEMINI_BACKEND.aprobe(model) for model in server.warmup_probes()))
+        except Exception as e:
+            server.readiness.record('async_models', time.monotonic() - started, e)
+            await asyncio.sleep(server.WARMUP_RETRY_SECONDS)
+            continue
+        server.readiness.record('async_models', time.monotonic() - started)
+        return
+
+
+# =================================================================
+# HTTP routes: /audio/<audio_id>, /healthz, /readyz, /metrics and /stats/*
+# =================================================================
+
+async def send_response(send, status, headers, body=b""):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.lower().encode(), str(value).encode()) for name, value in headers.items()]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+# Serves a stored clip with Range and ETag support, like server.get_audio
+async def serve_audio(scope, send, audio_id):
+    fetch_started = time.perf_counter()
+    audio_parts = await store_call(state_store.get_audio, audio_id)
+    if audio_parts is None:
+        await send_response(send, 404, {'Content-Type': 'text/plain'}, b"Audio not found")
+        return
+
+    request_headers = {name.decode().lower(): value.decode() for name, value in scope['headers']}
+    status, headers, byte_range = plan_audio_response(
+        audio_id, sum(len(part) for part in audio_parts), request_headers.get('if-none-match'),
+        request_headers.get('range'), request_headers.get('if-range'))
+    if byte_range is None:
+        await send_response(send, status, headers)
+        return
+
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(name.lower().encode(), str(value).encode()) for name, value in headers.items()]})
+    if scope['method'] == 'HEAD':
+        await send({'type': 'http.response.body', 'body': b""})
+        return
+    for chunk in iter_with_fetch_span(iter_buffer_range(audio_parts, *byte_range, server.AUDIO_CHUNK_BYTES),
+                                      fetch_started, audio_id, status):
+        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b""})
+
+
+# /stats/<name> views of server.py (they only read module state), with turns from this loop.
+# Like /metrics they may read the state store, so they are served from a thread
+def stats_views():
+    views = {rule.rule[len('/stats/'):]: server.app.view_functions[rule.endpoint]
+             for rule in server.app.url_map.iter_rules() if rule.rule.startswith('/stats/')}
+    views['turns'] = turns.stats
+    return views
+
+
+STATS_VIEWS = stats_views()
+warmup_tasks = set()   # keeps the warm-up task referenced while it runs
+
+
+async def http_app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # The worker's sweeper, recorder, gauges (of these turns) and warm-up (see server.start_worker)
+                server.start_worker(turns)
+                if server.WARMUP_ON_STARTUP:
+                    warmup_tasks.add(asyncio.ensure_future(warm_async_client()))
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    path = scope['path']
+    if scope['method'] not in ('GET', 'HEAD'):
+        await send_response(send, 405, {'Content-Type': 'text/plain'}, b"Method not allowed")
+    elif path.startswith('/audio/'):
+        await serve_audio(scope, send, path[len('/audio/'):])
+    elif path == '/healthz':
+        await send_response(send, 200, {'Content-Type': 'application/json'}, json.dumps(server.get_health()).encode())
+    elif path == '/readyz':
+        status = server.readiness.stats()
+        await send_response(send, 200 if status['ready'] else 503, {'Content-Type': 'application/json'},
+                            json.dumps(status).encode())
+    elif path == '/metrics':
+        await send_response(send, 200, {'Content-Type': 'text/plain; version=0.0.4'},
+                            (await asyncio.to_thread(metrics.registry.render)).encode())
+    elif path.startswith('/stats/') and path[len('/stats/'):] in STATS_VIEWS:
+        stats = await asyncio.to_thread(STATS_VIEWS[path[len('/stats/'):]])
+        await send_response(send, 200, {'Content-Type': 'application/json'}, json.dumps(stats).encode())
+    else:
+        await send_response(send, 404, {'Content-Type': 'text/plain'}, b"Not found")
+
+
+app = socketio.ASGIApp(sio, other_asgi_app=http_app)
+
+
+# --- Main Execution ---
+if __name__ == '__main__':
+    import uvicorn
+
+    if server.PRERENDER_ON_STARTUP:
+        threading.Thread(target=server.prerender_scene_intros, daemon=True).start()
+
+    port = int(os.environ.get("PORT", "5000"))
+    print(f"Starting asyncio WebSocket server on port {port}...")
+    uvicorn.run(app, host='0.0.0.0', port=port, log_level='warning')
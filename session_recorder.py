@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import queue
+import random
+import threading
+
+# =================================================================
+# Session traffic recording
+# =================================================================
+# Opt-in capture of what players send, so real sessions can be replayed
+# later (replay_sessions.py) against any server, including one running on
+# the fake Gemini backend. Every inbound event of a recorded session is
+# appended as one JSON line to <name>.events.jsonl:
+#
+#   {"ts": 1718000000.1234, "sid": "...", "event": "message", "bytes": 3200, "audio": [6400, 3200]}
+#
+# Audio chunks are logged by size only unless audio recording is enabled;
+# then their bytes go to the <name>.audio.bin sidecar and "audio" holds
+# (offset, length) into it. The end of each turn (outcome and latency) is
+# logged too, so a replay can be compared with the original run.
+#
+# Handlers only stamp the event and put it on a queue; a background thread
+# does the file writes, like the span logger in metrics.py.
+
+RECORDING_VERSION = 1
+
+
+class SessionRecorder:
+    def __init__(self, directory: str, record_audio: bool = False, sample_rate: float = 1.0):
+        self.record_audio = record_audio
+        self.sample_rate = sample_rate      # fraction of sessions recorded
+        os.makedirs(directory, exist_ok=True)
+        name = f"sessions-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.events_path = os.path.join(directory, f"{name}.events.jsonl")
+        self.audio_path = os.path.join(directory, f"{name}.audio.bin") if record_audio else None
+        self._sessions = set()              # sids being recorded
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._stats = {'sessions': 0, 'events': 0, 'audio_bytes': 0}
+        self._writer = threading.Thread(target=self._write_loop, name="session-recorder", daemon=True)
+        self._writer.start()
+        self._queue.put(({'event': 'recording', 'version': RECORDING_VERSION, 'ts': round(time.time(), 4),
+                          'audio': os.path.basename(self.audio_path) if self.audio_path else None}, None))
+
+    def start_session(self, sid, **fields):
+        """Decide whether this connection is recorded (sampling) and log its connect event"""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        with self._lock:
+            self._sessions.add(sid)
+            self._stats['sessions'] += 1
+        self.record(sid, 'connect', **fields)
+        return True
+
+    def end_session(self, sid):
+        if sid in self._sessions:
+            self.record(sid, 'disconnect')
+            with self._lock:
+                self._sessions.discard(sid)
+
+    def record(self, sid, event, audio: bytes = None, **fields):
+        if sid not in self._sessions:
+            return
+        entry = {'ts': round(time.time(), 4), 'sid': sid, 'event': event, **fields}
+        if audio is not None:
+            entry['bytes'] = len(audio)
+        self._queue.put((entry, audio if self.record_audio else None))
+
+    def _write_loop(self):
+        audio_file = open(self.audio_path, "ab") if self.audio_path else None
+        offset = audio_file.tell() if audio_file else 0
+        with open(self.events_path, "a") as events_file:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                entry, audio = item
+                if audio is not None:
+                    audio_file.write(audio)
+                    entry['audio'] = [offset, len(audio)]
+                    offset += len(audio)
+                events_file.write(json.dumps(entry, separators=(',', ':')) + "\n")
+                with self._lock:
+                    self._stats['events'] += 1
+                    self._stats['audio_bytes'] += len(audio) if audio is not None else 0
+                if self._queue.empty():
+                    events_file.flush()
+                    if audio_file:
+                        audio_file.flush()
+        if audio_file:
+            audio_file.close()
+
+    def stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['recording'] = len(self._sessions)
+        snapshot['events_path'] = self.events_path
+        snapshot['audio_path'] = self.audio_path
+        return snapshot
+
+    def close(self):
+        """Write out everything queued so far and stop the writer"""
+        self._queue.put(None)
+        self._writer.join(timeout=10)
+
+
+# Reads a recording back as {sid: [events in order]} plus the path of its
+# audio sidecar (None when audio was not recorded)
+def load_recording(events_path):
+    sessions = {}
+    audio_path = None
+    with open(events_path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue   # a line cut short by a crash
+            if entry['event'] == 'recording':
+                if entry.get('audio'):
+                    audio_path = os.path.join(os.path.dirname(events_path), entry['audio'])
+                continue
+            sessions.setdefault(entry['sid'], []).append(entry)
+    return sessions, audio_path
@@ -0,0 +1,131 @@
+import time
+import importlib
+import threading
+
+# =================================================================
+# Startup: deferred imports, warm-up and readiness
+# =================================================================
+# Importing google-genai (its pydantic types alone take ~0.45s) and numpy is
+# most of the server's import time, yet neither is needed until the first
+# turn. Modules that use them hold a LazyModule instead, which imports the
+# real module on first attribute access, so the server starts listening
+# (and answers /healthz) without waiting for them.
+#
+# The warm-up then runs on a background thread: it loads the deferred
+# modules, builds the Gemini client and sends each model a cheap probe,
+# which also opens and keeps a warm TLS connection for the first turn. The
+# worker reports ready (/readyz) only once every check has passed. A failed
+# check (no API key, unknown model, API down) is logged and retried.
+#
+#   curl -s localhost:5000/readyz
+
+STARTED_AT = time.monotonic()   # when the server began importing (see the top of server.py)
+deferred_modules = []           # every LazyModule, for the warm-up to load
+# google-genai imports itself circularly, which Python's per-module import
+# locks do not protect when two threads import it at once (one of them gets a
+# partially initialized module), so deferred imports are done one at a time
+_load_lock = threading.RLock()
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access"""
+
+    def __init__(self, name: str):
+        self._lazy_name = name
+        self._lazy_module = None
+        deferred_modules.append(self)
+
+    def load(self):
+        if self._lazy_module is None:
+            with _load_lock:
+                if self._lazy_module is None:
+                    self._lazy_module = importlib.import_module(self._lazy_name)
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._lazy_module is not None else 'not loaded'
+        return f"<lazy module {self._lazy_name!r} ({state})>"
+
+
+# Imports every deferred module now (the first warm-up check)
+def load_deferred_modules():
+    for module in deferred_modules:
+        module.load()
+
+
+class Readiness:
+    """
+    Named warm-up checks, run in order on a background thread. A check that
+    raises is retried every retry_seconds (later checks wait for it). A check
+    added without a function is reported from elsewhere with record().
+    With no checks at all (warm-up disabled) the worker is ready at once.
+    """
+
+    def __init__(self, retry_seconds: float = 5):
+        self.retry_seconds = retry_seconds
+        self._checks = {}      # name -> function, or None when reported with record()
+        self._results = {}     # name -> {'ok', 'ms', 'attempts', 'error'}
+        self._phases = {}      # startup phase -> ms since STARTED_AT
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add_check(self, name, fn=None):
+        with self._lock:
+            self._checks[name] = fn
+            self._results[name] = {'ok': False, 'ms': None, 'attempts': 0, 'error': None}
+
+    def mark(self, phase):
+        """Notes that a startup phase is done (time since the server began importing)"""
+        with self._lock:
+            self._phases[phase] = round((time.monotonic() - STARTED_AT) * 1000, 1)
+
+    def record(self, name, seconds: float, error=None):
+        with self._lock:
+            result = self._results[name]
+            result['attempts'] += 1
+            result['ms'] = round(seconds * 1000, 1)
+            result['ok'] = error is None
+            result['error'] = None if error is None else f"{type(error).__name__}: {error}"
+            became_ready = error is None and all(r['ok'] for r in self._results.values())
+        if error is not None:
+            print(f"Warm-up check '{name}' failed (attempt {result['attempts']}): {result['error']}")
+        elif became_ready:
+            self.mark('ready')
+            timings = ', '.join(f"{check} {result['ms']:.0f}ms" for check, result in self.stats()['checks'].items())
+            print(f"Worker ready {self._phases['ready'] / 1000:.2f}s after startup ({timings})")
+
+    def _run(self):
+        for name, fn in list(self._checks.items()):
+            if fn is None:
+                continue
+            while True:
+                started = time.monotonic()
+                try:
+                    fn()
+                except Exception as e:
+                    self.record(name, time.monotonic() - started, e)
+                    time.sleep(self.retry_seconds)
+                    continue
+                self.record(name, time.monotonic() - started)
+                break
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="warm-up", daemon=True)
+        self._thread.start()
+
+    @property
+    def ready(self):
+        with self._lock:
+            return all(r['ok'] for r in self._results.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': all(r['ok'] for r in self._results.values()),
+                'uptime_seconds': round(time.monotonic() - STARTED_AT, 1),
+                'startup_ms': dict(self._phases),
+                'checks': {name: dict(result) for name, result in self._results.items()},
+            }
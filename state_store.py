@@ -0,0 +1,374 @@
+import os
+import json
+import mmap
+import time
+import threading
+from io import BytesIO
+
+from audio_store import AudioStore
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# =================================================================
+# Shared session and audio state
+# =================================================================
+# The server keeps three kinds of per-session state: the session context
+# (memory scene, conversation history, input format...), the recording
+# buffer of the utterance being streamed, and the rendered reply clips
+# waiting for /audio/<audio_id>. A state store holds all three:
+#
+#   MemoryStateStore - in-process dicts plus the AudioStore (one worker)
+#   RedisStateStore  - a Redis server shared by every worker, so a client can
+#                      reconnect to another worker, or fetch /audio from one,
+#                      without losing anything
+#
+# Sessions are saved explicitly with update_session(); a loaded session is a
+# copy (object_fields, such as the conversation history, are copied through
+# their to_state()/from_state() by both stores). Loading a session and
+# streaming audio into its recording buffer keep it alive too, so a player
+# who only talks never outlives the session TTL.
+#
+# Clips are kept by reference where possible: with a shared directory (a
+# volume every worker mounts) the clip is written there once and Redis only
+# holds its path, so the audio bytes never travel through Redis.
+
+
+class MemoryStateStore:
+    def __init__(self, audio_store: AudioStore, session_ttl_seconds: float = 3600, object_fields: dict = None):
+        self.audio_store = audio_store
+        self.session_ttl_seconds = session_ttl_seconds
+        self.object_fields = object_fields or {}   # field name -> class with to_state()/from_state()
+        self._sessions = {}     # key -> (fields dict, expires_at)
+        self._buffers = {}      # key -> BytesIO recording buffer
+        self._next_purge = 0.0
+        self._lock = threading.Lock()
+
+    def _purge_expired_sessions(self, now):
+        if now < self._next_purge:
+            return
+        self._next_purge = now + 60
+        expired = [key for key, (_, expires_at) in self._sessions.items() if expires_at <= now]
+        for key in expired:
+            del self._sessions[key]
+
+    # --- Sessions ---
+
+    # A copy of session fields that shares no mutable object with the caller
+    def _copy(self, fields):
+        copied = dict(fields)
+        for name, cls in self.object_fields.items():
+            if copied.get(name) is not None:
+                copied[name] = cls.from_state(copied[name].to_state())
+        return copied
+
+    # Extends a live session's TTL; called with the lock held
+    def _touch(self, key, now):
+        entry = self._sessions.get(key)
+        if entry is None or entry[1] <= now:
+            return None
+        self._sessions[key] = (entry[0], now + self.session_ttl_seconds)
+        return entry[0]
+
+    def load_session(self, key):
+        """The session's fields as a dict, or None if it does not exist (or expired); refreshes its TTL"""
+        with self._lock:
+            session = self._touch(key, time.monotonic())
+            return None if session is None else self._copy(session)
+
+    def update_session(self, key, fields):
+        """Create the session or overwrite the given fields; refreshes its TTL"""
+        now = time.monotonic()
+        fields = self._copy(fields)
+        with self._lock:
+            entry = self._sessions.get(key)
+            session = entry[0] if entry and entry[1] > now else {}
+            session.update(fields)
+            self._sessions[key] = (session, now + self.session_ttl_seconds)
+            self._purge_expired_sessions(now)
+
+    def delete_session(self, key):
+        with self._lock:
+            self._sessions.pop(key, None)
+
+    # --- Recording buffers ---
+
+    def reset_buffer(self, key):
+        """Start a new, empty recording buffer"""
+        with self._lock:
+            self._buffers[key] = BytesIO()
+
+    def append_buffer(self, key, chunk: bytes):
+        """Append a chunk (refreshing the session's TTL); False if no recording was started"""
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                return False
+            buffer.write(chunk)
+            self._touch(key, time.monotonic())
+            return True
+
+    def has_buffer(self, key):
+        with self._lock:
+            return key in self._buffers
+
+    def take_buffer(self, key):
+        """Return the recording so far and leave an empty buffer in its place (None if none was started)"""
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                return None
+            self._buffers[key] = BytesIO()
+            self._touch(key, time.monotonic())
+        return buffer.getvalue()
+
+    def delete_buffer(self, key):
+        with self._lock:
+            self._buffers.pop(key, None)
+
+    # --- Reply clips ---
+
+    def put_audio(self, audio_id, parts):
+        self.audio_store.put(audio_id, parts)
+
+    def get_audio(self, audio_id):
+        return self.audio_store.get(audio_id)
+
+    def audio_stats(self):
+        return self.audio_store.stats()
+
+    def start_sweeper(self):
+        self.audio_store.start_sweeper()
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'sessions': len(self._sessions), 'buffers': len(self._buffers)}
+
+    def close(self):
+        self.audio_store.close()
+
+
+class RedisStateStore:
+    """
+    State in Redis (or anything speaking its protocol). A session is a hash
+    with one JSON-encoded field per session field, so concurrent updates to
+    different fields never overwrite each other. object_fields maps a field
+    name to a class with to_state()/from_state() for values that are not
+    plain JSON (the conversation history).
+
+    A started recording buffer begins with RECORDING_MARK. APPEND creates a
+    missing key, so a chunk sent without a recording leaves a key without
+    the mark, which append_buffer removes again (unless a new recording has
+    replaced it in the meantime) and take_buffer ignores.
+    """
+
+    RECORDING_MARK = b"R"
+
+    def __init__(self, client, prefix: str = 'chatbot', session_ttl_seconds: int = 3600,
+                 audio_ttl_seconds: int = 300, audio_grace_seconds: int = 30, audio_dir: str = None,
+                 object_fields: dict = None):
+        self.client = client
+        self.prefix = prefix
+        self.session_ttl_seconds = session_ttl_seconds
+        self.audio_ttl_seconds = audio_ttl_seconds
+        self.audio_grace_seconds = audio_grace_seconds
+        self.audio_dir = audio_dir      # shared directory for clips, or None to store them in Redis
+        self.object_fields = object_fields or {}
+        if audio_dir:
+            os.makedirs(audio_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {'puts': 0, 'hits': 0, 'misses': 0, 'bytes_by_reference': 0, 'bytes_inline': 0,
+                       'files_swept': 0}
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        if redis is None:
+            raise RuntimeError("STATE_BACKEND=redis requires the 'redis' package (pip install redis)")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _key(self, kind, key):
+        return f"{self.prefix}:{kind}:{key}"
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _encode(self, name, value):
+        if name in self.object_fields and value is not None:
+            value = value.to_state()
+        return json.dumps(value)
+
+    def _decode(self, name, raw):
+        value = json.loads(raw)
+        if name in self.object_fields and value is not None:
+            value = self.object_fields[name].from_state(value)
+        return value
+
+    # --- Sessions ---
+
+    def load_session(self, key):
+        redis_key = self._key('session', key)
+        pipe = self.client.pipeline()
+        pipe.hgetall(redis_key)
+        pipe.expire(redis_key, self.session_ttl_seconds)
+        raw, _ = pipe.execute()
+        if not raw:
+            return None
+        return {name.decode(): self._decode(name.decode(), value) for name, value in raw.items()}
+
+    def update_session(self, key, fields):
+        redis_key = self._key('session', key)
+        pipe = self.client.pipeline()
+        pipe.hset(redis_key, mapping={name: self._encode(name, value) for name, value in fields.items()})
+        pipe.expire(redis_key, self.session_ttl_seconds)
+        pipe.execute()
+
+    def delete_session(self, key):
+        self.client.delete(self._key('session', key))
+
+    # --- Recording buffers ---
+
+    def reset_buffer(self, key):
+        self.client.set(self._key('buffer', key), self.RECORDING_MARK, ex=self.session_ttl_seconds)
+
+    def append_buffer(self, key, chunk: bytes):
+        redis_key = self._key('buffer', key)
+        # APPEND would create a missing buffer; check in the same round trip and undo if so.
+        # Both the buffer and the session stay alive while audio keeps coming.
+        pipe = self.client.pipeline()
+        pipe.exists(redis_key)
+        pipe.append(redis_key, chunk)
+        pipe.expire(redis_key, self.session_ttl_seconds)
+        pipe.expire(self._key('session', key), self.session_ttl_seconds)
+        existed = pipe.execute()[0]
+        if not existed:
+            self._discard_unmarked(redis_key)
+            return False
+        return True
+
+    # Deletes a buffer key that APPEND created, unless it is (by now) a started recording
+    def _discard_unmarked(self, redis_key):
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(redis_key)
+                if pipe.getrange(redis_key, 0, len(self.RECORDING_MARK) - 1) == self.RECORDING_MARK:
+                    return
+                pipe.multi()
+                pipe.delete(redis_key)
+                pipe.execute()
+            except redis.WatchError:
+                pass   # changed since: reset_buffer started a new recording
+
+    def has_buffer(self, key):
+        return bool(self.client.exists(self._key('buffer', key)))
+
+    def take_buffer(self, key):
+        redis_key = self._key('buffer', key)
+        pipe = self.client.pipeline()   # MULTI/EXEC: no chunk lands between the read and the reset
+        pipe.get(redis_key)
+        pipe.set(redis_key, self.RECORDING_MARK, ex=self.session_ttl_seconds, xx=True)
+        pipe.expire(self._key('session', key), self.session_ttl_seconds)
+        data = pipe.execute()[0]
+        if data is None or not data.startswith(self.RECORDING_MARK):
+            return None
+        return data[len(self.RECORDING_MARK):]
+
+    def delete_buffer(self, key):
+        self.client.delete(self._key('buffer', key))
+
+    # --- Reply clips ---
+
+    def put_audio(self, audio_id, parts):
+        if isinstance(parts, (bytes, bytearray, memoryview)):
+            parts = (parts,)
+        size = sum(len(part) for part in parts)
+        redis_key = self._key('audio', audio_id)
+        if self.audio_dir:
+            path = os.path.join(self.audio_dir, f"{audio_id}.wav")
+            if os.path.exists(path):
+                # Stable ids (scene intros) name identical content; just keep the file from being swept
+                os.utime(path)
+            else:
+                temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temp_path, "wb") as f:
+                    for part in parts:
+                        f.write(part)
+                os.replace(temp_path, path)
+            mapping = {'path': path, 'size': size}
+            self._count('bytes_by_reference', size)
+        else:
+            mapping = {'data': b"".join(parts), 'size': size}
+            self._count('bytes_inline', size)
+        pipe = self.client.pipeline()
+        pipe.delete(redis_key)
+        pipe.hset(redis_key, mapping=mapping)
+        pipe.expire(redis_key, self.audio_ttl_seconds)
+        pipe.execute()
+        self._count('puts')
+
+    def get_audio(self, audio_id):
+        """Like AudioStore.get: the first read shortens the clip's lifetime to the grace window"""
+        redis_key = self._key('audio', audio_id)
+        pipe = self.client.pipeline()
+        pipe.hgetall(redis_key)
+        pipe.expire(redis_key, self.audio_grace_seconds, lt=True)
+        fields, _ = pipe.execute()
+        if not fields:
+            self._count('misses')
+            return None
+        if b'data' in fields:
+            self._count('hits')
+            return (fields[b'data'],)
+        try:
+            with open(fields[b'path'].decode(), "rb") as f:
+                clip = (memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)),)
+        except (OSError, ValueError):
+            # Swept or never reached this worker's view of the shared directory
+            self._count('misses')
+            return None
+        self._count('hits')
+        return clip
+
+    def audio_stats(self):
+        with self._lock:
+            snapshot = dict(self._stats)
+        # Nothing is held in this worker's memory; the clips live in Redis or the shared directory
+        snapshot['entries'] = 0
+        snapshot['memory_bytes'] = 0
+        snapshot['disk_bytes'] = 0
+        return snapshot
+
+    def sweep(self):
+        """Remove shared clip files older than the clip TTL plus the grace window"""
+        if not self.audio_dir:
+            return
+        cutoff = time.time() - self.audio_ttl_seconds - self.audio_grace_seconds
+        try:
+            names = os.listdir(self.audio_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.audio_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    self._count('files_swept')
+            except OSError:
+                pass   # another worker got there first
+
+    def start_sweeper(self, interval_seconds: float = 30):
+        def loop():
+            while True:
+                time.sleep(interval_seconds)
+                self.sweep()
+        threading.Thread(target=loop, name="state-store-sweeper", daemon=True).start()
+
+    def stats(self):
+        return {'backend': 'redis', 'prefix': self.prefix, 'audio_dir': self.audio_dir,
+                'sessions': sum(1 for _ in self.client.scan_iter(match=self._key('session', '*'), count=500))}
+
+    def close(self):
+        # Shared clips belong to every worker; the sweeper (of whichever worker is left) removes them
+        self.client.close()
@@ -0,0 +1,134 @@
+import io
+import wave
+
+import numpy as np
+import pytest
+
+import server
+from audio_codec import encode_pcm, ffmpeg_available, parse_sample_rate, resample_pcm16
+from turn_pipeline import pushed_audio_fields
+
+
+# One second of a 440 Hz tone as 16-bit mono PCM
+def tone(sample_rate, seconds=1.0):
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    return (np.sin(2 * np.pi * 440 * t) * 8000).astype('<i2').tobytes()
+
+
+# --- encode_pcm ---
+
+def test_pcm16_at_the_source_rate_is_unchanged():
+    pcm = tone(24000)
+    assert encode_pcm(pcm, 24000, 'pcm16') == pcm
+    assert encode_pcm(pcm, 24000, 'pcm16', target_rate=24000) == pcm
+
+
+@pytest.mark.parametrize('target_rate', [16000, 8000, 48000])
+def test_pcm16_is_resampled_to_the_target_rate(target_rate):
+    pcm = encode_pcm(tone(24000), 24000, 'pcm16', target_rate=target_rate)
+    assert len(pcm) == 2 * target_rate
+
+
+def test_downsampling_keeps_the_tone():
+    samples = np.frombuffer(resample_pcm16(tone(24000), 24000, 8000), dtype='<i2')
+    spectrum = np.abs(np.fft.rfft(samples))
+    assert np.argmax(spectrum) == 440   # 1 Hz bins over one second
+
+
+def test_wav_carries_the_target_rate():
+    data = encode_pcm(tone(24000), 24000, 'wav', target_rate=16000)
+    with wave.open(io.BytesIO(data)) as wf:
+        assert (wf.getnchannels(), wf.getsampwidth(), wf.getframerate()) == (1, 2, 16000)
+        assert wf.getnframes() == 16000
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        encode_pcm(tone(24000), 24000, 'mp3')
+
+
+@pytest.mark.skipif(not ffmpeg_available(), reason="ffmpeg is not installed")
+def test_opus_is_an_ogg_stream():
+    data = encode_pcm(tone(24000), 24000, 'opus')
+    assert data[:4] == b'OggS'
+    assert len(data) < len(tone(24000)) // 4
+
+
+def test_pushed_audio_fields_describe_the_encoded_clip():
+    pcm = tone(24000, seconds=0.5)
+    fields = pushed_audio_fields('clip', pcm, 24000, {'format': 'pcm16', 'sample_rate': 16000}, '24k', 'ffmpeg')
+    assert fields['audio_id'] == 'clip'
+    assert fields['duration'] == pytest.approx(0.5)
+    assert (fields['format'], fields['sample_rate']) == ('pcm16', 16000)
+    assert len(fields['data']) == 16000
+
+
+# --- Sample rates ---
+
+@pytest.mark.parametrize('value, expected', [
+    (16000, 16000),
+    ("44100", 44100),
+    (8000, 8000),
+    (192000, 192000),
+    (7999, None),
+    (192001, None),
+    (True, None),
+    ("fast", None),
+    (None, None),
+    (float('inf'), None),
+])
+def test_parse_sample_rate(value, expected):
+    assert parse_sample_rate(value) == expected
+
+
+@pytest.mark.parametrize('value, expected', [
+    (16000, 16000),
+    (48000, server.TTS_SAMPLE_RATE),   # never upsampled past the TTS rate
+    ("bogus", server.TTS_SAMPLE_RATE),
+])
+def test_push_sample_rate(value, expected):
+    assert server.push_sample_rate(value) == expected
+
+
+# --- Push format negotiation ---
+
+@pytest.fixture
+def no_ffmpeg(monkeypatch):
+    monkeypatch.setattr(server, 'ffmpeg_available', lambda path='ffmpeg': False)
+
+
+@pytest.fixture
+def with_ffmpeg(monkeypatch):
+    monkeypatch.setattr(server, 'ffmpeg_available', lambda path='ffmpeg': True)
+
+
+def test_audio_urls_unless_push_is_asked_for():
+    assert server.negotiate_audio_delivery({}) is None
+    assert server.negotiate_audio_delivery({'audio_delivery': 'url', 'audio_format': 'opus'}) is None
+
+
+def test_push_defaults_to_pcm16_at_the_tts_rate():
+    assert server.negotiate_audio_delivery({'audio_delivery': 'push'}) == {
+        'format': 'pcm16', 'sample_rate': server.TTS_SAMPLE_RATE}
+
+
+def test_push_keeps_the_requested_format_and_rate():
+    delivery = server.negotiate_audio_delivery({'audio_delivery': 'push', 'audio_format': 'wav',
+                                                'audio_sample_rate': 16000})
+    assert delivery == {'format': 'wav', 'sample_rate': 16000}
+
+
+def test_unknown_format_falls_back_to_pcm16():
+    delivery = server.negotiate_audio_delivery({'audio_delivery': 'push', 'audio_format': 'mp3'})
+    assert delivery['format'] == 'pcm16'
+
+
+def test_opus_needs_ffmpeg(no_ffmpeg):
+    delivery = server.negotiate_audio_delivery({'audio_delivery': 'push', 'audio_format': 'opus'})
+    assert delivery == {'format': 'pcm16', 'sample_rate': server.TTS_SAMPLE_RATE}
+
+
+def test_opus_is_always_sent_at_48k(with_ffmpeg):
+    delivery = server.negotiate_audio_delivery({'audio_delivery': 'push', 'audio_format': 'opus',
+                                                'audio_sample_rate': 16000})
+    assert delivery == {'format': 'opus', 'sample_rate': 48000}
@@ -0,0 +1,25 @@
+import numpy as np
+
+from audio_ingest import AudioIngest
+
+SAMPLE_RATE = 16000
+
+
+def tone(seconds):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (3000 * np.sin(2 * np.pi * 220 * t)).astype('<i2').tobytes()
+
+
+def test_interim_windows_are_counted_apart_from_recordings():
+    ingest = AudioIngest(ffmpeg_path='no-such-ffmpeg')
+    window = tone(1.0)
+    recording = tone(2.0)
+    ingest.process(window, 'pcm16', SAMPLE_RATE, window=True)
+    ingest.process(window, 'pcm16', SAMPLE_RATE, window=True)
+    audio, _ = ingest.process(recording, 'pcm16', SAMPLE_RATE)
+    assert audio[1] == 'audio/wav'
+    stats = ingest.stats()
+    assert stats['recordings'] == 1
+    assert stats['bytes_in'] == len(recording)
+    assert stats['windows'] == 2
+    assert stats['window_bytes_in'] == 2 * len(window)
@@ -0,0 +1,93 @@
+import pytest
+
+import server
+from turn_pipeline import parse_range_header
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+# A published reply clip: (audio_id, the WAV bytes /audio serves for it)
+@pytest.fixture
+def clip():
+    pcm = bytes(range(256)) * 8
+    audio_id, _, _ = server.publish_audio(pcm, 'localhost')
+    return audio_id, server.create_wav_header(len(pcm)) + pcm
+
+
+# --- /audio/<audio_id> ---
+
+def test_full_clip(client, clip):
+    audio_id, wav = clip
+    response = client.get(f'/audio/{audio_id}')
+    assert response.status_code == 200
+    assert response.data == wav
+    assert response.headers['ETag'] == f'"{audio_id}"'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Content-Length'] == str(len(wav))
+    assert response.headers['Content-Type'] == 'audio/wav'
+
+
+@pytest.mark.parametrize('range_header, start, end', [
+    ('bytes=0-43', 0, 43),          # the WAV header only
+    ('bytes=40-1000', 40, 1000),    # across the header/PCM boundary
+    ('bytes=-100', None, None),     # the last 100 bytes
+    ('bytes=2000-', 2000, None),    # to the end
+])
+def test_range_request(client, clip, range_header, start, end):
+    audio_id, wav = clip
+    if start is None:
+        start = len(wav) - 100
+    if end is None:
+        end = len(wav) - 1
+    response = client.get(f'/audio/{audio_id}', headers={'Range': range_header})
+    assert response.status_code == 206
+    assert response.data == wav[start:end + 1]
+    assert response.headers['Content-Range'] == f'bytes {start}-{end}/{len(wav)}'
+    assert response.headers['Content-Length'] == str(end - start + 1)
+
+
+def test_unsatisfiable_range(client, clip):
+    audio_id, wav = clip
+    response = client.get(f'/audio/{audio_id}', headers={'Range': f'bytes={len(wav)}-'})
+    assert response.status_code == 416
+    assert response.data == b""
+    assert response.headers['Content-Range'] == f'bytes */{len(wav)}'
+
+
+def test_current_copy_is_not_sent_again(client, clip):
+    audio_id, _ = clip
+    response = client.get(f'/audio/{audio_id}', headers={'If-None-Match': f'"{audio_id}"'})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers['ETag'] == f'"{audio_id}"'
+
+
+def test_stale_if_range_gets_the_whole_clip(client, clip):
+    audio_id, wav = clip
+    response = client.get(f'/audio/{audio_id}', headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+    assert response.status_code == 200
+    assert response.data == wav
+
+
+def test_unknown_clip(client):
+    assert client.get('/audio/no-such-clip').status_code == 404
+
+
+# --- Range header parsing ---
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('items=0-9', None),            # not bytes
+    ('bytes=0-9,20-29', None),      # multiple ranges: served whole
+    ('bytes=a-b', None),
+    ('bytes=5-2', False),
+    ('bytes=100-', False),          # starts past the end
+    ('bytes=-0', False),
+    ('bytes=90-200', (90, 99)),     # end clamped to the clip
+    ('bytes=-500', (0, 99)),        # suffix longer than the clip
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 100) == expected
@@ -0,0 +1,64 @@
+import pytest
+
+from audio_store import AudioStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AudioStore(max_memory_bytes=200, max_disk_bytes=250, spill_dir=str(tmp_path))
+    yield store
+    store.close()
+
+
+def clip(n):
+    return bytes([n]) * 100
+
+
+def test_cold_clips_spill_to_disk_and_stay_readable(store):
+    for n in range(4):
+        store.put(f"a{n}", clip(n))
+    stats = store.stats()
+    assert stats['memory_bytes'] <= 200
+    assert stats['disk_bytes'] == 200
+    assert stats['spills'] == 2
+    assert bytes(store.get("a0")[0]) == clip(0)
+
+
+def test_disk_budget_evicts_only_spilled_clips(store):
+    for n in range(5):
+        store.put(f"a{n}", clip(n))
+    # a0..a2 were spilled (300 bytes > 250): the coldest spilled clip goes, the hot ones in memory stay
+    assert "a0" not in store
+    assert all(f"a{n}" in store for n in range(1, 5))
+    stats = store.stats()
+    assert stats['evicted'] == 1
+    assert stats['disk_bytes'] == 200
+    assert stats['memory_bytes'] == 200
+
+
+def test_recently_read_spilled_clip_outlives_colder_ones(store):
+    for n in range(4):
+        store.put(f"a{n}", clip(n))
+    store.get("a0")   # a0 (on disk) is now the most recently used
+    store.put("a4", clip(4))
+    assert "a0" in store
+    assert "a1" not in store
+
+
+def test_spill_dir_is_created_on_the_first_spill(tmp_path):
+    spill_dir = tmp_path / "spill"
+    store = AudioStore(max_memory_bytes=200, spill_dir=str(spill_dir))
+    store.put("a0", clip(0))
+    store.put("a1", clip(1))
+    assert not spill_dir.exists()
+    store.put("a2", clip(2))
+    assert spill_dir.exists()
+    store.close()
+    assert not spill_dir.exists()
+
+
+def test_store_without_spills_creates_no_temp_dir():
+    store = AudioStore(max_memory_bytes=200)
+    store.put("a0", clip(0))
+    assert store.spill_dir is None
+    store.close()
@@ -0,0 +1,98 @@
+import time
+
+from resilience import CircuitBreaker
+
+
+# A breaker that opens on 2 failures out of its last 4 calls and cools down briefly
+def breaker(open_seconds=0.05):
+    return CircuitBreaker('llm', window_seconds=30, min_calls=4, failure_ratio=0.5, open_seconds=open_seconds)
+
+
+# Records calls on the breaker: True for a failure
+def record(circuit, *failures):
+    for failed in failures:
+        circuit.record(failed)
+
+
+def test_stays_closed_below_min_calls_or_failure_ratio():
+    circuit = breaker()
+    record(circuit, True, True, True)
+    assert circuit.state == 'closed'
+    circuit = breaker()
+    record(circuit, True, False, False, False)
+    assert circuit.state == 'closed'
+    assert circuit.allow()
+    assert circuit.stats()['window_failures'] == 1
+
+
+def test_opens_at_the_failure_ratio_and_short_circuits():
+    circuit = breaker(open_seconds=10)
+    record(circuit, True, False, True, False)
+    assert circuit.state == 'open'
+    assert circuit.rejecting()
+    assert not circuit.allow()
+    assert not circuit.allow()
+    stats = circuit.stats()
+    assert stats['opened'] == 1
+    assert stats['short_circuited'] == 2
+    assert stats['window_calls'] == 0
+
+
+def test_calls_finishing_while_open_are_ignored():
+    circuit = breaker(open_seconds=10)
+    record(circuit, True, True, False, False)
+    record(circuit, False, False, False)
+    assert circuit.state == 'open'
+    assert circuit.stats()['window_calls'] == 0
+
+
+def test_half_open_lets_one_probe_through():
+    circuit = breaker()
+    record(circuit, True, True, True, True)
+    time.sleep(0.06)
+    assert not circuit.rejecting()
+    assert circuit.allow()
+    assert circuit.state == 'half_open'
+    # Everything else waits for the probe's result
+    assert not circuit.allow()
+
+
+def test_successful_probe_closes_the_breaker():
+    circuit = breaker()
+    record(circuit, True, True, True, True)
+    time.sleep(0.06)
+    assert circuit.allow()
+    circuit.record(False)
+    assert circuit.state == 'closed'
+    assert circuit.allow() and circuit.allow()
+
+
+def test_failed_probe_opens_it_again():
+    circuit = breaker()
+    record(circuit, True, True, True, True)
+    time.sleep(0.06)
+    assert circuit.allow()
+    circuit.record(True)
+    assert circuit.state == 'open'
+    assert circuit.rejecting()
+    assert circuit.stats()['opened'] == 2
+
+
+def test_probe_that_never_reports_back_is_written_off():
+    circuit = breaker()
+    record(circuit, True, True, True, True)
+    time.sleep(0.06)
+    assert circuit.allow()
+    assert not circuit.allow()
+    time.sleep(0.06)
+    assert circuit.allow()
+    assert circuit.state == 'half_open'
+
+
+def test_failures_outside_the_window_are_forgotten():
+    circuit = CircuitBreaker('llm', window_seconds=0.05, min_calls=4, failure_ratio=0.5)
+    record(circuit, True, True, True)
+    time.sleep(0.06)
+    circuit.record(False)
+    assert circuit.state == 'closed'
+    assert circuit.stats()['window_calls'] == 1
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import random
+import wave
+
+import pytest
+from google.api_core.exceptions import ServiceUnavailable
+from google.genai import types
+
+from gemini_backend import (FAKE_REPLIES, FAKE_TRANSCRIPTS, FakeGeminiBackend, load_canned_audio, make_backend,
+                            parse_latency, parse_model_slowdowns)
+
+
+def audio_config():
+    return types.GenerateContentConfig(response_modalities=["AUDIO"])
+
+
+def fused_config():
+    return types.GenerateContentConfig(response_mime_type="application/json")
+
+
+def recording():
+    return types.Part(inline_data=types.Blob(data=b"\x00" * 320, mime_type="audio/wav"))
+
+
+# --- Latency and slowdown specs ---
+
+@pytest.mark.parametrize('spec, low, high', [
+    ("fixed:300", 0.3, 0.3),
+    ("uniform:200,600", 0.2, 0.6),
+    ("normal:500,100", 0.0, 1.5),
+    ("lognormal:800,0.4", 0.0, 10.0),
+])
+def test_parse_latency(spec, low, high):
+    sample = parse_latency(spec)
+    rng = random.Random(1)
+    assert all(low <= sample(rng) <= high for _ in range(50))
+
+
+@pytest.mark.parametrize('spec', ["bogus:1", "fixed:abc", ""])
+def test_parse_latency_rejects_bad_specs(spec):
+    with pytest.raises(ValueError):
+        parse_latency(spec)
+
+
+def test_parse_model_slowdowns():
+    assert parse_model_slowdowns("flash=3@10-20, pro=2") == {
+        'flash': (3.0, 10.0, 20.0),
+        'pro': (2.0, 0.0, float('inf')),
+    }
+    assert parse_model_slowdowns("") == {}
+    with pytest.raises(ValueError):
+        parse_model_slowdowns("flash=fast")
+
+
+# --- FakeGeminiBackend ---
+
+def test_each_stage_gets_its_canned_answer():
+    backend = FakeGeminiBackend(seed=1)
+    assert backend.generate_content("m", [recording(), "Transcribe"]).text in FAKE_TRANSCRIPTS
+    assert backend.generate_content("m", ["Hello"]).text in FAKE_REPLIES
+    fused = json.loads(backend.generate_content("m", [recording()], config=fused_config()).text)
+    assert fused['transcript'] in FAKE_TRANSCRIPTS and fused['reply'] in FAKE_REPLIES
+    blob = backend.generate_content("m", ["Say this."], config=audio_config()).candidates[0].content.parts[0]
+    assert blob.inline_data.mime_type == "audio/L16;codec=pcm;rate=24000"
+    assert backend.stats['stt'] == backend.stats['llm'] == backend.stats['fused'] == backend.stats['tts'] == 1
+
+
+def test_synthesized_speech_lasts_as_long_as_the_text():
+    backend = FakeGeminiBackend(speech_chars_per_second=10)
+    response = backend.generate_content("m", ["x" * 20], config=audio_config())
+    pcm = response.candidates[0].content.parts[0].inline_data.data
+    assert len(pcm) == 2 * 24000 * 2
+
+
+def test_canned_audio_is_returned_as_is():
+    backend = FakeGeminiBackend(audio_pcm=b"\x01\x02" * 10)
+    response = backend.generate_content("m", ["Anything"], config=audio_config())
+    assert response.candidates[0].content.parts[0].inline_data.data == b"\x01\x02" * 10
+
+
+def test_stream_yields_the_reply_word_by_word():
+    backend = FakeGeminiBackend()
+    chunks = [response.text for response in backend.generate_content_stream("m", ["Hello"])]
+    assert len(chunks) > 1
+    assert "".join(chunks).strip() in FAKE_REPLIES
+
+
+def test_async_calls_match_the_sync_ones():
+    async def run():
+        backend = FakeGeminiBackend()
+        reply = await backend.agenerate_content("m", ["Hello"])
+        chunks = [response.text async for response in backend.agenerate_content_stream("m", ["Hello"])]
+        return reply.text, "".join(chunks).strip()
+
+    reply, streamed = asyncio.run(run())
+    assert reply in FAKE_REPLIES and streamed in FAKE_REPLIES
+
+
+def test_error_rate_injects_503s():
+    backend = FakeGeminiBackend(error_rate=1.0)
+    with pytest.raises(ServiceUnavailable):
+        backend.generate_content("m", ["Hello"])
+    assert backend.stats['injected_errors'] == 1
+    # Probes never fail
+    backend.probe("m")
+    assert backend.stats['probes'] == 1
+
+
+def test_same_seed_gives_the_same_run():
+    def run(seed):
+        backend = FakeGeminiBackend(seed=seed, error_rate=0.5)
+        outcomes = []
+        for _ in range(20):
+            try:
+                outcomes.append(backend.generate_content("m", ["Hello"]).text)
+            except ServiceUnavailable:
+                outcomes.append(None)
+        return outcomes
+
+    assert run(7) == run(7)
+    assert None in run(7)
+
+
+def test_model_slowdown_applies_only_to_that_model():
+    backend = FakeGeminiBackend(latencies={'llm': parse_latency("fixed:100")},
+                                model_slowdowns={'slow': (3.0, 0.0, float('inf'))})
+    assert backend._draw('llm', 'slow')[0] == pytest.approx(0.3)
+    assert backend._draw('llm', 'fast')[0] == pytest.approx(0.1)
+
+
+def test_slowdown_outside_its_window_is_ignored():
+    backend = FakeGeminiBackend(latencies={'llm': parse_latency("fixed:100")},
+                                model_slowdowns={'slow': (3.0, 60.0, 120.0)})
+    assert backend._draw('llm', 'slow')[0] == pytest.approx(0.1)
+
+
+# --- Backend setup ---
+
+def test_load_canned_audio_reads_wav_and_raw_pcm(tmp_path):
+    pcm = b"\x10\x00" * 100
+    wav_path = tmp_path / "reply.wav"
+    with wave.open(str(wav_path), "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(24000)
+        wf.writeframes(pcm)
+    raw_path = tmp_path / "reply.pcm"
+    raw_path.write_bytes(pcm)
+    assert load_canned_audio(str(wav_path)) == pcm
+    assert load_canned_audio(str(raw_path)) == pcm
+
+
+def test_make_backend_builds_the_fake_from_options():
+    backend = make_backend('fake', {'latencies': {'tts': "fixed:250"}, 'error_rate': 0.1, 'seed': 3})
+    assert isinstance(backend, FakeGeminiBackend)
+    assert backend.error_rate == 0.1
+    assert backend.latencies['tts'](None) == pytest.approx(0.25)
+    with pytest.raises(ValueError):
+        make_backend('other')
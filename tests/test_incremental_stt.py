@@ -0,0 +1,128 @@
+from io import BytesIO
+from concurrent.futures import Future
+
+import numpy as np
+
+from incremental_stt import IncrementalTranscriber
+
+SAMPLE_RATE = 16000
+
+
+class ManualExecutor:
+    """Holds submitted work until run_pending(), so windows finish in a known order"""
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.pending.append((future, fn, args))
+        return future
+
+    def run_pending(self):
+        while self.pending:
+            future, fn, args = self.pending.pop(0)
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+
+def tone(seconds):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return (3000 * np.sin(2 * np.pi * 220 * t)).astype('<i2').tobytes()
+
+
+class FakeSTT:
+    """Answers window n with 'wn' and the whole recording with 'full'; fails the calls listed in fail"""
+
+    def __init__(self, fail=(), total_bytes=None):
+        self.fail = set(fail)
+        self.total_bytes = total_bytes
+        self.calls = 0
+        self.window_flags = []   # the window argument of each call
+
+    def __call__(self, pcm, is_pcm, window):
+        self.calls += 1
+        self.window_flags.append(window)
+        if self.calls in self.fail:
+            raise RuntimeError(f"STT call {self.calls} failed")
+        if len(pcm) == self.total_bytes:
+            return "full"
+        return f"w{self.calls}"
+
+
+# Streams the recording in 100 ms chunks, letting each submitted window finish before the next chunk
+def feed(transcriber, pcm, chunk_bytes=3200):
+    for offset in range(0, len(pcm), chunk_bytes):
+        transcriber.append(pcm[offset:offset + chunk_bytes])
+        transcriber.executor.run_pending()
+
+
+def make_transcriber(stt):
+    return IncrementalTranscriber(BytesIO(), stt, ManualExecutor(), on_partial=lambda text: None,
+                                  sample_rate=SAMPLE_RATE, window_seconds=1.0)
+
+
+def test_windows_and_tail_make_the_transcript():
+    pcm = tone(3.6)
+    stt = FakeSTT(total_bytes=len(pcm))
+    transcriber = make_transcriber(stt)
+    feed(transcriber, pcm)
+    windows = transcriber.stats['windows']
+    assert windows >= 3
+    # Every window and the tail are transcribed once, in order
+    assert transcriber.finish() == " ".join(f"w{n}" for n in range(1, windows + 2))
+    assert stt.calls == windows + 1
+    # Only the tail, sent at stop time, counts as the recording in the ingest stats
+    assert stt.window_flags == [True] * windows + [False]
+
+
+def test_failed_window_falls_back_to_the_whole_recording():
+    pcm = tone(3.6)
+    stt = FakeSTT(fail={1}, total_bytes=len(pcm))
+    transcriber = make_transcriber(stt)
+    feed(transcriber, pcm)
+    # No windows are sent after the failure; the audio of window 1 is not lost
+    assert transcriber.stats['failed_windows'] == 1
+    assert stt.calls == 1
+    assert transcriber.finish() == "full"
+
+
+def test_failed_later_window_still_transcribes_everything():
+    pcm = tone(3.6)
+    stt = FakeSTT(fail={2}, total_bytes=len(pcm))
+    transcriber = make_transcriber(stt)
+    feed(transcriber, pcm)
+    assert transcriber.finish() == "full"
+
+
+# --- Compressed input (whole-prefix windows) ---
+
+# A WebM transcriber whose prefix windows are due on every chunk
+def make_webm_transcriber(stt, max_prefix_windows):
+    return IncrementalTranscriber(BytesIO(), stt, ManualExecutor(), on_partial=lambda text: None,
+                                  input_format='webm', window_seconds=0.0, max_prefix_windows=max_prefix_windows)
+
+
+def test_webm_prefix_windows_are_capped():
+    data = b'\x1a\x45\xdf\xa3' + bytes(4000)
+    stt = FakeSTT(total_bytes=len(data))
+    transcriber = make_webm_transcriber(stt, max_prefix_windows=2)
+    feed(transcriber, data, chunk_bytes=400)
+    # Two interim prefixes, then nothing until stop, where the whole recording is sent once
+    assert transcriber.stats['windows'] == 2
+    assert transcriber.stats['prefix_capped'] == 1
+    assert transcriber.finish() == "full"
+    assert stt.calls == 3
+    assert stt.window_flags == [True, True, False]
+
+
+def test_webm_last_prefix_is_reused_when_nothing_followed_it():
+    data = b'\x1a\x45\xdf\xa3' + bytes(796)
+    stt = FakeSTT(total_bytes=len(data))
+    transcriber = make_webm_transcriber(stt, max_prefix_windows=4)
+    feed(transcriber, data, chunk_bytes=400)
+    assert transcriber.finish() == "full"
+    assert stt.calls == 2
+    assert stt.window_flags == [True, True]
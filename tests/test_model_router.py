@@ -0,0 +1,93 @@
+import time
+
+from model_router import ModelRouter
+
+
+def make_router(**options):
+    settings = dict(tiers={'llm': ['pro', 'flash', 'lite']}, slo_seconds={'llm': 1.0}, min_calls=5,
+                    probe_seconds=0, probe_successes=3)
+    settings.update(options)
+    return ModelRouter(**settings)
+
+
+# A call that started now, after any tier change so far
+def observe_new_call(router, model, seconds, failed=False):
+    router.observe('llm', model, seconds, failed, started=time.monotonic())
+
+
+def test_slo_breach_moves_to_the_next_tier():
+    router = make_router()
+    for _ in range(4):
+        router.observe('llm', 'pro', 2.0, False)
+    assert router.active_tier('llm') == 0   # below min_calls: not judged yet
+    router.observe('llm', 'pro', 2.0, False)
+    assert router.active_tier('llm') == 1
+    assert router.stats()['llm']['demotions'] == 1
+    assert router.route('llm') == ('pro', 'probe')   # probe_seconds=0: the tier above is probed at once
+
+
+def test_error_ratio_breach_moves_to_the_next_tier():
+    router = make_router(max_error_ratio=0.2)
+    for failed in (True, True, False, False, False):
+        router.observe('llm', 'pro', 0.1, failed)
+    assert router.active_tier('llm') == 1
+
+
+def test_good_probes_fail_back():
+    router = make_router()
+    for _ in range(5):
+        router.observe('llm', 'pro', 2.0, False)
+    assert router.active_tier('llm') == 1
+    for _ in range(2):
+        observe_new_call(router, 'pro', 0.2)
+    assert router.active_tier('llm') == 1
+    observe_new_call(router, 'pro', 0.2)
+    assert router.active_tier('llm') == 0
+    assert router.stats()['llm']['failbacks'] == 1
+    assert router.route('llm') == ('pro', 'primary')
+
+
+def test_a_slow_or_failed_probe_restarts_the_streak():
+    router = make_router()
+    for _ in range(5):
+        router.observe('llm', 'pro', 2.0, False)
+    observe_new_call(router, 'pro', 0.2)
+    observe_new_call(router, 'pro', 0.2)
+    observe_new_call(router, 'pro', 1.5)   # over the SLO
+    observe_new_call(router, 'pro', 0.2)
+    observe_new_call(router, 'pro', 0.2, failed=True)
+    observe_new_call(router, 'pro', 0.2)
+    observe_new_call(router, 'pro', 0.2)
+    assert router.active_tier('llm') == 1
+
+
+def test_stale_in_flight_observation_is_ignored():
+    router = make_router()
+    started_before_move = time.monotonic()
+    for _ in range(5):
+        router.observe('llm', 'pro', 2.0, False)
+    assert router.active_tier('llm') == 1
+    # Calls to the old primary that were in flight during the move must not count as probes
+    for _ in range(3):
+        router.observe('llm', 'pro', 0.2, False, started=started_before_move)
+    assert router.active_tier('llm') == 1
+    # ...and a slow call to the fallback that started before the move does not demote it again
+    for _ in range(5):
+        router.observe('llm', 'flash', 2.0, False, started=started_before_move)
+    assert router.active_tier('llm') == 1
+    assert router.stats()['llm']['models']['flash']['calls'] == 0
+
+
+def test_stale_observation_without_a_start_time_uses_its_latency():
+    router = make_router()
+    for _ in range(5):
+        router.observe('llm', 'pro', 2.0, False)
+    time.sleep(0.05)
+    # Took 10s, so it started long before the move
+    router.observe('llm', 'flash', 10.0, False)
+    assert router.stats()['llm']['models']['flash']['calls'] == 0
+
+
+def test_open_breaker_skips_a_tier():
+    router = make_router(is_available=lambda model: model != 'pro')
+    assert router.route('llm') == ('flash', 'fallback')
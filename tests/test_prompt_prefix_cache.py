@@ -0,0 +1,68 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from conversation import PromptPrefixCache
+from resilience import Deadline, current_deadline
+
+
+class FakeCreate:
+    """create_fn stand-in: counts calls, can block on a gate and fail"""
+
+    def __init__(self, fail=False, gate=None):
+        self.fail = fail
+        self.gate = gate
+        self.calls = 0
+
+    def __call__(self, model, config):
+        self.calls += 1
+        if self.gate is not None:
+            self.gate.wait(5)
+        if self.fail:
+            raise RuntimeError("upstream unavailable")
+        return SimpleNamespace(name=f"cachedContents/{self.calls}")
+
+
+def test_concurrent_callers_share_one_creation():
+    gate = threading.Event()
+    create = FakeCreate(gate=gate)
+    cache = PromptPrefixCache(create, "model")
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("scene", "persona"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+    assert create.calls == 1
+    assert results == ["cachedContents/1"] * 4
+    assert cache.get("scene", "persona") == "cachedContents/1"
+
+
+def test_waiting_caller_gives_up_at_its_deadline():
+    gate = threading.Event()
+    cache = PromptPrefixCache(FakeCreate(gate=gate), "model")
+    leader = threading.Thread(target=cache.get, args=("scene", "persona"))
+    leader.start()
+    time.sleep(0.05)
+    token = current_deadline.set(Deadline(0.1))
+    try:
+        started = time.monotonic()
+        assert cache.get("scene", "persona") is None
+        assert time.monotonic() - started < 1
+    finally:
+        current_deadline.reset(token)
+        gate.set()
+        leader.join(5)
+
+
+def test_failed_creation_backs_off():
+    create = FakeCreate(fail=True)
+    cache = PromptPrefixCache(create, "model", retry_seconds=0.2)
+    assert cache.get("scene", "persona") is None
+    assert cache.get("scene", "persona") is None
+    assert create.calls == 1
+    time.sleep(0.25)
+    create.fail = False
+    assert cache.get("scene", "persona") == "cachedContents/2"
@@ -0,0 +1,45 @@
+import threading
+import time
+
+from gemini_backend import RequestSlots
+from resilience import HedgedCaller, QueueTiming, run_timed
+
+
+# A call that holds one of the slots for `seconds`
+def slow_call(slots, seconds):
+    def call():
+        with slots.hold():
+            time.sleep(seconds)
+        return "ok"
+    return call
+
+
+def test_slot_wait_is_not_counted_as_call_latency():
+    slots = RequestSlots(1)
+    caller = HedgedCaller()
+    busy = threading.Thread(target=slow_call(slots, 0.3))
+    busy.start()
+    time.sleep(0.05)
+    queued = QueueTiming()
+    started = time.monotonic()
+    assert run_timed(queued, lambda: caller.call('stt', slow_call(slots, 0.05))) == "ok"
+    elapsed = time.monotonic() - started
+    busy.join()
+    assert queued.seconds > 0.15
+    assert not queued.waiting
+    # The latency the hedger learns from is the call itself, without the wait for the slot
+    observed = caller._trackers['stt']._samples[-1]
+    assert observed < elapsed - 0.15
+
+
+def test_request_queued_for_a_slot_is_not_hedged():
+    slots = RequestSlots(1)
+    caller = HedgedCaller(hedging=True, min_hedge_delay=0.05)
+    for _ in range(20):
+        caller._tracker('llm').observe(0.05)
+    busy = threading.Thread(target=slow_call(slots, 0.4))
+    busy.start()
+    time.sleep(0.05)
+    assert caller.call('llm', slow_call(slots, 0.02)) == "ok"
+    busy.join()
+    assert caller.stats()['llm']['hedged'] == 0
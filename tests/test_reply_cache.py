@@ -0,0 +1,90 @@
+import pytest
+
+from reply_cache import ReplyCache, normalize_transcript
+
+
+# Stores `count` distinct replies to a question
+def fill(cache, memory_id, transcript, count):
+    for n in range(count):
+        cache.store(memory_id, transcript, f"reply {n}", bytes([n]) * 4)
+
+
+def test_normalize_transcript():
+    assert normalize_transcript("  Where am I?!  ") == "where am i"
+    assert normalize_transcript("What's   that...") == "what's that"
+
+
+def test_question_misses_until_it_has_enough_replies():
+    cache = ReplyCache(variety=2)
+    fill(cache, '3', "Where am I?", 1)
+    assert cache.lookup('3', "Where am I?") is None
+    fill(cache, '3', "Where am I?", 2)
+    assert cache.lookup('3', "where am i") is not None
+
+
+def test_hits_rotate_among_the_replies():
+    cache = ReplyCache(variety=3)
+    fill(cache, '3', "Where am I?", 3)
+    texts = [cache.lookup('3', "Where am I?")[0] for _ in range(4)]
+    assert texts == ["reply 0", "reply 1", "reply 2", "reply 0"]
+    assert cache.stats()['hits'] == 4
+
+
+def test_repeated_reply_text_is_stored_once():
+    cache = ReplyCache(variety=2)
+    cache.store('3', "Where am I?", "Somewhere safe.", b"a")
+    cache.store('3', "Where am I?", "Somewhere safe.", b"b")
+    assert cache.lookup('3', "Where am I?") is None
+    assert cache.stats()['stores'] == 1
+
+
+def test_replies_are_kept_per_scene():
+    cache = ReplyCache(variety=1)
+    fill(cache, '3', "Where am I?", 1)
+    assert cache.lookup('2', "Where am I?") is None
+    assert cache.lookup(None, "Where am I?") is None
+    assert cache.lookup('3', "Where am I?") == ("reply 0", b"\x00" * 4)
+
+
+@pytest.mark.parametrize('threshold, hit', [(0.8, True), (0.85, False)])
+def test_token_set_threshold(threshold, hit):
+    cache = ReplyCache(variety=1, match='token_set', threshold=threshold)
+    fill(cache, '3', "where am i right now", 1)
+    # 4 of 5 tokens shared: Jaccard 0.8, and the threshold is inclusive
+    result = cache.lookup('3', "where am i now")
+    assert (result is not None) == hit
+    assert cache.stats()['near_hits' if hit else 'misses'] == 1
+
+
+def test_exact_mode_needs_the_same_normalized_text():
+    cache = ReplyCache(variety=1, match='exact')
+    fill(cache, '3', "Where am I?", 1)
+    assert cache.lookup('3', "where am I") is not None
+    assert cache.lookup('3', "where am I now") is None
+
+
+def test_embedding_mode_matches_near_duplicates_only():
+    cache = ReplyCache(variety=1, match='embedding', threshold=0.8)
+    fill(cache, '3', "where am i right now", 1)
+    assert cache.lookup('3', "where am i right now please") is not None
+    assert cache.lookup('3', "tell me about the lighthouse") is None
+
+
+def test_expired_replies_are_generated_again():
+    cache = ReplyCache(variety=1, ttl_seconds=0)
+    fill(cache, '3', "Where am I?", 1)
+    assert cache.lookup('3', "Where am I?") is None
+
+
+def test_scene_keeps_only_its_most_recent_questions():
+    cache = ReplyCache(variety=1, match='exact', max_questions_per_scene=2)
+    for question in ("one", "two", "three"):
+        fill(cache, '3', question, 1)
+    assert cache.lookup('3', "one") is None
+    assert cache.lookup('3', "three") is not None
+    assert cache.stats()['questions'] == 2
+
+
+def test_unknown_match_mode_is_rejected():
+    with pytest.raises(ValueError):
+        ReplyCache(match='fuzzy')
@@ -0,0 +1,152 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from gemini_backend import PooledBackend, PoolTimeout, RequestSlots
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+# Starts a thread that takes a slot, records `name` and holds it until `release` is set
+def holder(slots, order, name, release):
+    def run():
+        with slots.hold():
+            order.append(name)
+            release.wait(2)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_free_slots_are_taken_without_waiting():
+    slots = RequestSlots(2)
+    slots.acquire()
+    slots.acquire()
+    stats = slots.stats()
+    assert stats['in_use'] == 2 and stats['peak_in_use'] == 2
+    assert stats['acquired'] == 2 and stats['waited'] == 0
+    slots.release()
+    slots.release()
+    assert slots.stats()['in_use'] == 0
+
+
+def test_waiting_requests_get_slots_in_arrival_order():
+    slots = RequestSlots(1)
+    release = threading.Event()
+    order = []
+    slots.acquire()
+    threads = []
+    for name in ("a", "b", "c"):
+        threads.append(holder(slots, order, name, release))
+        wait_until(lambda: slots.stats()['waiting'] == len(threads))
+    release.set()
+    slots.release()
+    for thread in threads:
+        thread.join()
+    assert order == ["a", "b", "c"]
+    stats = slots.stats()
+    assert stats['waited'] == 3
+    assert stats['in_use'] == 0
+    assert stats['peak_in_use'] == 1
+
+
+def test_acquire_times_out_and_the_slot_is_not_lost():
+    slots = RequestSlots(1, acquire_timeout=0.05)
+    slots.acquire()
+    with pytest.raises(PoolTimeout):
+        slots.acquire()
+    assert slots.stats()['timeouts'] == 1
+    # The timed-out waiter is skipped: the released slot is free again
+    slots.release()
+    assert slots.stats()['in_use'] == 0
+    slots.acquire()
+    assert slots.stats()['in_use'] == 1
+
+
+def test_on_wait_gets_every_acquire_wait():
+    waits = []
+    slots = RequestSlots(1, on_wait=waits.append)
+    with slots.hold():
+        pass
+    assert len(waits) == 1 and waits[0] < 0.05
+
+
+def test_threads_and_coroutines_share_the_slots():
+    slots = RequestSlots(1)
+    release = threading.Event()
+    order = []
+    thread = holder(slots, order, "thread", release)
+    wait_until(lambda: order == ["thread"])
+
+    async def run():
+        async with slots.ahold():
+            order.append("coroutine")
+
+    threading.Timer(0.05, release.set).start()
+    asyncio.run(run())
+    thread.join()
+    assert order == ["thread", "coroutine"]
+    assert slots.stats()['in_use'] == 0
+
+
+def test_cancelled_coroutine_gives_up_its_place():
+    slots = RequestSlots(1)
+    slots.acquire()
+
+    async def run():
+        task = asyncio.ensure_future(slots.aacquire())
+        await asyncio.sleep(0.02)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    slots.release()
+    assert slots.stats()['in_use'] == 0
+
+
+def test_async_acquire_times_out():
+    slots = RequestSlots(1, acquire_timeout=0.05)
+    slots.acquire()
+    with pytest.raises(PoolTimeout):
+        asyncio.run(slots.aacquire())
+    slots.release()
+    assert slots.stats()['in_use'] == 0
+
+
+# --- PooledBackend ---
+
+class RecordingBackend:
+    def __init__(self, slots):
+        self.slots = slots
+        self.in_use = []
+        self.name = "recording"
+
+    def generate_content(self, model, contents, config=None):
+        self.in_use.append(self.slots.stats()['in_use'])
+        return "reply"
+
+    def generate_content_stream(self, model, contents, config=None):
+        for word in ("one", "two"):
+            self.in_use.append(self.slots.stats()['in_use'])
+            yield word
+
+
+def test_pooled_backend_holds_a_slot_for_each_call():
+    slots = RequestSlots(2)
+    backend = RecordingBackend(slots)
+    pooled = PooledBackend(backend, slots)
+    assert pooled.generate_content("m", ["Hello"]) == "reply"
+    assert list(pooled.generate_content_stream("m", ["Hello"])) == ["one", "two"]
+    # The slot is held while the call (and the whole stream) runs, then returned
+    assert backend.in_use == [1, 1, 1]
+    assert slots.stats()['in_use'] == 0
+    # Anything else goes straight to the wrapped backend
+    assert pooled.name == "recording"
@@ -0,0 +1,74 @@
+from session_recorder import SessionRecorder, load_recording
+
+
+# Records one short session and returns (recorder, {sid: events}, audio_path) once it is written out
+def record_session(directory, record_audio):
+    recorder = SessionRecorder(str(directory), record_audio=record_audio)
+    recorder.start_session("s1", transport="websocket")
+    recorder.record("s1", "load_memory", memory_id="3")
+    recorder.record("s1", "message", audio=b"\x01" * 6400)
+    recorder.record("s1", "message", audio=b"\x02" * 3200)
+    recorder.record("s1", "turn_end", outcome="ok", ms=812.5)
+    recorder.end_session("s1")
+    recorder.close()
+    sessions, audio_path = load_recording(recorder.events_path)
+    return recorder, sessions, audio_path
+
+
+def test_events_are_read_back_in_order(tmp_path):
+    recorder, sessions, audio_path = record_session(tmp_path, record_audio=False)
+    events = sessions["s1"]
+    assert [event['event'] for event in events] == ["connect", "load_memory", "message", "message",
+                                                   "turn_end", "disconnect"]
+    assert events[0]['transport'] == "websocket"
+    assert events[1]['memory_id'] == "3"
+    assert events[4]['outcome'] == "ok" and events[4]['ms'] == 812.5
+    assert all(event['sid'] == "s1" for event in events)
+    assert [event['ts'] for event in events] == sorted(event['ts'] for event in events)
+    # Without audio recording, chunks are logged by size only
+    assert [event['bytes'] for event in events if event['event'] == 'message'] == [6400, 3200]
+    assert not any('audio' in event for event in events)
+    assert audio_path is None
+    assert recorder.stats()['events'] == 7   # with the file's own header line
+
+
+def test_audio_round_trips_through_the_sidecar(tmp_path):
+    recorder, sessions, audio_path = record_session(tmp_path, record_audio=True)
+    assert audio_path == recorder.audio_path
+    with open(audio_path, "rb") as f:
+        audio = f.read()
+    chunks = [audio[offset:offset + length]
+              for offset, length in (event['audio'] for event in sessions["s1"] if event['event'] == 'message')]
+    assert chunks == [b"\x01" * 6400, b"\x02" * 3200]
+    assert recorder.stats()['audio_bytes'] == 9600
+
+
+def test_unrecorded_sessions_are_left_out(tmp_path):
+    recorder = SessionRecorder(str(tmp_path), sample_rate=0.0)
+    assert not recorder.start_session("s1")
+    recorder.record("s1", "message", audio=b"\x00" * 10)
+    recorder.record("other", "message")
+    recorder.close()
+    sessions, _ = load_recording(recorder.events_path)
+    assert sessions == {}
+    assert recorder.stats()['sessions'] == 0
+
+
+def test_sessions_are_kept_apart(tmp_path):
+    recorder = SessionRecorder(str(tmp_path))
+    recorder.start_session("a")
+    recorder.start_session("b")
+    recorder.record("b", "load_memory", memory_id="2")
+    recorder.record("a", "load_memory", memory_id="3")
+    recorder.close()
+    sessions, _ = load_recording(recorder.events_path)
+    assert [event['memory_id'] for event in sessions["a"][1:]] == ["3"]
+    assert [event['memory_id'] for event in sessions["b"][1:]] == ["2"]
+
+
+def test_a_line_cut_short_is_skipped(tmp_path):
+    recorder, _, _ = record_session(tmp_path, record_audio=False)
+    with open(recorder.events_path, "a") as f:
+        f.write('{"ts":1.0,"sid":"s1","event":"mess')
+    sessions, _ = load_recording(recorder.events_path)
+    assert len(sessions["s1"]) == 6
@@ -0,0 +1,245 @@
+import os
+import threading
+import time
+
+import fakeredis
+import pytest
+
+from audio_store import AudioStore
+from conversation import ConversationHistory
+from state_store import MemoryStateStore, RedisStateStore
+
+
+@pytest.fixture
+def redis_client():
+    client = fakeredis.FakeRedis()
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def redis_store(redis_client):
+    return RedisStateStore(redis_client, session_ttl_seconds=60, audio_ttl_seconds=300, audio_grace_seconds=30)
+
+
+@pytest.fixture
+def memory_store(tmp_path):
+    store = MemoryStateStore(AudioStore(spill_dir=str(tmp_path)), session_ttl_seconds=0.3)
+    yield store
+    store.close()
+
+
+# --- RedisStateStore: sessions ---
+
+class History:
+    def __init__(self, turns):
+        self.turns = turns
+
+    def to_state(self):
+        return {'turns': self.turns}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state['turns'])
+
+
+def test_redis_session_fields_round_trip(redis_client):
+    store = RedisStateStore(redis_client, object_fields={'history': History})
+    store.update_session('s1', {'memory_id': '3', 'history': History(['hi'])})
+    store.update_session('s1', {'input_format': 'pcm16'})
+    session = store.load_session('s1')
+    assert session['memory_id'] == '3'
+    assert session['input_format'] == 'pcm16'
+    assert session['history'].turns == ['hi']
+    store.delete_session('s1')
+    assert store.load_session('s1') is None
+
+
+def test_redis_session_ttl_is_refreshed_by_load_and_audio(redis_client, redis_store):
+    session_key = redis_store._key('session', 's1')
+    redis_store.update_session('s1', {'memory_id': '3'})
+    redis_client.expire(session_key, 5)
+    redis_store.load_session('s1')
+    assert redis_client.ttl(session_key) > 5
+
+    redis_client.expire(session_key, 5)
+    redis_store.reset_buffer('s1')
+    assert redis_store.append_buffer('s1', b"abc")
+    assert redis_client.ttl(session_key) > 5
+
+    redis_client.expire(session_key, 5)
+    redis_store.take_buffer('s1')
+    assert redis_client.ttl(session_key) > 5
+
+
+def test_redis_audio_does_not_revive_an_expired_session(redis_client, redis_store):
+    redis_store.reset_buffer('s1')
+    assert redis_store.append_buffer('s1', b"abc")
+    assert not redis_client.exists(redis_store._key('session', 's1'))
+
+
+# --- RedisStateStore: recording buffers ---
+
+def test_redis_append_without_a_recording_is_undone(redis_client, redis_store):
+    assert not redis_store.append_buffer('s1', b"chunk")
+    assert not redis_store.has_buffer('s1')
+    assert redis_store.take_buffer('s1') is None
+
+
+def test_redis_undo_keeps_a_recording_started_in_between(redis_client, redis_store, monkeypatch):
+    # reset_buffer lands between the append round trip and its undo
+    discard = redis_store._discard_unmarked
+
+    def reset_then_discard(redis_key):
+        redis_store.reset_buffer('s1')
+        discard(redis_key)
+
+    monkeypatch.setattr(redis_store, '_discard_unmarked', reset_then_discard)
+    assert not redis_store.append_buffer('s1', b"late")
+    assert redis_store.has_buffer('s1')
+    assert redis_store.append_buffer('s1', b"new")
+    assert redis_store.take_buffer('s1') == b"new"
+
+
+def test_redis_take_buffer_returns_the_recording_and_starts_an_empty_one(redis_store):
+    redis_store.reset_buffer('s1')
+    for chunk in (b"one ", b"two ", b"three"):
+        assert redis_store.append_buffer('s1', chunk)
+    assert redis_store.take_buffer('s1') == b"one two three"
+    assert redis_store.has_buffer('s1')
+    assert redis_store.take_buffer('s1') == b""
+    assert redis_store.append_buffer('s1', b"four")
+    assert redis_store.take_buffer('s1') == b"four"
+
+
+def test_redis_take_buffer_loses_no_chunk_under_concurrent_appends(redis_store):
+    redis_store.reset_buffer('s1')
+    chunks = [bytes([65 + i % 26]) * 10 for i in range(200)]
+    taken = []
+
+    def append_all():
+        for chunk in chunks:
+            assert redis_store.append_buffer('s1', chunk)
+
+    writer = threading.Thread(target=append_all)
+    writer.start()
+    while writer.is_alive():
+        taken.append(redis_store.take_buffer('s1'))
+    writer.join()
+    taken.append(redis_store.take_buffer('s1'))
+    assert b"".join(taken) == b"".join(chunks)
+
+
+def test_redis_take_buffer_does_not_start_a_recording(redis_store):
+    assert redis_store.take_buffer('s1') is None
+    assert not redis_store.has_buffer('s1')
+
+
+# --- RedisStateStore: reply clips ---
+
+def test_redis_first_read_shortens_the_clip_to_the_grace_window(redis_client, redis_store):
+    redis_store.put_audio('a1', [b"RIFF", b"data"])
+    audio_key = redis_store._key('audio', 'a1')
+    assert redis_client.ttl(audio_key) > 30
+    assert b"".join(redis_store.get_audio('a1')) == b"RIFFdata"
+    assert 0 < redis_client.ttl(audio_key) <= 30
+    # Later reads never lengthen it again
+    redis_client.expire(audio_key, 5)
+    redis_store.get_audio('a1')
+    assert redis_client.ttl(audio_key) <= 5
+
+
+def test_redis_missing_clip_is_a_miss(redis_store):
+    assert redis_store.get_audio('nope') is None
+    assert redis_store.audio_stats()['misses'] == 1
+
+
+def test_redis_clips_by_reference(redis_client, tmp_path):
+    store = RedisStateStore(redis_client, audio_dir=str(tmp_path), audio_ttl_seconds=300, audio_grace_seconds=30)
+    store.put_audio('a1', [b"RIFF", b"data"])
+    fields = redis_client.hgetall(store._key('audio', 'a1'))
+    assert b'data' not in fields
+    assert fields[b'path'].decode() == str(tmp_path / "a1.wav")
+    clip = store.get_audio('a1')
+    assert bytes(clip[0]) == b"RIFFdata"
+    assert store.audio_stats()['bytes_by_reference'] == 8
+
+    # A second put of the same id keeps the file, only refreshing its age
+    store.put_audio('a1', [b"RIFFdata"])
+    assert (tmp_path / "a1.wav").read_bytes() == b"RIFFdata"
+
+    # A swept file is a miss, not an error
+    (tmp_path / "a1.wav").unlink()
+    store.put_audio('a2', b"x")
+    redis_client.hset(store._key('audio', 'a1'), 'path', str(tmp_path / "a1.wav"))
+    assert store.get_audio('a1') is None
+
+
+def test_redis_sweep_removes_only_old_clip_files(redis_client, tmp_path):
+    store = RedisStateStore(redis_client, audio_dir=str(tmp_path), audio_ttl_seconds=10, audio_grace_seconds=5)
+    store.put_audio('old', b"old")
+    store.put_audio('new', b"new")
+    old_time = time.time() - 60
+    os.utime(tmp_path / "old.wav", (old_time, old_time))
+    store.sweep()
+    assert not (tmp_path / "old.wav").exists()
+    assert (tmp_path / "new.wav").exists()
+    assert store.audio_stats()['files_swept'] == 1
+
+
+# --- MemoryStateStore ---
+
+def test_memory_session_expires_without_activity(memory_store):
+    memory_store.update_session('s1', {'memory_id': '3'})
+    assert memory_store.load_session('s1') == {'memory_id': '3'}
+    time.sleep(0.35)
+    assert memory_store.load_session('s1') is None
+
+
+def test_memory_session_ttl_is_refreshed_by_load_and_audio(memory_store):
+    memory_store.update_session('s1', {'memory_id': '3'})
+    memory_store.reset_buffer('s1')
+    for _ in range(4):
+        time.sleep(0.1)
+        assert memory_store.append_buffer('s1', b"x")
+    for _ in range(3):
+        time.sleep(0.1)
+        assert memory_store.load_session('s1') is not None
+    assert memory_store.take_buffer('s1') == b"xxxx"
+
+
+def test_memory_loaded_session_is_a_copy(memory_store):
+    memory_store.update_session('s1', {'memory_id': '3'})
+    memory_store.load_session('s1')['memory_id'] = '4'
+    assert memory_store.load_session('s1') == {'memory_id': '3'}
+
+
+def test_memory_history_is_copied_on_save_and_load(tmp_path):
+    store = MemoryStateStore(AudioStore(spill_dir=str(tmp_path)), object_fields={'history': ConversationHistory})
+    history = ConversationHistory()
+    store.update_session('s1', {'history': history})
+    history.add_turn("saved later?", "no")
+    loaded = store.load_session('s1')['history']
+    loaded.add_turn("where am I?", "Somewhere safe.")
+    assert store.load_session('s1')['history'].turns == []
+    store.update_session('s1', {'history': loaded})
+    assert store.load_session('s1')['history'].turns == [("where am I?", "Somewhere safe.")]
+    store.close()
+
+
+def test_memory_buffers(memory_store):
+    assert not memory_store.append_buffer('s1', b"chunk")
+    assert memory_store.take_buffer('s1') is None
+    memory_store.reset_buffer('s1')
+    assert memory_store.append_buffer('s1', b"one ")
+    assert memory_store.append_buffer('s1', b"two")
+    assert memory_store.take_buffer('s1') == b"one two"
+    assert memory_store.take_buffer('s1') == b""
+    memory_store.delete_buffer('s1')
+    assert not memory_store.has_buffer('s1')
+
+
+def test_memory_clips_go_through_the_audio_store(memory_store):
+    memory_store.put_audio('a1', [b"RIFF", b"data"])
+    assert b"".join(bytes(part) for part in memory_store.get_audio('a1')) == b"RIFFdata"
+    assert memory_store.audio_stats()['entries'] == 1
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from turn_scheduler import SessionQueues, TurnScheduler
+
+
+# A turn that records its name when it runs
+def recorder(ran, name):
+    def turn(token):
+        ran.append(name)
+    return turn
+
+
+# A turn that holds its worker until released (or cancelled)
+def blocker(release, started=None):
+    def turn(token):
+        if started is not None:
+            started.set()
+        while not release.wait(0.01):
+            token.raise_if_cancelled()
+    return turn
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+# --- SessionQueues ---
+
+def test_session_queues_serve_sessions_round_robin():
+    queues = SessionQueues()
+    for item in ("a1", "a2", "a3"):
+        queues.push("a", item)
+    queues.push("b", "b1")
+    queues.push("c", "c1")
+    assert len(queues) == 5
+    assert [queues.pop()[1] for _ in range(5)] == ["a1", "b1", "c1", "a2", "a3"]
+    assert not queues
+
+
+def test_session_queues_drop_removes_only_that_session():
+    queues = SessionQueues()
+    queues.push("a", "a1")
+    queues.push("b", "b1")
+    queues.push("a", "a2")
+    assert queues.drop("a") == ["a1", "a2"]
+    assert queues.drop("a") == []
+    assert len(queues) == 1
+    assert queues.pop() == ("b", "b1")
+
+
+# --- TurnScheduler ---
+
+def test_busy_session_does_not_starve_the_others():
+    scheduler = TurnScheduler(max_concurrent=1, max_queued=10)
+    release, started = threading.Event(), threading.Event()
+    ran = []
+    scheduler.submit("x", blocker(release, started))
+    started.wait(1)
+    for sid, name in (("a", "a1"), ("a", "a2"), ("b", "b1"), ("c", "c1"), ("a", "a3")):
+        scheduler.submit(sid, recorder(ran, name))
+    release.set()
+    wait_until(lambda: len(ran) == 5)
+    assert ran == ["a1", "b1", "c1", "a2", "a3"]
+    wait_until(lambda: scheduler.stats()['completed'] == 6)
+
+
+def test_full_queue_rejects_turns():
+    scheduler = TurnScheduler(max_concurrent=1, max_queued=2)
+    release, started = threading.Event(), threading.Event()
+    scheduler.submit("x", blocker(release, started))
+    started.wait(1)
+    ran = []
+    assert scheduler.submit("a", recorder(ran, "a1"))[1] == 1
+    assert scheduler.submit("b", recorder(ran, "b1"))[1] == 2
+    assert scheduler.submit("c", recorder(ran, "c1")) == (None, None)
+    assert scheduler.stats()['rejected'] == 1
+    release.set()
+    wait_until(lambda: len(ran) == 2)
+
+
+def test_cancel_stops_the_running_turn_and_drops_queued_ones():
+    scheduler = TurnScheduler(max_concurrent=1, max_queued=10)
+    never, started = threading.Event(), threading.Event()
+    running_token, _ = scheduler.submit("a", blocker(never, started))
+    started.wait(1)
+    ran = []
+    queued_token, _ = scheduler.submit("a", recorder(ran, "a2"))
+    scheduler.submit("b", recorder(ran, "b1"))
+    assert scheduler.cancel("a") == 2
+    assert running_token.cancelled and queued_token.cancelled
+    # The worker is free again and only the other session's turn runs
+    wait_until(lambda: ran == ["b1"])
+    wait_until(lambda: scheduler.stats()['completed'] == 1)
+    stats = scheduler.stats()
+    assert stats['cancelled'] == 2
+    assert stats['failed'] == 0
+
+
+def test_failed_turn_is_counted_and_the_worker_keeps_going():
+    scheduler = TurnScheduler(max_concurrent=1, max_queued=10)
+    ran = []
+
+    def failing(token):
+        raise RuntimeError("boom")
+
+    scheduler.submit("a", failing)
+    scheduler.submit("a", recorder(ran, "a2"))
+    wait_until(lambda: ran == ["a2"])
+    wait_until(lambda: scheduler.stats()['completed'] == 1)
+    assert scheduler.stats()['failed'] == 1
+
@@ -0,0 +1,160 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# =================================================================
+# Content-addressed TTS cache
+# =================================================================
+# Rendered speech is keyed by everything that changes the output audio:
+# the text, the voice, the TTS model and the sample rate. Entries live in
+# a small in-memory LRU in front of a persistent on-disk store, so scene
+# intros survive restarts and only ever get synthesized once.
+
+
+def make_tts_key(text: str, voice: str, model: str, sample_rate: int) -> str:
+    """Stable content hash for one TTS rendering"""
+    payload = json.dumps([text, voice, model, sample_rate], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    def __init__(self, cache_dir: str = None, max_memory_entries: int = 64):
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self._memory = OrderedDict()   # key -> PCM bytes, most recent last
+        self._inflight = {}            # key -> Future shared by concurrent callers
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'evictions': 0,
+            'errors': 0,
+        }
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    # --- Memory tier ---
+
+    def _memory_get(self, key):
+        pcm = self._memory.get(key)
+        if pcm is not None:
+            self._memory.move_to_end(key)
+        return pcm
+
+    def _memory_put(self, key, pcm):
+        self._memory[key] = pcm
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    # --- Disk tier ---
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pcm")
+
+    def _disk_get(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f"Warning: Could not read TTS cache entry {key[:12]}: {e}")
+            return None
+
+    def _disk_put(self, key, pcm):
+        if not self.cache_dir:
+            return
+        # Write to a temp file first so a crash never leaves a truncated entry
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(pcm)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not write TTS cache entry {key[:12]}: {e}")
+
+    # --- Public API ---
+
+    def get(self, key):
+        """Return cached PCM for key (memory, then disk) or None"""
+        with self._lock:
+            pcm = self._memory_get(key)
+            if pcm is not None:
+                self._stats['memory_hits'] += 1
+                return pcm
+        pcm = self._disk_get(key)
+        if pcm is not None:
+            with self._lock:
+                self._stats['disk_hits'] += 1
+                self._memory_put(key, pcm)
+        return pcm
+
+    def get_or_render(self, text: str, voice: str, model: str, sample_rate: int, render_fn):
+        """
+        Return PCM for (text, voice, model, sample_rate), calling render_fn(text)
+        only on a miss. Concurrent callers asking for the same key while it is
+        being rendered wait on the first caller's result instead of issuing
+        their own TTS request.
+        """
+        key = make_tts_key(text, voice, model, sample_rate)
+        pcm = self.get(key)
+        if pcm is not None:
+            return pcm
+
+        with self._lock:
+            # Re-check under the lock: another thread may have just finished
+            pcm = self._memory_get(key)
+            if pcm is not None:
+                self._stats['memory_hits'] += 1
+                return pcm
+            future = self._inflight.get(key)
+            if future is not None:
+                self._stats['coalesced'] += 1
+                owner = False
+            else:
+                future = Future()
+                self._inflight[key] = future
+                self._stats['misses'] += 1
+                owner = True
+
+        if not owner:
+            return future.result()
+
+        try:
+            pcm = render_fn(text)
+        except BaseException as e:
+            with self._lock:
+                self._stats['errors'] += 1
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+
+        if pcm:
+            self._disk_put(key, pcm)
+        with self._lock:
+            if pcm:
+                self._memory_put(key, pcm)
+            del self._inflight[key]
+        future.set_result(pcm)
+        return pcm
+
+    def stats(self):
+        """Snapshot of hit/miss counters and current sizes"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot['memory_entries'] = len(self._memory)
+            snapshot['inflight'] = len(self._inflight)
+        lookups = snapshot['memory_hits'] + snapshot['disk_hits'] + snapshot['misses'] + snapshot['coalesced']
+        hits = lookups - snapshot['misses']
+        snapshot['hit_ratio'] = round(hits / lookups, 4) if lookups else 0.0
+        return snapshot
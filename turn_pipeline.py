@@ -0,0 +1,280 @@
+import re
+import time
+import logging
+from contextlib import contextmanager
+
+from google.api_core.exceptions import GoogleAPICallError
+
+import metrics
+from audio_codec import encode_pcm
+from resilience import Deadline, DeadlineExceeded, CircuitOpen, current_deadline, is_retryable_error
+from startup import LazyModule
+
+genai_errors = LazyModule('google.genai.errors')
+
+log = logging.getLogger("chatbot")
+
+# =================================================================
+# Turn pipeline pieces shared by both servers
+# =================================================================
+# server.py runs a turn on a scheduler thread and server_async.py as a
+# coroutine, so each keeps its own run_turn and sends through its own
+# Socket.IO server. What a turn decides is the same in both and lives here:
+# the turn's metrics and deadline scope, how a failure is answered, how a
+# streamed reply is cut into sentences and tracked, how pushed audio is
+# encoded, and how /audio answers Range and ETag requests. Nothing here
+# does I/O or waits, so both servers call it directly.
+
+
+# =================================================================
+# Turn scope
+# =================================================================
+
+# Tags every span recorded inside it with the turn's sid and memory_id, gives
+# the turn's Gemini calls one deadline counted from turn_started (stop_stream),
+# and records the 'queue_wait' and 'turn' spans and the 'turn_end' event
+# (through the server's record_event). Yields a dict whose 'outcome' the turn
+# sets; it stays 'error' unless the turn says otherwise.
+@contextmanager
+def turn_scope(sid, memory_id, turn_started, deadline_seconds, record_event):
+    context_token = metrics.turn_context.set(metrics.new_turn_context(sid, memory_id))
+    deadline_token = current_deadline.set(
+        Deadline(deadline_seconds, started_at=turn_started) if deadline_seconds > 0 else None)
+    metrics.record_span('queue_wait', time.monotonic() - turn_started)
+    turn = {'outcome': 'error'}
+    try:
+        yield turn
+    finally:
+        turn_seconds = time.monotonic() - turn_started
+        turn_context = metrics.turn_context.get()
+        metrics.record_span('turn', turn_seconds, retries=turn_context['retries'], outcome=turn['outcome'],
+                            routes=turn_context['routes'])
+        record_event(sid, 'turn_end', outcome=turn['outcome'], ms=round(turn_seconds * 1000, 1),
+                     routes=turn_context['routes'])
+        current_deadline.reset(deadline_token)
+        metrics.turn_context.reset(context_token)
+
+
+# Decides how a failed turn is answered and logs it. Returns (outcome,
+# fallback_reason, status_message): a turn out of its deadline, stopped by an
+# open breaker or still failing upstream after its retries gets the fallback
+# line (fallback_reason set); any other failure gets a status message.
+def classify_turn_error(sid, error, turn_started):
+    if isinstance(error, (DeadlineExceeded, CircuitOpen)):
+        reason = 'deadline' if isinstance(error, DeadlineExceeded) else 'circuit_open'
+        log.warning("[%s] Answering with the fallback line (%s) after %.2fs", sid, reason,
+                    time.monotonic() - turn_started)
+        return 'fallback', reason, None
+    if isinstance(error, (GoogleAPICallError, genai_errors.APIError)):
+        log.error("[%s] API Error: %s", sid, error)
+        if is_retryable_error(error):
+            # Still failing when retries stopped: say something in character rather than nothing
+            return 'fallback', 'upstream_error', None
+        return 'error', None, 'Service temporarily unavailable. Please try again.'
+    log.error("[%s] Error: %s", sid, error)
+    return 'error', None, 'Server processing error.'
+
+
+# The fallback line's audio, from the TTS cache (it is pre-rendered with the
+# scene intros, so no Gemini call is needed); None sends the text only
+def fallback_audio(sid, reason, tts_cache, tts_key):
+    metrics.turn_fallbacks.inc(reason=reason)
+    pcm_bytes = tts_cache.get(tts_key)
+    if pcm_bytes is None:
+        log.warning("[%s] Fallback line is not in the TTS cache; sending text only", sid)
+    return pcm_bytes
+
+
+# =================================================================
+# Streamed replies
+# =================================================================
+
+# Matches the end of a sentence: terminal punctuation (optionally followed by
+# closing quotes/brackets) and then whitespace
+SENTENCE_END_RE = re.compile(r'[.!?…]+["\')\]”’]*\s+')
+
+
+# Splits buffered LLM text into complete sentences and the unfinished remainder
+def split_sentences(buffer: str, min_chars: int):
+    sentences = []
+    start = 0
+    for match in SENTENCE_END_RE.finditer(buffer):
+        candidate = buffer[start:match.end()].strip()
+        if len(candidate) >= min_chars:
+            sentences.append(candidate)
+            start = match.end()
+    return sentences, buffer[start:]
+
+
+class SentenceStream:
+    """
+    Cuts a streamed LLM reply into sentences for TTS: feed() each text chunk
+    and synthesize the sentences it returns, then finish() for the rest.
+    Records 'llm_first_text' and 'llm_stream' spans unless the reply is only
+    replayed (fused mode already generated it).
+    """
+
+    def __init__(self, prompt: str, min_chars: int, replayed: bool = False):
+        self.prompt_bytes = len(prompt.encode())
+        self.min_chars = min_chars
+        self.replayed = replayed
+        self._chunks = []
+        self._buffer = ""
+        self._started = time.perf_counter()
+
+    def feed(self, chunk_text):
+        if not self._chunks and not self.replayed:
+            metrics.record_span('llm_first_text', time.perf_counter() - self._started, bytes_in=self.prompt_bytes)
+        self._chunks.append(chunk_text)
+        self._buffer += chunk_text
+        sentences, self._buffer = split_sentences(self._buffer, self.min_chars)
+        return sentences
+
+    def finish(self):
+        tail = self._buffer.strip()
+        self._buffer = ""
+        if not self.replayed:
+            # Covers the whole stream, including the TTS overlapped with it
+            metrics.record_span('llm_stream', time.perf_counter() - self._started, bytes_in=self.prompt_bytes,
+                                bytes_out=len(self.text.encode()))
+        return [tail] if tail else []
+
+    @property
+    def text(self):
+        return "".join(self._chunks).strip()
+
+
+class SegmentProgress:
+    """
+    Tracks the segments of a streamed reply as they are sent: add() numbers
+    each synthesized sentence (None for one without audio, which is skipped),
+    and complete() gives the 'audio_complete' payload.
+    """
+
+    def __init__(self, sid, turn_started):
+        self.sid = sid
+        self.turn_started = turn_started
+        self.audio = []   # PCM of each sent segment, in order
+        self.first_audio_at = None
+        self._sentences = 0
+
+    def add(self, pcm_bytes):
+        sentence_index = self._sentences
+        self._sentences += 1
+        if not pcm_bytes:
+            log.warning("[%s] No TTS audio for segment %d", self.sid, sentence_index)
+            return None
+        if self.first_audio_at is None:
+            self.first_audio_at = time.monotonic()
+            log.debug("[%s] Time to first audio: %.2fs", self.sid, self.first_audio_at - self.turn_started)
+        self.audio.append(pcm_bytes)
+        return len(self.audio) - 1
+
+    def complete(self):
+        total_latency = time.monotonic() - self.turn_started
+        log.debug("[%s] Streamed %d segments, total latency: %.2fs", self.sid, len(self.audio), total_latency)
+        return {
+            'segments': len(self.audio),
+            'time_to_first_audio': (self.first_audio_at - self.turn_started) if self.first_audio_at else None,
+            'total_latency': total_latency
+        }
+
+
+# =================================================================
+# Reply audio
+# =================================================================
+
+# Encodes a reply clip for a session that asked for pushed audio and returns
+# the message fields that carry it (merged into the event's payload)
+def pushed_audio_fields(audio_id, pcm_bytes, source_rate, delivery, bitrate, ffmpeg_path):
+    with metrics.span('encode', bytes_in=len(pcm_bytes), format=delivery['format']) as encode_span:
+        data = encode_pcm(pcm_bytes, source_rate, delivery['format'], delivery['sample_rate'],
+                          bitrate=bitrate, ffmpeg_path=ffmpeg_path)
+        encode_span['bytes_out'] = len(data)
+    return {'audio_id': audio_id, 'duration': len(pcm_bytes) / (source_rate * 2), 'format': delivery['format'],
+            'sample_rate': delivery['sample_rate'], 'data': data}
+
+
+# Parses a single-range "bytes=..." header into an inclusive (start, end),
+# None for a missing/unsupported header (serve everything), or False if unsatisfiable
+def parse_range_header(range_header, total_size):
+    if not range_header or not range_header.startswith('bytes=') or ',' in range_header:
+        return None
+    start_str, _, end_str = range_header[len('bytes='):].strip().partition('-')
+    try:
+        if start_str == '':
+            # Suffix range: the last N bytes
+            suffix = int(end_str)
+            if suffix <= 0:
+                return False
+            return max(0, total_size - suffix), total_size - 1
+        start = int(start_str)
+        end = int(end_str) if end_str else total_size - 1
+    except ValueError:
+        return None
+    if start >= total_size or end < start:
+        return False
+    return start, min(end, total_size - 1)
+
+
+# Answers a GET of a stored clip from its request headers. Returns (status,
+# headers, byte_range): 304 when the client's copy is current, 416 for an
+# unsatisfiable range (byte_range None for both, no body), else 200 or 206
+# with the inclusive (start, end) to send.
+def plan_audio_response(audio_id, total_size, if_none_match=None, range_header=None, if_range=None):
+    # Clip content never changes for a given id, so the id is a strong validator
+    etag = f'"{audio_id}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': 'no-cache',  # may be cached, but must revalidate
+        'Accept-Ranges': 'bytes',
+    }
+    if etag in (if_none_match or ''):
+        return 304, headers, None
+
+    byte_range = parse_range_header(range_header, total_size)
+    # If-Range: only honour the range when the client's copy is still current
+    if if_range and if_range != etag:
+        byte_range = None
+    if byte_range is False:
+        headers['Content-Range'] = f'bytes */{total_size}'
+        return 416, headers, None
+
+    if byte_range is None:
+        status, (start, end) = 200, (0, total_size - 1)
+    else:
+        status, (start, end) = 206, byte_range
+        headers['Content-Range'] = f'bytes {start}-{end}/{total_size}'
+    headers['Content-Length'] = str(end - start + 1)
+    headers['Content-Type'] = 'audio/wav'
+    return status, headers, (start, end)
+
+
+# Yields [start, end] of a clip stored as several buffers, in chunks, without joining them.
+# WSGI servers only accept bytes, so each chunk (not the whole clip) is copied out of its view.
+def iter_buffer_range(parts, start, end, chunk_size):
+    offset = 0
+    for part in parts:
+        view = memoryview(part)
+        part_start, part_end = offset, offset + len(view)
+        offset = part_end
+        if part_end <= start:
+            continue
+        if part_start > end:
+            break
+        lo = max(start, part_start) - part_start
+        hi = min(end + 1, part_end) - part_start
+        for pos in range(lo, hi, chunk_size):
+            yield bytes(view[pos:min(pos + chunk_size, hi)])
+
+
+# Yields the response body chunks and records an 'audio_fetch' span once the body is sent
+def iter_with_fetch_span(chunks, fetch_started, audio_id, status):
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.record_span('audio_fetch', time.perf_counter() - fetch_started, bytes_out=sent,
+                            audio_id=audio_id, status=status)
@@ -0,0 +1,151 @@
+import logging
+import threading
+from collections import OrderedDict, deque
+
+# =================================================================
+# Turn scheduler
+# =================================================================
+# Conversation turns (STT -> LLM -> TTS) run on a fixed set of worker
+# threads instead of the Socket.IO handler thread. The number of turns
+# hitting Gemini at once is capped, waiting turns are kept in a bounded
+# queue, sessions are served round-robin so one chatty client cannot
+# starve the others, and a session's work can be cancelled at any time.
+
+log = logging.getLogger("chatbot.turns")
+
+
+class TurnCancelled(Exception):
+    """Raised inside a turn once its session has cancelled it"""
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TurnCancelled()
+
+
+class SessionQueues:
+    """
+    Waiting turns kept per session and served round-robin: pop() takes one
+    turn from the front session, then moves that session to the back if it
+    still has turns waiting. Not locked; the scheduler using it serializes access.
+    """
+
+    def __init__(self):
+        self._queues = OrderedDict()   # sid -> deque of items; front sid is served next
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def push(self, sid, item):
+        self._queues.setdefault(sid, deque()).append(item)
+        self._count += 1
+
+    def pop(self):
+        sid, queue = next(iter(self._queues.items()))
+        item = queue.popleft()
+        del self._queues[sid]
+        if queue:
+            self._queues[sid] = queue
+        self._count -= 1
+        return sid, item
+
+    def drop(self, sid):
+        """Remove and return the items waiting for sid"""
+        queue = self._queues.pop(sid, None) or ()
+        self._count -= len(queue)
+        return list(queue)
+
+
+class TurnScheduler:
+    def __init__(self, max_concurrent: int = 8, max_queued: int = 32):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self._queues = SessionQueues()   # (fn, token) per session, served round-robin
+        self._running = {}             # sid -> list of tokens for turns in flight
+        self._running_count = 0
+        self._cond = threading.Condition()
+        self._stats = {'submitted': 0, 'rejected': 0, 'cancelled': 0, 'completed': 0, 'failed': 0}
+        for i in range(max_concurrent):
+            threading.Thread(target=self._worker, name=f"turn-worker-{i}", daemon=True).start()
+
+    def submit(self, sid, fn):
+        """
+        Queue fn(token) for session sid.
+        Returns (token, position): position is 0 when a worker is free right
+        away, N when N turns are waiting ahead of or alongside it, or None
+        (with token None) when the queue is full and the turn was rejected.
+        """
+        with self._cond:
+            idle_workers = self.max_concurrent - self._running_count
+            if len(self._queues) >= self.max_queued + idle_workers:
+                self._stats['rejected'] += 1
+                return None, None
+            token = CancelToken()
+            self._queues.push(sid, (fn, token))
+            self._stats['submitted'] += 1
+            position = max(0, len(self._queues) - idle_workers)
+            self._cond.notify()
+            return token, position
+
+    def cancel(self, sid):
+        """Drop queued turns for sid and signal its in-flight turns to stop"""
+        with self._cond:
+            queued = self._queues.drop(sid)
+            dropped = len(queued)
+            for _, token in queued:
+                token.cancel()
+            running = self._running.get(sid, [])
+            for token in running:
+                token.cancel()
+            self._stats['cancelled'] += dropped + len(running)
+            return dropped + len(running)
+
+    def stats(self):
+        with self._cond:
+            snapshot = dict(self._stats)
+            snapshot['queued'] = len(self._queues)
+            snapshot['running'] = self._running_count
+            snapshot['max_concurrent'] = self.max_concurrent
+            snapshot['max_queued'] = self.max_queued
+        return snapshot
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queues:
+                    self._cond.wait()
+                sid, (fn, token) = self._queues.pop()
+                self._running.setdefault(sid, []).append(token)
+                self._running_count += 1
+
+            outcome = 'completed'
+            try:
+                token.raise_if_cancelled()
+                fn(token)
+            except TurnCancelled:
+                outcome = None   # already counted by cancel()
+            except Exception as e:
+                outcome = 'failed'
+                log.error("[%s] Turn failed: %s", sid, e)
+            finally:
+                with self._cond:
+                    running = self._running.get(sid, [])
+                    if token in running:
+                        running.remove(token)
+                    if not running:
+                        self._running.pop(sid, None)
+                    self._running_count -= 1
+                    if outcome:
+                        self._stats[outcome] += 1